@@ -1,70 +1,231 @@
-from flask import Flask, render_template, request, jsonify, send_from_directory, redirect, url_for, session
+from flask import Flask, render_template, request, jsonify, send_from_directory, redirect, url_for, session, g
 from werkzeug.utils import secure_filename
-from PIL import Image
+from werkzeug.security import safe_join
 import os
 from pathlib import Path
-import sqlite3
 from os import environ as env
-from authlib.integrations.flask_client import OAuth
 from dotenv import load_dotenv, find_dotenv
 from urllib.parse import quote_plus, urlencode
 from functools import wraps
+from collections import Counter
+import base64
+import hashlib
+from itertools import combinations
+import pickle
+import random
+import re
+import threading
+import time
 
 from main import (
     init_db,
+    load_indexes,
+    index_listeners,
+    find_similar_hashes,
+    find_nearest_color_hash,
     store_image_hashes,
+    store_image_hashes_batch,
     verify_image_colors,
     generate_color_uuid_from_hash,
-    phash_dhash_combo,
-    create_color_bar,
-    COLOR_TOLERANCE,
-    REQUIRED_MATCH_PERCENT,
-    JPG_QUALITY,
-    decode_url_to_colors
+    compare_bar_colors,
+    decode_url_to_colors,
+    color_hash_to_bytes,
+    bytes_to_color_hash,
+    bytes_to_colors,
+    process_upload,
+    open_upload,
+    decode_upload,
+    decode_rgb,
+    is_animated,
+    sample_animation_colors,
+    ImageTooLarge,
+    make_derivatives,
+    derivative_filename,
+    DERIVATIVE_WIDTHS,
+    HASH_BITS,
+    HASH_MATCH_DISTANCE,
+    NEAR_MATCH_CANDIDATES,
+    MAX_IMAGE_PIXELS,
+    MAX_ANIMATION_FRAMES,
+    MAX_ANIMATION_PIXELS,
+    MAX_IMAGES_TO_PROCESS
 )
+from cache import TTLCache
+from jobs import JOB_QUEUE_SIZE, JobQueue, QueueFull
+from locator import locate_color_bar_candidates, read_located_colors
+import metrics
+import storage
 
 app = Flask(__name__)
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024
 app.config['UPLOAD_FOLDER'] = 'temp_uploads'
 app.config['OUTPUT_FOLDER'] = 'images/output'
+# Refused from the image header before decoding: an RGB image takes 3 bytes per pixel
+app.config['MAX_IMAGE_PIXELS'] = int(env.get('MAX_IMAGE_PIXELS', MAX_IMAGE_PIXELS))
+# Animations are re-encoded frame by frame, so their length is capped too
+app.config['MAX_ANIMATION_FRAMES'] = int(env.get('MAX_ANIMATION_FRAMES', MAX_ANIMATION_FRAMES))
+app.config['MAX_ANIMATION_PIXELS'] = int(env.get('MAX_ANIMATION_PIXELS', MAX_ANIMATION_PIXELS))
+
+def upload_limits():
+    """(max_pixels, max_frames, max_animation_pixels) for open_upload and process_upload."""
+    return app.config['MAX_IMAGE_PIXELS'], app.config['MAX_ANIMATION_FRAMES'], app.config['MAX_ANIMATION_PIXELS']
 
 # Ensure necessary directories exist
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 os.makedirs(app.config['OUTPUT_FOLDER'], exist_ok=True)
 
-# Initialize the database on startup
-init_db()
+# Importing this module touches no database, so a new worker is ready as
+# soon as its imports finish. The schema is set up by an explicit step
+# (flask --app app migrate, or python app.py); the in-memory indexes are
+# filled on the first request. After that, hashes stored by other worker
+# processes or bulk.py are added at most INDEX_REFRESH_SECONDS later.
+app.config['INDEX_REFRESH_SECONDS'] = float(env.get('INDEX_REFRESH_SECONDS', 2))
+indexes_refreshed = None    # time.monotonic() of the last load_indexes()
+indexes_lock = threading.Lock()
+
+@app.before_request
+def refresh_indexes():
+    global indexes_refreshed
+    if indexes_refreshed is not None and time.monotonic() - indexes_refreshed < app.config['INDEX_REFRESH_SECONDS']:
+        return
+    with indexes_lock:
+        if indexes_refreshed is None:
+            version = storage.schema_version()
+            if version < storage.SCHEMA_VERSION:
+                raise RuntimeError(f"Database schema is at version {version} of {storage.SCHEMA_VERSION}; "
+                                   "run 'flask --app app migrate' first")
+            load_indexes()
+        elif time.monotonic() - indexes_refreshed >= app.config['INDEX_REFRESH_SECONDS']:
+            load_indexes()
+        indexes_refreshed = time.monotonic()
+
+@app.cli.command('migrate')
+def migrate_command():
+    """Create or upgrade the database schema."""
+    init_db()
+    print(f"Database schema at version {storage.schema_version()}")
 
 # Load .env file
 load_dotenv()
 
-# Auth0 config
-oauth = OAuth(app)
-oauth.register(
-    "auth0",
-    client_id=env.get("AUTH0_CLIENT_ID"),
-    client_secret=env.get("AUTH0_CLIENT_SECRET"),
-    client_kwargs={
-        "scope": "openid profile email",
-    },
-    server_metadata_url=f'https://{env.get("AUTH0_DOMAIN")}/.well-known/openid-configuration'
-)
+# Auth0 config, built on first login: authlib alone takes longer to import
+# than the rest of the app
+oauth = None
+
+def get_oauth():
+    global oauth
+    if oauth is None:
+        from authlib.integrations.flask_client import OAuth
+        oauth = OAuth(app)
+        oauth.register(
+            "auth0",
+            client_id=env.get("AUTH0_CLIENT_ID"),
+            client_secret=env.get("AUTH0_CLIENT_SECRET"),
+            client_kwargs={
+                "scope": "openid profile email",
+            },
+            server_metadata_url=f'https://{env.get("AUTH0_DOMAIN")}/.well-known/openid-configuration'
+        )
+    return oauth
+
+# Async /process: uploads go to a bounded queue served by a process pool,
+# which /process/batch shares. Job state is per server process: run a
+# single worker process, or route each client to one worker, or a status
+# poll that reaches another worker gets 404 for a job that exists.
+app.config['PROCESS_ASYNC'] = env.get('PROCESS_ASYNC', '0') == '1'
+app.config['PROCESS_WORKERS'] = int(env.get('PROCESS_WORKERS', os.cpu_count() or 1))
+app.config['PROCESS_QUEUE_SIZE'] = int(env.get('PROCESS_QUEUE_SIZE', JOB_QUEUE_SIZE))
+job_queue = None
+
+def get_job_queue():
+    """Create the worker pool on first use so sync-only deployments never fork."""
+    global job_queue
+    if job_queue is None:
+        job_queue = JobQueue(app.config['PROCESS_WORKERS'], app.config['PROCESS_QUEUE_SIZE'])
+    return job_queue
+
+# srcset derivatives of new output images: their own small thread pool, so
+# sync /process never starts the process pool and derivatives never take
+# the slots async uploads are refused for. Pillow releases the GIL while
+# resizing and encoding. Skipped ones are counted; bulk.py derivatives
+# backfills them.
+app.config['DERIVATIVE_WORKERS'] = int(env.get('DERIVATIVE_WORKERS', 1))
+app.config['DERIVATIVE_QUEUE_SIZE'] = int(env.get('DERIVATIVE_QUEUE_SIZE', 64))
+derivative_queue = JobQueue(app.config['DERIVATIVE_WORKERS'], app.config['DERIVATIVE_QUEUE_SIZE'], threads=True)
+
+# /user/<id> galleries: keyset-paginated pages, rendered pages cached
+app.config['GALLERY_PAGE_SIZE'] = int(env.get('GALLERY_PAGE_SIZE', 48))
+app.config['GALLERY_MAX_PAGE_SIZE'] = int(env.get('GALLERY_MAX_PAGE_SIZE', 200))
+app.config['GALLERY_CACHE_SIZE'] = int(env.get('GALLERY_CACHE_SIZE', 1024))
+app.config['GALLERY_CACHE_TTL'] = float(env.get('GALLERY_CACHE_TTL', 30))  # How stale view totals may get
+gallery_cache = TTLCache(app.config['GALLERY_CACHE_SIZE'], app.config['GALLERY_CACHE_TTL'])
+# Part of each cached page's key: bumped for every row load_indexes sees
+# stored, so an upload retires its user's pages without a query per view
+gallery_versions = Counter()
+
+# /images/output files are named by their content, so clients and CDNs may
+# keep them for good. USE_X_SENDFILE hands the file to nginx/Apache instead
+# of streaming it from Python (Flask reads this key itself).
+app.config['IMAGE_MAX_AGE'] = int(env.get('IMAGE_MAX_AGE', 365 * 24 * 3600))
+app.config['USE_X_SENDFILE'] = env.get('USE_X_SENDFILE', '0') == '1'
+image_etags = TTLCache(max_entries=int(env.get('IMAGE_ETAG_CACHE_SIZE', 65536)))
+
+# /verify caches: identical uploads skip decoding and hashing, repeated
+# (perceptual_hash, color_hash) pairs skip the DB lookups. New hashes evict
+# the lookups they change as they reach the in-memory indexes, within
+# INDEX_REFRESH_SECONDS for another worker's; VERIFY_LOOKUP_TTL bounds
+# anything else.
+app.config['VERIFY_CACHE_SIZE'] = int(env.get('VERIFY_CACHE_SIZE', 10000))
+app.config['VERIFY_CACHE_BYTES'] = int(env.get('VERIFY_CACHE_BYTES', 32 * 1024 * 1024))
+app.config['VERIFY_UPLOAD_TTL'] = float(env.get('VERIFY_UPLOAD_TTL', 3600))
+app.config['VERIFY_LOOKUP_TTL'] = float(env.get('VERIFY_LOOKUP_TTL', 60))
+upload_cache = TTLCache(app.config['VERIFY_CACHE_SIZE'], app.config['VERIFY_UPLOAD_TTL'],
+                        max_bytes=app.config['VERIFY_CACHE_BYTES'], weigh=lambda features: len(pickle.dumps(features)))
+registration_cache = TTLCache(app.config['VERIFY_CACHE_SIZE'], app.config['VERIFY_LOOKUP_TTL'])
+# XOR masks taking a hash to each of its neighbours within HASH_MATCH_DISTANCE
+near_masks = [sum(1 << bit for bit in bits)
+              for distance in range(HASH_MATCH_DISTANCE + 1) for bits in combinations(range(HASH_BITS), distance)]
+REGISTRATION_EVICT_ROWS = 64  # Larger batches of new rows clear registration_cache instead
+
+# /verify's last resort, searching the bottom-right corner for a moved or
+# rescaled bar, costs 50-200 ms on a 4K upload and runs for every upload
+# that fails the fixed-position checks, unbarcoded ones included. Set
+# VERIFY_LOCATE=0 where that is too much per request.
+app.config['VERIFY_LOCATE'] = env.get('VERIFY_LOCATE', '1') == '1'
+
+# /metrics: request counts, latency and errors per endpoint, pipeline stage
+# and DB call timings and upload sizes, in Prometheus text format. A
+# PROFILE_SAMPLE_RATE share of requests is stack-sampled; those slower than
+# PROFILE_SLOW_SECONDS leave a folded-stack file in PROFILE_FOLDER.
+app.config['PROFILE_SAMPLE_RATE'] = float(env.get('PROFILE_SAMPLE_RATE', 0))
+app.config['PROFILE_SLOW_SECONDS'] = float(env.get('PROFILE_SLOW_SECONDS', 1.0))
+app.config['PROFILE_FOLDER'] = env.get('PROFILE_FOLDER', 'profiles')
+request_count = metrics.counter('leviathan_requests_total', "HTTP requests by endpoint, method and status.",
+                                ['endpoint', 'method', 'status'])
+request_seconds = metrics.histogram('leviathan_request_seconds', "Time to answer a request.", ['endpoint'])
+error_count = metrics.counter('leviathan_errors_total', "Requests answered with a 5xx or an exception.", ['endpoint'])
+upload_bytes = metrics.histogram('leviathan_upload_bytes', "Size of uploaded image files.", ['route'],
+                                 metrics.BYTES_BUCKETS)
+image_pixels = metrics.histogram('leviathan_image_pixels', "Longest side of uploaded images, in pixels.", ['route'],
+                                 metrics.PIXELS_BUCKETS)
+caches = {'gallery': gallery_cache, 'etags': image_etags, 'uploads': upload_cache, 'registrations': registration_cache}
+
+def cache_info(field):
+    return lambda: {(name,): cache.info()[field] for name, cache in caches.items()}
+
+metrics.callback('leviathan_cache_hits_total', "Cache lookups that hit.", cache_info('hits'), ['cache'], 'counter')
+metrics.callback('leviathan_cache_misses_total', "Cache lookups that missed.", cache_info('misses'), ['cache'], 'counter')
+metrics.callback('leviathan_cache_entries', "Entries held per cache.", cache_info('entries'), ['cache'])
+metrics.callback('leviathan_jobs_pending', "Jobs queued or running on the worker pool.",
+                 lambda: {(): job_queue.pending() if job_queue is not None else 0})
+metrics.callback('leviathan_derivative_jobs_pending', "Derivative encodes queued or running.",
+                 lambda: {(): derivative_queue.pending()})
+derivatives_skipped = metrics.counter('leviathan_derivatives_skipped_total',
+                                      "Output images whose derivatives were not queued: queue full.")
 
 # Make sure you have a secret key set
 app.secret_key = env.get("FLASK_SECRET_KEY", "your-secret-key-here")
 
-def upgrade_db():
-    conn = sqlite3.connect('images.db')
-    c = conn.cursor()
-    try:
-        c.execute('ALTER TABLE image_hashes ADD COLUMN query_count INTEGER DEFAULT 0')
-        conn.commit()
-    except sqlite3.OperationalError:
-        # Column might already exist
-        pass
-    finally:
-        conn.close()
-
 def requires_auth(f):
     @wraps(f)
     def decorated(*args, **kwargs):
@@ -78,14 +239,135 @@ def index():
     """Render the main HTML page."""
     return render_template('index.html')
 
+# <color_hash>_<width>.jpg|webp, as named by derivative_filename
+DERIVATIVE_PATTERN = re.compile(r'^(?P<color_hash>.+)_\d+\.(?:jpg|webp)$')
+
+def image_etag(path):
+    """Strong ETag for a file: a digest of its bytes, cached per (path, mtime, size)."""
+    stat = os.stat(path)
+    key = (path, stat.st_mtime_ns, stat.st_size)
+    etag = image_etags.get(key)
+    if etag is None:
+        digest = hashlib.blake2b(digest_size=16)
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+        etag = digest.hexdigest()
+        image_etags.put(key, etag)
+    return etag
+
 @app.route('/images/output/<filename>')
 def serve_image(filename):
-    """Route to serve images from the output folder."""
-    return send_from_directory(app.config['OUTPUT_FOLDER'], filename)
+    """
+    Route to serve images from the output folder, cacheable for
+    IMAGE_MAX_AGE and marked immutable, with a strong ETag. Conditional
+    GETs get a 304 and Range requests a 206 (send_file does both); under a
+    server with wsgi.file_wrapper (e.g. gunicorn) the body goes out via
+    sendfile. A derivative that was never made (image narrower than that
+    width) or is not encoded yet is answered with the full-size JPEG, which
+    is not immutable: that URL gets the real derivative later.
+    """
+    # send_from_directory would resolve a relative folder against app.root_path
+    folder = os.path.join(os.getcwd(), app.config['OUTPUT_FOLDER'])
+    immutable = True
+    match = DERIVATIVE_PATTERN.match(filename)
+    if match and not (Path(folder) / filename).is_file():
+        filename, immutable = f"{match['color_hash']}.jpg", False
+    path = safe_join(folder, filename)
+    if path is None or not os.path.isfile(path):
+        return "Image not found", 404
+    response = send_from_directory(
+        folder, filename,
+        etag=image_etag(path),
+        max_age=app.config['IMAGE_MAX_AGE'] if immutable else None
+    )
+    if immutable:
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.no_cache = True
+    return response
+
+@app.template_global()
+def image_srcset(color_hash, ext='jpg'):
+    """srcset listing every derivative width of an output image."""
+    return ', '.join(
+        f"/images/output/{derivative_filename(color_hash, width, ext)} {width}w" for width in DERIVATIVE_WIDTHS
+    )
+
+def queue_derivatives(color_hash):
+    """
+    Encode an output image's srcset sizes on derivative_queue instead of in
+    the request. Until they exist serve_image falls back to the full JPEG.
+    """
+    try:
+        derivative_queue.submit(make_derivatives, color_hash, app.config['OUTPUT_FOLDER'])
+    except QueueFull:
+        derivatives_skipped.inc()
+        print(f"Derivatives skipped for {color_hash}: derivative queue full")  # Debug print
+
+def process_response(result, user_id):
+    """Store a processed upload's hashes and build the /process JSON for it."""
+    observe_processed(result)
+    with metrics.db_seconds.time(query='insert_image_hash'):
+        store_image_hashes(result['perceptual_hash'], result['color_hash'], user_id)
+    queue_derivatives(result['color_hash'])
+    print(f"Stored image with user_id: {user_id}")  # Debug print
+    return process_json(result)
+
+def observe_processed(result):
+    """Record a process_upload result's stage timings and image size."""
+    metrics.observe_stages(result['timings'], 'process')
+    image_pixels.observe(max(result['size']), route='process')
+
+def upload_size(file):
+    """Byte size of an uploaded file, leaving its stream at the start."""
+    file.stream.seek(0, os.SEEK_END)
+    size = file.stream.tell()
+    file.stream.seek(0)
+    return size
+
+def too_large(error):
+    """The 413 reply for an upload over upload_limits()."""
+    max_pixels, max_frames, max_animation_pixels = upload_limits()
+    return jsonify({'error': str(error), 'success': False, 'max_pixels': max_pixels,
+                    'max_frames': max_frames, 'max_animation_pixels': max_animation_pixels}), 413
+
+def queue_full(error):
+    """The 503 reply when the job queue has no room for an upload."""
+    response = jsonify({'error': 'Too many images being processed, try again shortly',
+                        'success': False, 'retry_after': error.retry_after})
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response, 503
+
+def process_json(result):
+    """
+    The /process JSON for a process_upload result; animated uploads also
+    get the animation_url of their barcoded GIF.
+    """
+    response = {
+        'success': True,
+        'perceptual_hash': result['perceptual_hash'],
+        'color_hash': result['color_hash'],
+        'image_url': f"/images/output/{result['color_hash']}.jpg",
+        'color_pattern': result['color_pattern'],
+        'verification': result['verification']
+    }
+    if result['animation']:
+        response['animation_url'] = f"/images/output/{result['animation']}"
+    return response
 
 @app.route('/process', methods=['POST'])
 def process_image():
-    """Process image and store with user ID from Auth0"""
+    """
+    Process image and store with user ID from Auth0.
+
+    With PROCESS_ASYNC set (or ?async=1) the upload is queued for the worker
+    pool instead: the reply is 202 with a job id to poll at
+    /process/<job_id>, or 503 with Retry-After when the queue is full.
+    Either way an image over MAX_IMAGE_PIXELS, or an animation over
+    MAX_ANIMATION_FRAMES or MAX_ANIMATION_PIXELS, is refused with 413 from
+    its header, before anything is decoded or queued.
+    """
     if 'file' not in request.files:
         return jsonify({'error': 'No file uploaded'}), 400
     
@@ -96,59 +378,240 @@ def process_image():
     file = request.files['file']
     if not file or file.filename.strip() == '':
         return jsonify({'error': 'No file selected'}), 400
+    upload_bytes.observe(upload_size(file), route='process')
+    try:
+        open_upload(file.stream, *upload_limits())
+    except ImageTooLarge as e:
+        return too_large(e)
+    except Exception as e:
+        return jsonify({'error': str(e), 'success': False}), 500
+    file.stream.seek(0)
+
+    if app.config['PROCESS_ASYNC'] or request.args.get('async') == '1':
+        try:
+            job_id = get_job_queue().submit(
+                process_upload, file.read(), app.config['OUTPUT_FOLDER'], *upload_limits(),
+                on_done=lambda result: process_response(result, user_id)
+            )
+        except QueueFull as e:
+            return queue_full(e)
+        status_url = url_for('process_status', job_id=job_id)
+        response = jsonify({'job_id': job_id, 'status': 'pending', 'status_url': status_url})
+        response.headers['Location'] = status_url
+        return response, 202
     
     try:
-        img = Image.open(file.stream).convert('RGB')
-        perceptual_hash = phash_dhash_combo(img)
-        uuid_colors, color_hash = generate_color_uuid_from_hash(img, None, perceptual_hash)
-
-        # Store in DB with Auth0 user ID
-        store_image_hashes(perceptual_hash, color_hash, user_id)
-        print(f"Stored image with user_id: {user_id}")  # Debug print
-
-        # Create color bar and paste onto the image
-        bar_img = create_color_bar(uuid_colors, img.width, img.height)
-        processed_img = img.copy()
-        processed_img.paste(bar_img, (img.width - bar_img.width, img.height - bar_img.height))
-
-        # Verify color bars (optional, but we do it to show success/fail in one step)
-        detected_colors = verify_image_colors(processed_img)
-        matches = []
-        for expected, detected in zip(uuid_colors, detected_colors):
-            diffs = [abs(e - d) for e, d in zip(expected, detected)]
-            matches.append(all(df <= COLOR_TOLERANCE for df in diffs))
-
-        match_count = sum(matches)
-        required_matches = int(len(matches) * REQUIRED_MATCH_PERCENT / 100)
+        result = process_upload(file.stream, app.config['OUTPUT_FOLDER'], *upload_limits())
+        return jsonify(process_response(result, user_id))
+    except Exception as e:
+        return jsonify({'error': str(e), 'success': False}), 500
 
-        # Save final result
-        output_path = Path(app.config['OUTPUT_FOLDER']) / f"{color_hash}.jpg"
-        processed_img.save(output_path, format="JPEG", quality=JPG_QUALITY)
+@app.route('/process/batch', methods=['POST'])
+def process_batch():
+    """
+    Process up to MAX_IMAGES_TO_PROCESS uploads ('files' fields) in one
+    request: images are hashed, painted and saved in parallel on the worker
+    pool and all their hashes are stored in a single DB transaction.
+    Returns one /process-style result per file, in upload order. Like
+    /process, the batch is refused with 413 from the headers, before
+    anything is queued, if any image is over upload_limits().
+    """
+    files = [file for file in request.files.getlist('files') if file and file.filename.strip() != '']
+    if not files:
+        return jsonify({'error': 'No files uploaded'}), 400
+    if len(files) > MAX_IMAGES_TO_PROCESS:
+        return jsonify({'error': f'At most {MAX_IMAGES_TO_PROCESS} images per batch'}), 400
 
-        return jsonify({
-            'success': True,
-            'perceptual_hash': perceptual_hash,
-            'color_hash': color_hash,
-            'image_url': f'/images/output/{color_hash}.jpg',
-            'color_pattern': uuid_colors,
-            'verification': {
-                'success': match_count >= required_matches,
-                'matches': match_count,
-                'total': len(matches),
-                'required': required_matches
-            }
-        })
+    user_id = session.get('user', {}).get('userinfo', {}).get('sub', 'anonymous')
+    print(f"Processing batch of {len(files)} images for user: {user_id}")  # Debug print
+
+    uploads = [file.read() for file in files]
+    for file, data in zip(files, uploads):
+        upload_bytes.observe(len(data), route='batch')
+        try:
+            open_upload(data, *upload_limits())
+        except ImageTooLarge as e:
+            return too_large(f"{file.filename}: {e}")
+        except Exception:
+            pass  # Unreadable files fail on the pool and are reported per file
+    try:
+        outcomes = get_job_queue().map(process_upload, uploads, app.config['OUTPUT_FOLDER'], *upload_limits())
+    except QueueFull as e:
+        return queue_full(e)
+    processed = [result for result, _ in outcomes if result is not None]
+    for result in processed:
+        observe_processed(result)
+    try:
+        with metrics.db_seconds.time(query='insert_image_hashes'):
+            store_image_hashes_batch([(result['perceptual_hash'], result['color_hash']) for result in processed], user_id)
     except Exception as e:
         return jsonify({'error': str(e), 'success': False}), 500
+    for result in processed:
+        queue_derivatives(result['color_hash'])
+
+    results = []
+    for file, (result, error) in zip(files, outcomes):
+        if error is not None:
+            results.append({'filename': file.filename, 'error': error, 'success': False})
+        else:
+            results.append({'filename': file.filename, **process_json(result)})
+    return jsonify({
+        'success': len(processed) == len(files),
+        'processed': len(processed),
+        'results': results
+    })
+
+@app.route('/process/<job_id>')
+def process_status(job_id):
+    """
+    Poll a queued /process job: 202 while pending, then the usual /process
+    reply. 404 for a job queued by another server process.
+    """
+    job = get_job_queue().status(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown or expired job', 'success': False}), 404
+    state, result = job
+    if state == 'pending':
+        return jsonify({'job_id': job_id, 'status': 'pending'}), 202
+    if state == 'error':
+        return jsonify({'error': result, 'success': False}), 500
+    return jsonify(result)
+
+def upload_features(data):
+    """
+    What /verify reads from the upload bytes alone: the perceptual_hash,
+    the color_hash and colors it implies, and the detected bar colors.
+    Cached by a digest of the bytes, so an identical re-upload is neither
+    decoded nor hashed again. Nothing here depends on the DB, so entries
+    never need invalidating. Raises ImageTooLarge for an image over
+    upload_limits(). An animation is hashed from its first frame and its
+    bar read from a few sampled frames.
+    """
+    digest = hashlib.blake2b(data, digest_size=16).digest()
+    features = upload_cache.get(digest)
+    if features is None:
+        watch = metrics.Stopwatch()
+        img, perceptual_hash = decode_upload(data, *upload_limits(), watch=watch)
+        uuid_colors, color_hash = generate_color_uuid_from_hash(img, None, perceptual_hash)
+        watch.lap('barcode')
+        source = open_upload(data, *upload_limits())
+        detected_colors = sample_animation_colors(source) if is_animated(source) else verify_image_colors(img)
+        watch.lap('sample')
+        metrics.observe_stages(watch.timings, 'verify')
+        features = {
+            'digest': digest,
+            'perceptual_hash': perceptual_hash,
+            'color_hash': color_hash,
+            'uuid_colors': uuid_colors,
+            'detected_colors': detected_colors,
+            'located': None,
+            'size': img.size
+        }
+        upload_cache.put(digest, features)
+    return features
+
+def located_bars(features, data):
+    """
+    [(location, colors), ...] for every candidate bar position in the
+    upload, searched for once per cached upload.
+    """
+    if features['located'] is None:
+        with metrics.stage_seconds.time(pipeline='verify', stage='locate'):
+            img = decode_rgb(open_upload(data, *upload_limits()))
+            located = [(location, read_located_colors(img, location)) for location in locate_color_bar_candidates(img)]
+        upload_cache.put(features['digest'], {**features, 'located': located})
+        return located
+    return features['located']
+
+def lookup_registration(perceptual_hash, color_hash):
+    """
+    (exact_match, near_matches) for /verify: the (user_id, created_at) row
+    of the exact pair, else None and up to NEAR_MATCH_CANDIDATES registered
+    hashes within HASH_MATCH_DISTANCE bits that have colors, closest first.
+    Cached until invalidate_registrations: the exact lookup under the pair,
+    the near matches under the perceptual hash's int value, whatever the
+    color_hash.
+    """
+    cached = registration_cache.get((perceptual_hash, color_hash))
+    if cached is None:
+        with metrics.db_seconds.time(query='find_image'):
+            cached = (storage.find_image(storage.perceptual_hash_to_int(perceptual_hash), color_hash_to_bytes(color_hash)),)
+        registration_cache.put((perceptual_hash, color_hash), cached)
+    exact_match, = cached
+    if exact_match is not None:
+        return exact_match, []
+
+    value = int(perceptual_hash, 16)
+    near_matches = registration_cache.get(value)
+    if near_matches is None:
+        near_matches = []
+        for candidate_hash, distance in find_similar_hashes(perceptual_hash)[:NEAR_MATCH_CANDIDATES]:
+            with metrics.db_seconds.time(query='find_color_hash'):
+                candidate_colors = storage.find_color_hash(storage.perceptual_hash_to_int(candidate_hash))
+            if candidate_colors:
+                near_matches.append({
+                    'perceptual_hash': candidate_hash,
+                    'color_hash': bytes_to_color_hash(candidate_colors),
+                    'distance': distance
+                })
+        registration_cache.put(value, near_matches)
+    return None, near_matches
+
+def bars_agree(expected_colors, detected_colors):
+    """Whether enough detected bars match expected_colors, as compare_bar_colors counts it."""
+    _, _, match_count, required_matches = compare_bar_colors(expected_colors, detected_colors)
+    return match_count >= required_matches
+
+def invalidate_registrations(rows):
+    """
+    index_listeners hook: drop the cached lookups newly stored
+    (perceptual_hash, color_hash) rows can change, by key. That is each
+    row's own pair and the near matches of every hash within
+    HASH_MATCH_DISTANCE bits of it: len(near_masks) keys per row, whatever
+    the cache holds. Batches over REGISTRATION_EVICT_ROWS (a bulk import
+    picked up by the index refresh) clear it instead.
+    """
+    if not len(registration_cache):
+        return
+    if len(rows) > REGISTRATION_EVICT_ROWS:
+        registration_cache.clear()
+        return
+    keys = []
+    for perceptual_hash, color_bytes, _ in rows:
+        value = perceptual_hash & 0xFFFFFFFFFFFFFFFF
+        keys.append((storage.int_to_perceptual_hash(perceptual_hash), bytes_to_color_hash(color_bytes)))
+        keys.extend(value ^ mask for mask in near_masks)
+    registration_cache.discard(keys)
+
+def bump_gallery_versions(rows):
+    """
+    index_listeners hook: move on the gallery version of every user with a
+    newly stored row. Uploads through this process bump it before they
+    return; other workers' and bulk.py's within INDEX_REFRESH_SECONDS.
+    """
+    gallery_versions.update(user_id for _, _, user_id in rows)
+
+index_listeners.extend((invalidate_registrations, bump_gallery_versions))
+
+@app.route('/verify/cache')
+def verify_cache_stats():
+    """Hit/miss counts, entries and size of the /verify caches."""
+    return jsonify({'uploads': upload_cache.info(), 'registrations': registration_cache.info()})
 
 @app.route('/verify', methods=['POST'])
 def verify_image():
     """
     Verifies an image that presumably has embedded color bars:
-    1. Reads image and extracts color bars.
-    2. Checks color similarity vs. expected from recomputed hash-based bars.
-    3. Checks if there's a match in the database for (perceptual_hash, color_hash).
-    4. Returns JSON with verification details.
+    1. Reads image and extracts color bars (once per identical upload).
+    2. Checks if there's a match in the database for (perceptual_hash, color_hash),
+       falling back to the closest registered hash within HASH_MATCH_DISTANCE bits.
+    3. Checks color similarity vs. the matched (or recomputed) hash-based bars.
+    4. Independently looks up the nearest registered color_hash to the bar itself.
+    5. If neither check passes (and VERIFY_LOCATE is on), searches for a moved
+       or rescaled bar and checks each candidate location's colors.
+    6. Returns JSON with verification details. 'verified' needs the hash
+       match of step 2 and bars matching its colors (step 3 or 5); steps 4
+       and 5 without a hash match only identify the bar's registration.
     """
     if 'file' not in request.files:
         return jsonify({'error': 'No file uploaded'}), 400
@@ -158,40 +621,103 @@ def verify_image():
         return jsonify({'error': 'No file selected'}), 400
     
     try:
-        img = Image.open(file.stream).convert('RGB')
-
-        # Recompute the same hash and color bars
-        perceptual_hash = phash_dhash_combo(img)
-        uuid_colors, color_hash = generate_color_uuid_from_hash(img, None, perceptual_hash)
-        detected_colors = verify_image_colors(img)
+        data = file.read()
+        upload_bytes.observe(len(data), route='verify')
+        try:
+            features = upload_features(data)
+        except ImageTooLarge as e:
+            return too_large(e)
+        image_pixels.observe(max(features['size']), route='verify')
+        perceptual_hash = features['perceptual_hash']
+        color_hash = features['color_hash']
+        uuid_colors = features['uuid_colors']
+        detected_colors = features['detected_colors']
+
+        # Check DB for the exact combination, else the closest registered
+        # hashes: screenshots and re-compression flip a few hash bits. With
+        # HASH_BITS-bit hashes a large registry has unrelated hashes within
+        # HASH_MATCH_DISTANCE of almost any upload, so a near match also
+        # needs its bars to agree, here or at a located position below.
+        exact_match, near_matches = lookup_registration(perceptual_hash, color_hash)
+        near_match = next((candidate for candidate in near_matches
+                           if bars_agree(decode_url_to_colors(candidate['color_hash']), detected_colors)), None)
+        if near_match is not None:
+            uuid_colors = decode_url_to_colors(near_match['color_hash'])
 
         # Compare the bars
-        matches = []
-        for expected, detected in zip(uuid_colors, detected_colors):
-            diffs = [abs(e - d) for e, d in zip(expected, detected)]
-            matches.append(all(df <= COLOR_TOLERANCE for df in diffs))
-        match_count = sum(matches)
-        required_matches = int(len(matches) * REQUIRED_MATCH_PERCENT / 100)
-        color_verification = (match_count >= required_matches)
-
-        # Check DB for exact combination
-        conn = sqlite3.connect('images.db')
-        c = conn.cursor()
-        c.execute(
-            'SELECT user_id, created_at FROM image_hashes WHERE perceptual_hash = ? AND color_hash = ?',
-            (perceptual_hash, color_hash)
-        )
-        exact_match = c.fetchone()
-        conn.close()
+        diffs, matches, match_count, required_matches = compare_bar_colors(uuid_colors, detected_colors)
+        color_verification = bool(match_count >= required_matches)
+        database_verification = exact_match is not None or near_match is not None
+
+        # Second path: look the bar itself up by its nearest registered color
+        # vector, independent of how far the perceptual hash has drifted.
+        barcode_match = None
+        with metrics.stage_seconds.time(pipeline='verify', stage='nearest'):
+            nearest = find_nearest_color_hash(detected_colors)
+        if nearest:
+            nearest_hash, distance = nearest
+            _, _, bar_count, bar_required = compare_bar_colors(decode_url_to_colors(nearest_hash), detected_colors)
+            barcode_match = {
+                'color_hash': nearest_hash,
+                'distance': round(distance, 2),
+                'matches': int(bar_count),
+                'verified': bool(bar_count >= bar_required)
+            }
+        barcode_verification = barcode_match is not None and barcode_match['verified']
+
+        # Third path: the bar is not where the current image size puts it
+        # (screenshots, padding, crops). Check each located candidate against
+        # the exact match's colors, else each near match's and then its
+        # nearest registered colors.
+        bar_location = None
+        if app.config['VERIFY_LOCATE'] and not ((database_verification and color_verification) or barcode_verification):
+            for location, located_colors in located_bars(features, data):
+                if exact_match is not None:
+                    expected = [(None, None, uuid_colors)]
+                else:
+                    expected = [(candidate, None, decode_url_to_colors(candidate['color_hash']))
+                                for candidate in near_matches]
+                    nearest = find_nearest_color_hash(located_colors)
+                    if nearest:
+                        expected.append((None, nearest[0], decode_url_to_colors(nearest[0])))
+                for candidate, located_hash, expected_colors in expected:
+                    _, _, located_count, located_required = compare_bar_colors(expected_colors, located_colors)
+                    if located_count >= located_required:
+                        near_match = candidate or near_match
+                        bar_location = {
+                            'x': location['x'],
+                            'y': location['y'],
+                            'bar_width': round(location['bar_width'], 2),
+                            'confidence': location['confidence'],
+                            'color_hash': located_hash,
+                            'matches': int(located_count)
+                        }
+                        break
+                if bar_location is not None:
+                    break
+        location_verification = bar_location is not None
+        database_verification = exact_match is not None or near_match is not None
+
+        # A bar alone proves nothing: it can be cut from one output and
+        # pasted onto another image. Only bars checked against the colors of
+        # the image's own registration (exact or within HASH_MATCH_DISTANCE
+        # bits) verify; barcode_verification and location_verification on
+        # their own only report whose bar this is.
+        verified = database_verification and (color_verification or location_verification)
 
         return jsonify({
             'color_verification': color_verification,
-            'database_verification': (exact_match is not None),
-            'verified': (exact_match is not None and color_verification),
+            'database_verification': database_verification,
+            'barcode_verification': barcode_verification,
+            'location_verification': location_verification,
+            'verified': verified,
             'perceptual_hash': perceptual_hash,
             'color_hash': color_hash,
+            'near_match': near_match,
+            'barcode_match': barcode_match,
+            'bar_location': bar_location,
             'matches': {
-                'count': match_count,
+                'count': int(match_count),
                 'required': required_matches,
                 'total': len(matches),
                 'details': [
@@ -200,10 +726,10 @@ def verify_image():
                         'expected': expected,
                         'detected': detected,
                         'matched': is_matched,
-                        'diffs': [abs(e - d) for e, d in zip(expected, detected)]
+                        'diffs': bar_diffs
                     }
-                    for i, (expected, detected, is_matched) in 
-                    enumerate(zip(uuid_colors, detected_colors, matches))
+                    for i, (expected, detected, is_matched, bar_diffs) in
+                    enumerate(zip(uuid_colors, detected_colors, matches.tolist(), diffs.tolist()))
                 ]
             }
         })
@@ -214,39 +740,27 @@ def verify_image():
 def show_image(color_hash):
     """Display details for a specific image by its color hash."""
     try:
-        # Query the database for image details and increment counter
-        conn = sqlite3.connect('images.db')
-        c = conn.cursor()
-        
-        # First, increment the query counter
-        c.execute('''
-            UPDATE image_hashes 
-            SET query_count = query_count + 1 
-            WHERE color_hash = ?
-        ''', (color_hash,))
-        
-        # Then fetch all details including the updated counter
-        c.execute('''
-            SELECT user_id, perceptual_hash, created_at, query_count 
-            FROM image_hashes 
-            WHERE color_hash = ?
-        ''', (color_hash,))
-        
-        result = c.fetchone()
-        conn.commit()
-        conn.close()
+        # The DB keys images by the raw color bytes behind the URL
+        try:
+            color_bytes = color_hash_to_bytes(color_hash)
+        except ValueError:
+            return "Image not found", 404
+
+        # Increment the query counter and fetch the updated details
+        with metrics.db_seconds.time(query='record_image_query'):
+            result = storage.record_image_query(color_bytes)
 
         if not result:
             return "Image not found", 404
 
         user_id, perceptual_hash, created_at, query_count = result
-        
-        # Decode the color hash back to RGB values
-        colors = decode_url_to_colors(color_hash)
+
+        # The stored bytes are the RGB values
+        colors = bytes_to_colors(color_bytes)
 
         return render_template('photo.html',
             color_hash=color_hash,
-            perceptual_hash=perceptual_hash,
+            perceptual_hash=storage.int_to_perceptual_hash(perceptual_hash),
             user_id=user_id,
             created_at=created_at,
             query_count=query_count,
@@ -256,72 +770,87 @@ def show_image(color_hash):
     except Exception as e:
         return f"Error: {str(e)}", 500
 
+def encode_gallery_cursor(created_at, image_id):
+    """Opaque ?before= value pointing just past a gallery row."""
+    return base64.urlsafe_b64encode(f"{created_at}|{image_id}".encode()).decode('ascii')
+
+def decode_gallery_cursor(cursor):
+    """(created_at, id) from encode_gallery_cursor; ValueError if malformed."""
+    created_at, _, image_id = base64.urlsafe_b64decode(cursor.encode('ascii')).decode().rpartition('|')
+    return created_at, int(image_id)
+
 @app.route('/user/<user_id>')  # Changed from int:user_id to just user_id
 def show_user_gallery(user_id):
-    """Display all images created by a specific user."""
+    """
+    Display a user's images, newest first, one page at a time. ?before= is
+    the cursor from the previous page's "Older" link and ?limit= the page
+    size, capped at GALLERY_MAX_PAGE_SIZE. Rendered pages are cached until
+    the user uploads again or GALLERY_CACHE_TTL passes.
+    """
     try:
-        conn = sqlite3.connect('images.db')
-        c = conn.cursor()
-        
         print(f"Fetching gallery for user: {user_id}")  # Debug print
-        
-        # Get all images for this user
-        c.execute('''
-            SELECT color_hash, perceptual_hash, created_at, query_count 
-            FROM image_hashes 
-            WHERE user_id = ? 
-            ORDER BY created_at DESC
-        ''', (user_id,))
-        
-        results = c.fetchall()
-        
-        # Calculate user stats
-        c.execute('''
-            SELECT 
-                COUNT(*) as total_images,
-                SUM(query_count) as total_queries,
-                MIN(created_at) as first_upload
-            FROM image_hashes 
-            WHERE user_id = ?
-        ''', (user_id,))
-        
-        stats = c.fetchone()
-        conn.close()
-
-        # Process the results
+
+        limit = request.args.get('limit', app.config['GALLERY_PAGE_SIZE'], type=int)
+        limit = max(1, min(limit, app.config['GALLERY_MAX_PAGE_SIZE']))
+        cursor = request.args.get('before')
+        try:
+            before = decode_gallery_cursor(cursor) if cursor else None
+        except (ValueError, UnicodeError):
+            return "Invalid page cursor", 400
+
+        key = (user_id, cursor, limit, gallery_versions[user_id])
+        page = gallery_cache.get(key)
+        if page is not None:
+            return page
+
+        # One row past the page tells whether there is an older page
+        with metrics.db_seconds.time(query='user_images'):
+            results = storage.user_images(user_id, limit + 1, before)
+        with metrics.db_seconds.time(query='user_stats'):
+            total_images, total_queries, first_upload = storage.user_stats(user_id)
+
         images = []
-        for color_hash, perceptual_hash, created_at, query_count in results:
-            colors = decode_url_to_colors(color_hash)
+        for _, color_bytes, perceptual_hash, created_at, query_count in results[:limit]:
             images.append({
-                'color_hash': color_hash,
-                'perceptual_hash': perceptual_hash,
+                'color_hash': bytes_to_color_hash(color_bytes),
+                'perceptual_hash': storage.int_to_perceptual_hash(perceptual_hash),
                 'created_at': created_at,
                 'query_count': query_count,
-                'colors': colors
+                'colors': bytes_to_colors(color_bytes)
             })
 
-        total_queries = stats[1] or 0
-        first_upload = stats[2] or 'No uploads yet'
+        page_args = {} if limit == app.config['GALLERY_PAGE_SIZE'] else {'limit': limit}
+        older_url = None
+        if len(results) > limit:
+            last_id, _, _, last_created_at, _ = results[limit - 1]
+            older_url = url_for('show_user_gallery', user_id=user_id,
+                                before=encode_gallery_cursor(last_created_at, last_id), **page_args)
+        newest_url = url_for('show_user_gallery', user_id=user_id, **page_args) if cursor else None
 
-        return render_template('user.html',
+        page = render_template('user.html',
             user_id=user_id,
             images=images,
-            total_queries=total_queries,
-            first_upload=first_upload
+            total_images=total_images,
+            total_queries=total_queries or 0,
+            first_upload=first_upload or 'No uploads yet',
+            older_url=older_url,
+            newest_url=newest_url
         )
+        gallery_cache.put(key, page)
+        return page
 
     except Exception as e:
         return f"Error: {str(e)}", 500
 
 @app.route("/login")
 def login():
-    return oauth.auth0.authorize_redirect(
+    return get_oauth().auth0.authorize_redirect(
         redirect_uri=url_for("callback", _external=True)
     )
 
 @app.route("/callback", methods=["GET", "POST"])
 def callback():
-    token = oauth.auth0.authorize_access_token()
+    token = get_oauth().auth0.authorize_access_token()
     session["user"] = token
     
     # Print user info to console
@@ -368,12 +897,61 @@ def get_current_user_id():
         return auth0_id
     return None
 
+@app.route('/metrics')
+def metrics_endpoint():
+    """Every metric of this process in Prometheus text format."""
+    return app.response_class(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    g.profiler = None
+    if random.random() < app.config['PROFILE_SAMPLE_RATE']:
+        g.profiler = metrics.StackSampler().start()
+
+@app.after_request
+def record_status(response):
+    g.response_status = response.status_code
+    return response
+
+@app.teardown_request
+def record_request(error=None):
+    """
+    Count and time the request, and keep the stacks of a profiled request
+    that took longer than PROFILE_SLOW_SECONDS.
+    """
+    start = g.pop('request_start', None)
+    if start is None:
+        return
+    elapsed = time.perf_counter() - start
+    endpoint = request.endpoint or 'unmatched'  # Unrouted paths share one label
+    status = 500 if error is not None else g.get('response_status', 500)
+    request_count.inc(endpoint=endpoint, method=request.method, status=status)
+    request_seconds.observe(elapsed, endpoint=endpoint)
+    if status >= 500:
+        error_count.inc(endpoint=endpoint)
+
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.stop()
+        if elapsed >= app.config['PROFILE_SLOW_SECONDS'] and profiler.stacks:
+            os.makedirs(app.config['PROFILE_FOLDER'], exist_ok=True)
+            path = os.path.join(app.config['PROFILE_FOLDER'], f"{int(time.time() * 1000)}-{endpoint}.folded")
+            with open(path, 'w') as f:
+                f.write(profiler.folded())
+            print(f"Slow {request.method} {request.path} ({elapsed:.2f} s) profiled to {path}")  # Debug print
+
+# Endpoints that set their own caching headers
+CACHED_ENDPOINTS = {'serve_image'}
+
 @app.after_request
 def add_header(response):
     """
     Add headers to both force latest IE rendering engine or Chrome Frame,
     and also to cache the rendered page for 0 minutes.
     """
+    if request.endpoint in CACHED_ENDPOINTS and response.status_code < 400:
+        return response
     response.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
     response.headers["Pragma"] = "no-cache"
     response.headers["Expires"] = "0"
@@ -381,5 +959,4 @@ def add_header(response):
 
 if __name__ == '__main__':
     init_db()
-    upgrade_db()
     app.run(debug=True) 
\ No newline at end of file
@@ -0,0 +1,137 @@
+"""
+Peak memory and time of process_upload on animated uploads as the frame
+count grows, against loading every frame first and handing the list to
+Pillow's save_all (which is also what GifImagePlugin does internally).
+
+process_upload decodes, quantizes and writes one frame at a time, so its
+peak should not depend on the number of frames. Each case runs in a
+fresh interpreter; the peak is the resident set's high-water mark after
+processing (VmHWM) minus the resident set just before it (VmRSS), so
+Linux only.
+
+    python benchmarks/bench_animation.py [--frames 25 100 400] [--size 640x360]
+"""
+import argparse
+import io
+import json
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import numpy as np
+from PIL import Image, ImageSequence
+
+from main import (
+    process_upload,
+    phash_dhash_combo,
+    generate_color_uuid_from_hash,
+    create_color_bar,
+)
+
+# ─────────────────────────────────────────────────────────
+# Configuration
+# ─────────────────────────────────────────────────────────
+FRAME_COUNTS = (25, 100, 400)
+FRAME_SIZE = (640, 360)
+FORMATS = ('GIF', 'WEBP')
+FRAME_DURATION = 40         # ms, 25 fps
+
+def eager_process_animation(data, output_folder):
+    """Every frame decoded and painted up front, then saved in one call."""
+    source = Image.open(io.BytesIO(data))
+    first = source.convert('RGB')
+    uuid_colors, color_hash = generate_color_uuid_from_hash(first, None, phash_dhash_combo(first))
+    bar = create_color_bar(uuid_colors, first.width, first.height)
+    frames, durations = [], []
+    for frame in ImageSequence.Iterator(source):
+        rgb = frame.convert('RGB')
+        rgb.paste(bar, (rgb.width - bar.width, rgb.height - bar.height))
+        frames.append(rgb)
+        durations.append(frame.info.get('duration', 0))
+    frames[0].save(Path(output_folder) / f"{color_hash}.gif", format='GIF', save_all=True,
+                   append_images=frames[1:], duration=durations, loop=source.info.get('loop', 0))
+
+def streaming_process_animation(data, output_folder):
+    # Past the default caps on purpose: this measures how memory scales
+    process_upload(data, output_folder, max_frames=1 << 40, max_animation_pixels=1 << 40)
+
+IMPLEMENTATIONS = {'eager': eager_process_animation, 'streaming': streaming_process_animation}
+
+def animation(fmt, frames, size):
+    """A scrolling gradient animation, one generated frame at a time."""
+    width, height = size
+    y, x = np.ogrid[0:height, 0:width]
+
+    def frame(i):
+        pixels = np.empty((height, width, 3), dtype=np.uint8)
+        pixels[..., 0] = (x + i * 7) % 256
+        pixels[..., 1] = y * 200 // height
+        pixels[..., 2] = (i * 5) % 256
+        return Image.fromarray(pixels, 'RGB')
+
+    buffer = io.BytesIO()
+    frame(0).save(buffer, format=fmt, save_all=True, append_images=(frame(i) for i in range(1, frames)),
+                  duration=FRAME_DURATION, loop=0)
+    return buffer.getvalue()
+
+# ─────────────────────────────────────────────────────────
+# Measurement
+# ─────────────────────────────────────────────────────────
+
+def memory_kib(field):
+    """
+    VmRSS (resident now) or VmHWM (its peak) of this process. Not
+    ru_maxrss: Linux carries that over from the parent through fork and
+    exec, so a worker would start at the harness's own peak.
+    """
+    for line in Path('/proc/self/status').read_text().splitlines():
+        if line.startswith(field + ':'):
+            return int(line.split()[1])
+    raise RuntimeError(f"no {field} in /proc/self/status")
+
+def worker(name, path, output_folder):
+    """Run in a fresh interpreter: process one upload, print JSON."""
+    data = Path(path).read_bytes()
+    before = memory_kib('VmRSS')
+    start = time.perf_counter()
+    IMPLEMENTATIONS[name](data, output_folder)
+    seconds = time.perf_counter() - start
+    after = memory_kib('VmHWM')
+    print(json.dumps({'peak_kib': after - before, 'seconds': seconds}))
+
+def measure(name, path, output_folder):
+    result = subprocess.run([sys.executable, __file__, '--worker', name, str(path), output_folder],
+                            capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('--frames', type=int, nargs='+', default=FRAME_COUNTS)
+    parser.add_argument('--size', default='x'.join(map(str, FRAME_SIZE)), help="frame WIDTHxHEIGHT")
+    parser.add_argument('--worker', nargs=3, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.worker:
+        worker(*args.worker)
+        return
+
+    size = tuple(int(n) for n in args.size.split('x'))
+    print(f"{size[0]}x{size[1]} frames\n")
+    print(f"{'upload':<22} {'eager peak':>11} {'streaming peak':>15} {'eager':>9} {'streaming':>10}")
+    with tempfile.TemporaryDirectory() as folder:
+        for fmt in FORMATS:
+            for frames in args.frames:
+                path = Path(folder) / f'{frames}.{fmt.lower()}'
+                path.write_bytes(animation(fmt, frames, size))
+                eager = measure('eager', path, folder)
+                streaming = measure('streaming', path, folder)
+                label = f"{fmt} x{frames} ({path.stat().st_size / 2**20:.1f} MiB)"
+                print(f"{label:<22} {eager['peak_kib'] / 1024:>7.0f} MiB {streaming['peak_kib'] / 1024:>11.0f} MiB "
+                      f"{eager['seconds']:>8.2f}s {streaming['seconds']:>9.2f}s")
+
+if __name__ == "__main__":
+    main()
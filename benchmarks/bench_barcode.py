@@ -0,0 +1,117 @@
+"""
+Before/after timings for the color bar engine over the images/ corpus.
+
+The "legacy" functions below are the original per-pixel putpixel/getpixel
+implementations, kept here only as a baseline.
+
+    python benchmarks/bench_barcode.py [image_dir]
+"""
+import sys
+import time
+from pathlib import Path
+
+from PIL import Image
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from main import (
+    phash_dhash_combo,
+    generate_color_uuid_from_hash,
+    create_color_bar,
+    verify_image_colors,
+    verify_batch_colors,
+    compare_bar_colors,
+    bar_geometry,
+    NUM_BARS,
+)
+
+# ─────────────────────────────────────────────────────────
+# Legacy baseline
+# ─────────────────────────────────────────────────────────
+
+def legacy_create_color_bar(uuid_colors, img_width, img_height):
+    bar_width, bar_height, total_width = bar_geometry(img_width, img_height)
+    bar_img = Image.new("RGB", (total_width, bar_height), color=(255, 255, 255))
+    for i, (r, g, b) in enumerate(uuid_colors):
+        for x in range(bar_width):
+            for y in range(bar_height):
+                bar_img.putpixel((i * bar_width + x, y), (r, g, b))
+    return bar_img
+
+def legacy_verify_image_colors(img):
+    w, h = img.size
+    bar_width, bar_height, total_width = bar_geometry(w, h)
+    bar_x = w - total_width
+    bar_y = h - bar_height
+    detected = []
+    for i in range(NUM_BARS):
+        x_center = bar_x + i * bar_width + bar_width // 2
+        y_center = bar_y + bar_height // 2
+        left = img.getpixel((x_center - 1, y_center))
+        center = img.getpixel((x_center, y_center))
+        right = img.getpixel((x_center + 1, y_center))
+        detected.append(tuple((left[c] + center[c] + right[c]) // 3 for c in range(3)))
+    return detected
+
+def legacy_compare(expected, detected, tolerance=40):
+    matches = []
+    for e_color, d_color in zip(expected, detected):
+        diffs = [abs(e - d) for e, d in zip(e_color, d_color)]
+        matches.append(all(df <= tolerance for df in diffs))
+    return sum(matches)
+
+# ─────────────────────────────────────────────────────────
+# Benchmark
+# ─────────────────────────────────────────────────────────
+
+def load_corpus(image_dir, upscale=4):
+    """
+    Load and barcode every image. Each image is also upscaled so the bar
+    is as tall as it would be on a large upload.
+    """
+    samples = []
+    for path in sorted(Path(image_dir).glob("*.JPEG")):
+        img = Image.open(path).convert("RGB")
+        img = img.resize((img.width * upscale, img.height * upscale))
+        colors, _ = generate_color_uuid_from_hash(img, None, phash_dhash_combo(img))
+        samples.append((img, colors))
+    return samples
+
+def timed(label, fn, samples):
+    start = time.perf_counter()
+    for img, colors in samples:
+        fn(img, colors)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<32} {elapsed * 1000:9.1f} ms  ({elapsed * 1000 / len(samples):.3f} ms/image)")
+    return elapsed
+
+def main():
+    image_dir = sys.argv[1] if len(sys.argv) > 1 else "images"
+    samples = load_corpus(image_dir)
+    print(f"{len(samples)} images from {image_dir}\n")
+
+    before = timed("create_color_bar (legacy)", lambda img, c: legacy_create_color_bar(c, *img.size), samples)
+    after = timed("create_color_bar", lambda img, c: create_color_bar(c, *img.size), samples)
+    print(f"{'':<32} speedup x{before / after:.1f}\n")
+
+    painted = []
+    for img, colors in samples:
+        bar = create_color_bar(colors, *img.size)
+        img.paste(bar, (img.width - bar.width, img.height - bar.height))
+        painted.append((img, colors))
+
+    before = timed("verify + compare (legacy)",
+                   lambda img, c: legacy_compare(c, legacy_verify_image_colors(img)), painted)
+    after = timed("verify + compare",
+                  lambda img, c: compare_bar_colors(c, verify_image_colors(img)), painted)
+    print(f"{'':<32} speedup x{before / after:.1f}\n")
+
+    start = time.perf_counter()
+    detected = verify_batch_colors([img for img, _ in painted])
+    _, _, match_count, required = compare_bar_colors([c for _, c in painted], detected)
+    elapsed = time.perf_counter() - start
+    print(f"{'verify + compare (batch)':<32} {elapsed * 1000:9.1f} ms  "
+          f"({(match_count >= required).sum()}/{len(painted)} verified)")
+
+if __name__ == "__main__":
+    main()
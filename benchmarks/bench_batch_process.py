@@ -0,0 +1,72 @@
+"""
+Ingesting meme sets of MAX_IMAGES_TO_PROCESS images: one /process request
+and one DB commit per image against a single /process/batch request, which
+processes the set on the worker pool and stores every hash in one
+transaction.
+
+Both runs go through the Flask test client against a fresh database and
+output folder, so the numbers include multipart parsing, hashing, bar
+painting, JPEG encoding and the SQLite writes.
+
+    python benchmarks/bench_batch_process.py [image_dir] [num_sets]
+"""
+import io
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import storage
+
+def one_by_one(client, images):
+    for name, data in images:
+        response = client.post('/process', data={'file': (io.BytesIO(data), name)},
+                               content_type='multipart/form-data')
+        assert response.status_code == 200, response.json
+
+def batched(client, images):
+    files = [(io.BytesIO(data), name) for name, data in images]
+    response = client.post('/process/batch', data={'files': files}, content_type='multipart/form-data')
+    assert response.status_code == 200 and response.json['success'], response.json
+
+def main():
+    image_dir = sys.argv[1] if len(sys.argv) > 1 else "images"
+    num_sets = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+
+    with tempfile.TemporaryDirectory() as tmp:
+        storage.use_database(str(Path(tmp) / 'images.db'))
+        storage.migrate()
+        paths = sorted(Path(image_dir).resolve().glob("*.JPEG"))
+        os.chdir(tmp)
+        import app as appmod
+        appmod.app.config['OUTPUT_FOLDER'] = tmp
+        client = appmod.app.test_client()
+
+        set_size = appmod.MAX_IMAGES_TO_PROCESS
+        images = [(path.name, path.read_bytes()) for path in paths[:2 * num_sets * set_size]]
+        sets = [images[i:i + set_size] for i in range(0, len(images), set_size)]
+        print(f"{len(sets) // 2} sets of {set_size} images per run, {os.cpu_count()} CPUs\n")
+
+        appmod.get_job_queue().map(len, [b'warm up the pool'])
+        results = {}
+        for label, upload, run_sets in (("request per image", one_by_one, sets[0::2]),
+                                        ("/process/batch", batched, sets[1::2])):
+            start = time.perf_counter()
+            for image_set in run_sets:
+                upload(client, image_set)
+            elapsed = time.perf_counter() - start
+            results[label] = elapsed / len(run_sets)
+            print(f"{label:<18} {elapsed / len(run_sets) * 1000:8.1f} ms per set "
+                  f"{len(run_sets) * set_size / elapsed:8.1f} images/s")
+        appmod.get_job_queue().shutdown()
+        storage.view_counts.close()
+        storage.get_pool().close_all()
+
+    before, after = results.values()
+    print(f"\nper-set time x{before / after:.2f}")
+
+if __name__ == "__main__":
+    main()
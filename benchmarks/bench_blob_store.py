@@ -0,0 +1,71 @@
+"""
+Repeat downloads of reposted images: the firehose pipeline with no blob
+store (every post fetched) against BlobStore, whose Bloom filter skips
+CIDs already stored before any request is made.
+
+Posts pick their image from a Zipf-like popularity curve, so a few memes
+are reposted many times. A second run reopens the store from disk to show
+the filter survives a restart. Uses the mock CDN from bench_firehose.
+
+    python benchmarks/bench_blob_store.py [posts] [unique_images] [zipf_exponent]
+"""
+import asyncio
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "old"))
+
+from bench_firehose import IMAGE_BYTES, start_mock_cdn
+from blob_store import BlobStore
+from image_pipeline import ImagePipeline
+
+def popular_cids(num_posts, num_unique, exponent, rng):
+    weights = [1 / (rank + 1) ** exponent for rank in range(num_unique)]
+    ranks = rng.choices(range(num_unique), weights, k=num_posts)
+    return [f"bafkrei{rank:020d}" for rank in ranks]
+
+def replay(cdn_url, cids, store, log_path):
+    def source():
+        for i, cid in enumerate(cids):
+            pipeline.offer("did:plc:bench", cid, "alt", f"at://did:plc:bench/app.bsky.feed.post/{i}")
+
+    pipeline = ImagePipeline(store=store, log_path=log_path, cdn_url=cdn_url, queue_size=len(cids))
+    start = time.perf_counter()
+    asyncio.run(pipeline.run(source))
+    return pipeline, time.perf_counter() - start
+
+def main():
+    num_posts = int(sys.argv[1]) if len(sys.argv) > 1 else 3000
+    num_unique = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    exponent = float(sys.argv[3]) if len(sys.argv) > 3 else 1.1
+    rng = random.Random(0)
+    server = start_mock_cdn(0.05, 0)
+    cdn_url = f"http://127.0.0.1:{server.server_port}/img/{{did}}/{{cid}}@png"
+    runs = [popular_cids(num_posts, num_unique, exponent, rng) for _ in range(2)]
+    print(f"{num_posts} posts per run over {num_unique} images (Zipf {exponent}), "
+          f"{len(set(runs[0]))} distinct in the first run, {IMAGE_BYTES // 1000} kB each\n")
+    print(f"{'':<26} {'CDN requests':>12} {'dedup hits':>11} {'MB saved':>9} {'seconds':>8}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        before = next(server.requests)
+        _, elapsed = replay(cdn_url, runs[0], None, f"{tmp}/plain.txt")
+        requests = next(server.requests) - before - 1
+        print(f"{'no store (in-flight only)':<26} {requests:>12} {'-':>11} {'-':>9} {elapsed:8.1f}")
+
+        for label, cids in (("BlobStore", runs[0]), ("BlobStore after restart", runs[1])):
+            store = BlobStore(f"{tmp}/store")
+            before = next(server.requests)
+            _, elapsed = replay(cdn_url, cids, store, f"{tmp}/store.txt")
+            requests = next(server.requests) - before - 1
+            store.close()
+            stats = store.stats
+            print(f"{label:<26} {requests:>12} {stats['hits'] / stats['lookups']:>10.1%} "
+                  f"{stats['bytes_saved'] / 1e6:9.1f} {elapsed:8.1f}")
+
+    server.shutdown()
+
+if __name__ == "__main__":
+    main()
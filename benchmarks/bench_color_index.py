@@ -0,0 +1,56 @@
+"""
+ColorIndex nearest-neighbour timings and recall at 1M synthetic color
+hashes, against a brute-force NumPy scan over all 36-D vectors.
+
+Queries are stored vectors with Gaussian per-channel noise, roughly what
+JPEG re-compression does to the bar.
+
+    python benchmarks/bench_color_index.py [num_vectors] [num_queries] [noise_sigma]
+"""
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from color_index import ColorIndex
+from main import NUM_BARS, COLOR_INDEX_RADIUS
+
+def main():
+    num_vectors = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    num_queries = int(sys.argv[2]) if len(sys.argv) > 2 else 1_000
+    sigma = float(sys.argv[3]) if len(sys.argv) > 3 else 8.0
+    rng = np.random.default_rng(0)
+    vectors = rng.integers(0, 256, (num_vectors, NUM_BARS * 3), dtype=np.uint8)
+
+    index = ColorIndex(num_bars=NUM_BARS, radius=COLOR_INDEX_RADIUS)
+    start = time.perf_counter()
+    index.update(vector.tobytes() for vector in vectors)
+    print(f"built index of {len(index):,} vectors in {time.perf_counter() - start:.2f} s")
+
+    targets = rng.integers(0, num_vectors, num_queries)
+    noise = rng.normal(0, sigma, (num_queries, NUM_BARS * 3))
+    queries = np.clip(vectors[targets] + noise, 0, 255).round().astype(np.uint8)
+
+    scan_queries = queries[:max(1, num_queries // 50)]
+    start = time.perf_counter()
+    wide = vectors.astype(np.int32)
+    for query in scan_queries:
+        ((wide - query.astype(np.int32)) ** 2).sum(axis=1).argmin()
+    scan_ms = (time.perf_counter() - start) * 1000 / len(scan_queries)
+
+    found = 0
+    start = time.perf_counter()
+    for target, query in zip(targets, queries):
+        nearest = index.nearest(query.tobytes())
+        found += nearest is not None and nearest[0] == vectors[target].tobytes()
+    index_ms = (time.perf_counter() - start) * 1000 / num_queries
+
+    print(f"noise sigma {sigma}: recall@1 {found / num_queries:.3f}")
+    print(f"{'brute-force scan':<20} {scan_ms:8.3f} ms/query")
+    print(f"{'color index':<20} {index_ms:8.3f} ms/query  (x{scan_ms / index_ms:.0f})")
+
+if __name__ == "__main__":
+    main()
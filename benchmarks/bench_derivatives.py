@@ -0,0 +1,84 @@
+"""
+Bytes a gallery card downloads before and after srcset derivatives, and
+what making them costs per image.
+
+Corpus images are barcoded with process_upload twice: at their own size
+and upscaled to a 12 MP phone photo (4032x3024 or its portrait), the size
+most uploads arrive at. For each, the card used to load <color_hash>.jpg;
+a 400 px card on a 2x display now picks the 640 px derivative (WebP where
+supported, else JPEG), or the full JPEG when the image is narrower. Also
+checks the bar still verifies in every derivative.
+
+    python benchmarks/bench_derivatives.py [image_dir] [images]
+"""
+import io
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from PIL import Image
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from main import (
+    DERIVATIVE_WIDTHS,
+    compare_bar_colors,
+    decode_url_to_colors,
+    derivative_filename,
+    make_derivatives,
+    process_upload,
+    verify_image_colors,
+)
+
+CARD_WIDTH = 640  # 400 px card at 2x
+
+def phone_sized(data):
+    img = Image.open(io.BytesIO(data)).convert('RGB')
+    size = (4032, 3024) if img.width >= img.height else (3024, 4032)
+    buffer = io.BytesIO()
+    img.resize(size, Image.BICUBIC).save(buffer, 'JPEG', quality=90)
+    return buffer.getvalue()
+
+def measure(uploads, output):
+    full = webp = jpeg = 0
+    derive_time = 0.0
+    verified = total = 0
+    for data in uploads:
+        color_hash = process_upload(data, output)['color_hash']
+        start = time.perf_counter()
+        widths = make_derivatives(color_hash, output)
+        derive_time += time.perf_counter() - start
+
+        original = Path(output) / f"{color_hash}.jpg"
+        full += original.stat().st_size
+        card = min((width for width in widths if width >= CARD_WIDTH), default=None)
+        webp += (Path(output) / derivative_filename(color_hash, card, 'webp')).stat().st_size if card else original.stat().st_size
+        jpeg += (Path(output) / derivative_filename(color_hash, card, 'jpg')).stat().st_size if card else original.stat().st_size
+        for width in widths:
+            for ext in ('jpg', 'webp'):
+                img = Image.open(Path(output) / derivative_filename(color_hash, width, ext)).convert('RGB')
+                _, _, match_count, required = compare_bar_colors(decode_url_to_colors(color_hash), verify_image_colors(img))
+                verified += match_count >= required
+                total += 1
+    return full, jpeg, webp, derive_time, verified, total
+
+def main():
+    image_dir = sys.argv[1] if len(sys.argv) > 1 else "images"
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 30
+    paths = sorted(p for p in Path(image_dir).iterdir() if p.suffix.lower() in {'.jpeg', '.jpg'})[:count]
+    corpus = [path.read_bytes() for path in paths]
+    print(f"{len(corpus)} images, derivative widths {DERIVATIVE_WIDTHS}, card picks {CARD_WIDTH} px\n")
+
+    for label, uploads in (("corpus size", corpus), ("12 MP upload", [phone_sized(data) for data in corpus])):
+        with tempfile.TemporaryDirectory() as tmp:
+            full, jpeg, webp, derive_time, verified, total = measure(uploads, tmp)
+        n = len(uploads)
+        print(f"{label:<13} card bytes: full JPEG {full / n / 1024:8.1f} KiB   "
+              f"derivative JPEG {jpeg / n / 1024:6.1f} KiB (x{full / jpeg:.1f})   "
+              f"WebP {webp / n / 1024:6.1f} KiB (x{full / webp:.1f})")
+        print(f"{'':<13} make_derivatives {derive_time / n * 1000:6.1f} ms/image   "
+              f"bars verify in {verified}/{total} derivatives\n")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""
+Offline firehose ingestion: the previous image_recorder, which downloaded
+each image with a blocking requests.get inside the firehose callback
+(reopening the log and calling os.makedirs per image), against
+old/image_pipeline.py.
+
+A mock CDN (a local keep-alive HTTP server with per-request latency and a
+share of 503s) stands in for cdn.bsky.app. A mock firehose offers image
+posts at a fixed rate from its own thread, as the atproto client does.
+Lag is measured from the moment a post is due on the firehose to the
+moment its image is on disk.
+
+    python benchmarks/bench_firehose.py [posts_per_second] [seconds] [cdn_latency_ms] [error_percent]
+"""
+import asyncio
+import itertools
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import requests
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "old"))
+
+from blob_store import BlobStore
+from image_pipeline import ImagePipeline
+
+IMAGE_BYTES = 150_000       # Typical feed_fullsize PNG
+
+# ─────────────────────────────────────────────────────────
+# Mock CDN and firehose
+# ─────────────────────────────────────────────────────────
+
+def start_mock_cdn(latency, error_rate):
+    body = os.urandom(IMAGE_BYTES)
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            next(self.server.requests)
+            time.sleep(latency * random.uniform(0.5, 1.5))
+            if random.random() < error_rate:
+                self.send_response(503)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "image/png")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    server.requests = itertools.count()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def mock_firehose(rate, seconds, on_post, due):
+    """
+    Call on_post(did, cid, alt) rate times a second; due[cid] records when
+    each post arrived. A callback that falls behind is cut off after
+    seconds, leaving the rest of the posts unconsumed.
+    """
+    start = time.perf_counter()
+    for i in range(int(rate * seconds)):
+        scheduled = start + i / rate
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        elif time.perf_counter() - start > seconds:
+            break
+        cid = f"bafkrei{i:020d}"
+        due[cid] = scheduled
+        on_post(f"did:plc:{i % 997:024d}", cid, "mock alt text")
+
+# ─────────────────────────────────────────────────────────
+# Legacy baseline: download inside the firehose callback
+# ─────────────────────────────────────────────────────────
+
+def legacy_recorder(cdn_url, image_dir, log_path, done):
+    def record(did, cid, alt_text):
+        full_url = cdn_url.format(did=did, cid=cid)
+        os.makedirs(image_dir, exist_ok=True)
+        try:
+            response = requests.get(full_url)
+            if response.status_code == 200:
+                with open(f"{image_dir}/{cid}.png", "wb") as f:
+                    f.write(response.content)
+                with open(log_path, "a", encoding="utf-8") as f:
+                    f.write(f"{full_url}\t{alt_text}\n")
+                done[cid] = time.perf_counter()
+        except Exception as e:
+            print(f"Error downloading image: {e}")
+    return record
+
+# ─────────────────────────────────────────────────────────
+# Benchmark
+# ─────────────────────────────────────────────────────────
+
+def report(label, posts, due, done, elapsed, dropped=0):
+    lags = sorted(done[cid] - due[cid] for cid in done) or [0.0]
+    print(f"{label:<22} {len(due):>6}/{posts:<6} {len(done):>6} {len(done) / elapsed:9.1f} "
+          f"{lags[len(lags) // 2] * 1000:9.0f} {lags[int(len(lags) * 0.99)] * 1000:9.0f} {dropped:>7}")
+
+def main():
+    rate = float(sys.argv[1]) if len(sys.argv) > 1 else 100
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 10
+    latency = float(sys.argv[3]) / 1000 if len(sys.argv) > 3 else 0.2
+    error_rate = float(sys.argv[4]) / 100 if len(sys.argv) > 4 else 0.02
+    posts = int(rate * seconds)
+
+    server = start_mock_cdn(latency, error_rate)
+    cdn_url = f"http://127.0.0.1:{server.server_port}/img/{{did}}/{{cid}}@png"
+    print(f"{rate:.0f} image posts/s for {seconds:.0f} s, CDN latency {latency * 1000:.0f} ms, "
+          f"{error_rate:.0%} 503s\n")
+    print(f"{'':<22} {'consumed':>13} {'saved':>6} {'images/s':>9} {'p50 lag':>9} {'p99 lag':>9} {'dropped':>7}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        due, done = {}, {}
+        record = legacy_recorder(cdn_url, f"{tmp}/legacy", f"{tmp}/legacy.txt", done)
+        start = time.perf_counter()
+        mock_firehose(rate, seconds, record, due)
+        elapsed = time.perf_counter() - start
+        report("blocking callback", posts, due, done, elapsed)
+
+        due, done = {}, {}
+        pipeline = ImagePipeline(store=BlobStore(f"{tmp}/pipeline"), log_path=f"{tmp}/pipeline.txt", cdn_url=cdn_url,
+                                 on_result=lambda url, ok: ok and done.__setitem__(url.split("/")[-1][:-4],
+                                                                                     time.perf_counter()))
+        start = time.perf_counter()
+        asyncio.run(pipeline.run(lambda: mock_firehose(rate, seconds, pipeline.offer, due)))
+        elapsed = time.perf_counter() - start
+        summary = pipeline.summary()
+        report("asyncio pipeline", posts, due, done, elapsed, summary['dropped'])
+        with open(f"{tmp}/pipeline.txt", encoding="utf-8") as f:
+            logged = sum(1 for _ in f)
+        print(f"\npipeline: {summary['retries']} retries, {summary['failed']} failed, "
+              f"{logged} log lines, {pipeline.store.stats['stored']} files")
+
+    server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+"""
+Firehose commit handling with and without the firehose_filter pre-filter.
+
+The old recorders decoded every block of every commit (CAR.from_bytes) and
+only then dropped likes, follows and reposts. The filtered recorders check
+commit.ops and the raw bytes first and decode just the record blocks of
+post creates.
+
+atproto and libipld are not needed here: commits are synthesised with a
+typical firehose op mix and real CARv1 framing and CIDs, but block payloads
+are JSON rather than DAG-CBOR, and the same decoder (json.loads) is used on
+both sides. Absolute rates are therefore not libipld's; the ratio reflects
+the decoding the filter avoids. Both sides must extract the same posts.
+
+    python benchmarks/bench_firehose_filter.py [commits]
+"""
+import base64
+import hashlib
+import json
+import random
+import sys
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "old"))
+
+from firehose_filter import IMAGE_EMBED_TYPE, mentions, records_for, wanted_ops, iter_car_blocks
+
+# Share of commits by the record they create (roughly the public firehose)
+MIX = [
+    ("app.bsky.feed.like", 55),
+    ("app.bsky.graph.follow", 12),
+    ("app.bsky.feed.repost", 10),
+    ("app.bsky.feed.post", 17),
+    ("app.bsky.feed.post+images", 5),
+    ("app.bsky.graph.block", 1),
+]
+
+# ─────────────────────────────────────────────────────────
+# Synthetic commits
+# ─────────────────────────────────────────────────────────
+
+def _varint(value):
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+def make_cid(block):
+    cid = b"\x01\x71\x12\x20" + hashlib.sha256(block).digest()
+    return cid, "b" + base64.b32encode(cid).decode("ascii").lower().rstrip("=")
+
+def make_car(blocks):
+    header = json.dumps({"version": 1, "roots": []}).encode()
+    out = [_varint(len(header)), header]
+    for block in blocks:
+        cid, _ = make_cid(block)
+        out += [_varint(len(cid) + len(block)), cid, block]
+    return b"".join(out)
+
+def make_record(kind, rng, now):
+    if kind.startswith("app.bsky.feed.post"):
+        record = {"$type": "app.bsky.feed.post", "createdAt": now, "langs": ["en"],
+                  "text": " ".join(rng.choice(["meme", "cat", "today", "lol", "news", "art"]) for _ in range(20))}
+        if kind.endswith("+images"):
+            record["embed"] = {"$type": IMAGE_EMBED_TYPE, "images": [
+                {"alt": "mock alt", "image": {"$type": "blob", "mimeType": "image/jpeg", "size": 150000,
+                                              "ref": make_cid(rng.randbytes(16))[1]}}
+                for _ in range(rng.randint(1, 4))
+            ]}
+        return record
+    return {"$type": kind, "createdAt": now,
+            "subject": {"uri": f"at://did:plc:{rng.getrandbits(100):025x}/app.bsky.feed.post/3k{rng.getrandbits(40):x}",
+                        "cid": make_cid(rng.randbytes(16))[1]}}
+
+def make_commit(rng):
+    kinds, weights = zip(*MIX)
+    kind = rng.choices(kinds, weights)[0]
+    collection = kind.split("+")[0]
+    record = json.dumps(make_record(kind, rng, "2024-11-20T12:00:00Z")).encode()
+    _, record_cid = make_cid(record)
+    # MST nodes on the path to the new record, plus the signed commit block
+    mst = [json.dumps({"l": make_cid(rng.randbytes(8))[1], "e": [
+        {"k": f"{collection}/3k{rng.getrandbits(40):x}", "p": rng.randrange(20), "v": make_cid(rng.randbytes(8))[1],
+         "t": make_cid(rng.randbytes(8))[1]} for _ in range(rng.randint(4, 12))
+    ]}).encode() for _ in range(rng.randint(3, 6))]
+    commit_block = json.dumps({"did": "did:plc:x", "version": 3, "data": make_cid(mst[0])[1],
+                               "rev": "3k", "sig": base64.b64encode(rng.randbytes(64)).decode()}).encode()
+    op = SimpleNamespace(action="create", path=f"{collection}/3k{rng.getrandbits(40):x}", cid=record_cid)
+    return SimpleNamespace(repo=f"did:plc:{rng.getrandbits(100):025x}", ops=[op],
+                           blocks=make_car([commit_block, *mst, record]))
+
+# ─────────────────────────────────────────────────────────
+# Recorders
+# ─────────────────────────────────────────────────────────
+
+def decode_all(commit):
+    """What CAR.from_bytes does: decode every block, keyed by CID string."""
+    return {make_cid_string(cid): json.loads(block) for cid, block in iter_car_blocks(commit.blocks)}
+
+def make_cid_string(cid):
+    return "b" + base64.b32encode(cid).decode("ascii").lower().rstrip("=")
+
+def images_in(commit, ops, records):
+    found = []
+    for op in ops:
+        raw = records.get(str(op.cid), {})
+        embed = raw.get("embed", {}) if raw.get("$type") == "app.bsky.feed.post" else {}
+        if embed.get("$type") == IMAGE_EMBED_TYPE:
+            found += [(commit.repo, image["image"]["ref"], image.get("alt")) for image in embed["images"]]
+    return found
+
+def legacy_images(commit):
+    records = decode_all(commit)
+    return images_in(commit, [op for op in commit.ops if op.action == "create" and op.cid], records)
+
+def filtered_images(commit):
+    ops = wanted_ops(commit)
+    if not ops or not mentions(commit, IMAGE_EMBED_TYPE):
+        return None
+    return images_in(commit, ops, records_for(commit, ops, json.loads))
+
+def texts_in(ops, records):
+    return [records[str(op.cid)]["text"] for op in ops
+            if records.get(str(op.cid), {}).get("$type") == "app.bsky.feed.post"]
+
+def legacy_texts(commit):
+    return texts_in([op for op in commit.ops if op.action == "create" and op.cid], decode_all(commit))
+
+def filtered_texts(commit):
+    ops = wanted_ops(commit)
+    if not ops:
+        return None
+    return texts_in(ops, records_for(commit, ops, json.loads))
+
+def run(recorder, commits):
+    start = time.perf_counter()
+    results = [recorder(commit) for commit in commits]
+    return results, time.perf_counter() - start
+
+def main():
+    num_commits = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+    rng = random.Random(0)
+    commits = [make_commit(rng) for _ in range(num_commits)]
+    size = sum(len(commit.blocks) for commit in commits) / num_commits
+    print(f"{num_commits:,} commits, {size:,.0f} CAR bytes per commit\n")
+
+    for label, legacy, filtered in (("text recorder", legacy_texts, filtered_texts),
+                                    ("image recorder", legacy_images, filtered_images)):
+        before, legacy_time = run(legacy, commits)
+        after, filtered_time = run(filtered, commits)
+        skipped = sum(result is None for result in after)
+        same = [result or [] for result in before] == [result or [] for result in after]
+        print(f"{label}: decode all {num_commits / legacy_time:9,.0f} events/s   "
+              f"pre-filtered {num_commits / filtered_time:9,.0f} events/s   "
+              f"x{legacy_time / filtered_time:.1f}   {skipped / num_commits:.1%} skipped   same output: {same}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+/user/<id> latency and response size for a prolific creator: the previous
+show_user_gallery (every row fetched and rendered, stats aggregated with
+COUNT/SUM/MIN on each view) against the keyset-paginated page with
+user_summaries stats, uncached and from gallery_cache.
+
+Runs the Flask app against a seeded database in a temporary directory.
+
+    python benchmarks/bench_gallery.py [images] [requests]
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import storage
+
+def legacy_gallery(app, user_id):
+    """The previous show_user_gallery: all rows, aggregate stats, one page."""
+    from main import bytes_to_color_hash, bytes_to_colors
+    from flask import render_template
+    conn = storage.connection()
+    rows = conn.execute(
+        'SELECT color_hash, perceptual_hash, created_at, query_count FROM image_hashes '
+        'WHERE user_id = ? ORDER BY created_at DESC', (user_id,)
+    ).fetchall()
+    stats = conn.execute(
+        'SELECT COUNT(*), SUM(query_count), MIN(created_at) FROM image_hashes WHERE user_id = ?', (user_id,)
+    ).fetchone()
+    images = [{'color_hash': bytes_to_color_hash(color_hash), 'perceptual_hash': storage.int_to_perceptual_hash(phash),
+               'created_at': created_at, 'query_count': query_count, 'colors': bytes_to_colors(color_hash)}
+              for color_hash, phash, created_at, query_count in rows]
+    with app.test_request_context(f'/user/{user_id}'):
+        return render_template('user.html', user_id=user_id, images=images, total_images=stats[0],
+                               total_queries=stats[1] or 0, first_upload=stats[2] or 'No uploads yet',
+                               older_url=None, newest_url=None)
+
+def timed(fn, repeats):
+    latencies = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        size = fn()
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    return latencies[len(latencies) // 2], size
+
+def main():
+    num_images = int(sys.argv[1]) if len(sys.argv) > 1 else 20_000
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    rng = random.Random(0)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        storage.use_database(str(Path(tmp) / 'images.db'))
+        storage.migrate()
+        storage.insert_image_hashes('creator', [(rng.getrandbits(31), rng.randbytes(36)) for _ in range(num_images)])
+        import app as web  # uses the database above
+
+        client = web.app.test_client()
+        page_size = web.app.config['GALLERY_PAGE_SIZE']
+        deep_row = storage.user_images('creator', num_images // 2 + 1)[-1]
+        deep_cursor = web.encode_gallery_cursor(deep_row[3], deep_row[0])
+        print(f"{num_images:,} images for one user, {page_size} per page, median of {repeats} requests\n")
+
+        def paged(url, cached):
+            if not cached:
+                web.gallery_cache.clear()
+            return len(client.get(url).data)
+
+        cases = [
+            ("previous: whole gallery", lambda: len(legacy_gallery(web.app, 'creator'))),
+            ("first page, uncached", lambda: paged('/user/creator', False)),
+            ("middle page, uncached", lambda: paged(f'/user/creator?before={deep_cursor}', False)),
+            ("first page, cached", lambda: paged('/user/creator', True)),
+        ]
+        with open(os.devnull, 'w') as devnull:
+            stdout, sys.stdout = sys.stdout, devnull  # show_user_gallery prints per request
+            results = [(label, *timed(fn, repeats)) for label, fn in cases]
+            sys.stdout = stdout
+        for label, latency, size in results:
+            print(f"{label:<26} {latency * 1000:9.2f} ms   {size / 1024:9.1f} KiB")
+        storage.view_counts.close()
+        storage.get_pool().close_all()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+"""
+HammingIndex build and query timings at 1M synthetic hashes, against a
+vectorized full scan (NumPy XOR + popcount) as the O(N) baseline.
+
+    python benchmarks/bench_hash_index.py [num_hashes] [num_queries]
+"""
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from hash_index import HammingIndex
+from main import HASH_BITS
+
+def main():
+    num_hashes = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    num_queries = int(sys.argv[2]) if len(sys.argv) > 2 else 1_000
+    rng = np.random.default_rng(0)
+    hashes = rng.integers(0, 1 << HASH_BITS, num_hashes, dtype=np.uint64)
+
+    index = HammingIndex(bits=HASH_BITS)
+    start = time.perf_counter()
+    index.update(hashes.tolist())
+    print(f"built index of {len(index):,} hashes in {time.perf_counter() - start:.2f} s\n")
+
+    # Queries are stored hashes with a few random bits flipped
+    picks = rng.choice(hashes, num_queries)
+    flips = [sum(1 << int(b) for b in rng.choice(HASH_BITS, 2, replace=False)) for _ in range(num_queries)]
+    queries = [int(h) ^ f for h, f in zip(picks, flips)]
+
+    scan_queries = queries[:max(1, num_queries // 20)]
+    start = time.perf_counter()
+    for q in scan_queries:
+        distances = np.bitwise_count(hashes ^ np.uint64(q))
+        np.flatnonzero(distances <= 3)
+    scan_ms = (time.perf_counter() - start) * 1000 / len(scan_queries)
+    print(f"{'full scan, k<=3':<20} {scan_ms:8.3f} ms/query")
+
+    for k in range(0, 6):
+        start = time.perf_counter()
+        found = sum(len(index.query(q, k)) for q in queries)
+        elapsed_ms = (time.perf_counter() - start) * 1000 / num_queries
+        print(f"{f'index, k<={k}':<20} {elapsed_ms:8.3f} ms/query  "
+              f"({found / num_queries:.2f} hits/query, x{scan_ms / elapsed_ms:.0f} vs scan)")
+
+if __name__ == "__main__":
+    main()
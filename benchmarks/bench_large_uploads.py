@@ -0,0 +1,155 @@
+"""
+Peak memory and time of process_upload on large uploads, against the
+previous implementation (embedded below): that one converted the whole
+image to RGB, hashed it at full size and painted the bar onto a full
+copy, so it held two or three full-size buffers per request.
+
+Each case runs in a fresh interpreter that imports main, reads the upload
+bytes and then processes them once. The peak reported is the resident
+set's high-water mark after processing (VmHWM) minus the resident set
+just before it (VmRSS), so Linux only: what one request adds to a warm
+worker. Multiply by workers per host to size a machine.
+
+It also reports how many of the 128 perceptual_hash bits the reduced-scale
+decode changes compared with a full-size hash. /process and /verify both
+hash an image over LARGE_IMAGE_PIXELS the reduced way, so this does not
+affect verification; it only says how different the mode's hashes are.
+
+    python benchmarks/bench_large_uploads.py [--megapixels 12 24 48]
+"""
+import argparse
+import io
+import json
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import numpy as np
+from PIL import Image
+
+from main import (
+    process_upload,
+    phash_dhash_combo,
+    generate_color_uuid_from_hash,
+    create_color_bar,
+    verify_image_colors,
+    compare_bar_colors,
+    JPG_QUALITY,
+    LARGE_IMAGE_PIXELS,
+    MAX_IMAGE_PIXELS,
+)
+
+# ─────────────────────────────────────────────────────────
+# Configuration
+# ─────────────────────────────────────────────────────────
+MEGAPIXELS = (12, 24, 48)   # 4:3 photos, as phones take them
+UPLOAD_QUALITY = 90
+
+def legacy_process_upload(fp, output_folder):
+    """process_upload before large-image mode."""
+    if isinstance(fp, (bytes, bytearray)):
+        fp = io.BytesIO(fp)
+    img = Image.open(fp).convert('RGB')
+    perceptual_hash = phash_dhash_combo(img)
+    uuid_colors, color_hash = generate_color_uuid_from_hash(img, None, perceptual_hash)
+    bar_img = create_color_bar(uuid_colors, img.width, img.height)
+    processed_img = img.copy()
+    processed_img.paste(bar_img, (img.width - bar_img.width, img.height - bar_img.height))
+    detected_colors = verify_image_colors(processed_img)
+    compare_bar_colors(uuid_colors, detected_colors)
+    output_path = Path(output_folder) / f"{color_hash}.jpg"
+    processed_img.save(output_path, format="JPEG", quality=JPG_QUALITY)
+    return perceptual_hash
+
+def current_process_upload(fp, output_folder):
+    return process_upload(fp, output_folder, max_pixels=1 << 40)['perceptual_hash']
+
+IMPLEMENTATIONS = {'legacy': legacy_process_upload, 'current': current_process_upload}
+
+# ─────────────────────────────────────────────────────────
+# Inputs
+# ─────────────────────────────────────────────────────────
+
+def photo_jpeg(megapixels, path):
+    """A 4:3 gradient-plus-noise JPEG of about megapixels, written in strips."""
+    width = int((megapixels * 1e6 * 4 / 3) ** 0.5) // 16 * 16
+    height = width * 3 // 4
+    img = Image.new('RGB', (width, height))
+    rng = np.random.default_rng(int(megapixels))
+    strip = 512
+    for top in range(0, height, strip):
+        rows = min(strip, height - top)
+        y, x = np.ogrid[top:top + rows, 0:width]
+        block = np.empty((rows, width, 3), dtype=np.uint8)
+        block[..., 0] = x * 220 // width
+        block[..., 1] = y * 220 // height
+        block[..., 2] = (x + y) * 220 // (width + height)
+        block += rng.integers(0, 24, (rows, width, 3), dtype=np.uint8)
+        img.paste(Image.fromarray(block, 'RGB'), (0, top))
+    img.save(path, format='JPEG', quality=UPLOAD_QUALITY)
+    return width, height
+
+def hamming(a, b):
+    return bin(int(a, 16) ^ int(b, 16)).count('1')
+
+# ─────────────────────────────────────────────────────────
+# Measurement
+# ─────────────────────────────────────────────────────────
+
+def memory_kib(field):
+    """
+    VmRSS (resident now) or VmHWM (its peak) of this process. Not
+    ru_maxrss: Linux carries that over from the parent through fork and
+    exec, so a worker would start at the harness's own peak.
+    """
+    for line in Path('/proc/self/status').read_text().splitlines():
+        if line.startswith(field + ':'):
+            return int(line.split()[1])
+    raise RuntimeError(f"no {field} in /proc/self/status")
+
+def worker(name, path, output_folder):
+    """Run in a fresh interpreter: process one upload, print JSON."""
+    data = Path(path).read_bytes()
+    before = memory_kib('VmRSS')
+    start = time.perf_counter()
+    perceptual_hash = IMPLEMENTATIONS[name](data, output_folder)
+    seconds = time.perf_counter() - start
+    after = memory_kib('VmHWM')
+    print(json.dumps({'peak_kib': after - before, 'seconds': seconds, 'perceptual_hash': perceptual_hash}))
+
+def measure(name, path, output_folder):
+    result = subprocess.run([sys.executable, __file__, '--worker', name, str(path), output_folder],
+                            capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('--megapixels', type=float, nargs='+', default=MEGAPIXELS)
+    parser.add_argument('--worker', nargs=3, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.worker:
+        worker(*args.worker)
+        return
+
+    print(f"LARGE_IMAGE_PIXELS {LARGE_IMAGE_PIXELS:,}, MAX_IMAGE_PIXELS {MAX_IMAGE_PIXELS:,}\n")
+    print(f"{'upload':<22} {'legacy peak':>12} {'current peak':>13} {'ratio':>6} "
+          f"{'legacy':>9} {'current':>9} {'hash bits changed':>18}")
+    with tempfile.TemporaryDirectory() as folder:
+        for megapixels in args.megapixels:
+            path = Path(folder) / f'{megapixels:g}mp.jpg'
+            width, height = photo_jpeg(megapixels, path)
+            legacy = measure('legacy', path, folder)
+            current = measure('current', path, folder)
+            label = f"{width}x{height} ({path.stat().st_size / 2**20:.1f} MiB)"
+            print(f"{label:<22} {legacy['peak_kib'] / 1024:>9.0f} MiB {current['peak_kib'] / 1024:>10.0f} MiB "
+                  f"{current['peak_kib'] / legacy['peak_kib']:>6.2f} {legacy['seconds'] * 1000:>7.0f}ms "
+                  f"{current['seconds'] * 1000:>7.0f}ms "
+                  f"{hamming(legacy['perceptual_hash'], current['perceptual_hash']):>18}")
+
+if __name__ == "__main__":
+    main()
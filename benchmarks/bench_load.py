@@ -0,0 +1,399 @@
+"""
+End-to-end load test of the Flask app: how many /process, /verify and
+/<color_hash> requests per second one box takes before p99 latency falls
+apart, and how long writers wait for SQLite's lock on the way.
+
+By default it starts app.py in a throwaway directory with its own
+images.db and dummy Auth0 settings; uploads run as the anonymous user, so
+Auth0 is never contacted. Settings such as PROCESS_ASYNC or
+PROCESS_WORKERS pass through from the environment. The server is Flask's
+threaded development server, the only one installed with the app. To load
+a production-style server (e.g. gunicorn) instead, start it yourself and
+pass --url.
+
+It seeds the app with corpus uploads, then runs each concurrency level
+for --duration seconds. Each client thread keeps one keep-alive
+connection and picks every request from the --mix weights:
+
+- process: POST /process with a corpus image cropped so every upload is a
+  new registration
+- verify: POST /verify with a barcoded output image
+- view: GET /<color_hash> for a seeded image
+
+Per level and endpoint it reports:
+
+- requests per second
+- p50/p95/p99 latency
+- error rate (connection failures and 4xx/5xx)
+
+From /metrics it adds the SQLite write-lock waits per operation and the
+"database is locked" timeouts. The client runs in the same box and
+interpreter as the server, so the highest levels partly measure the
+client; compare runs made on the same machine only.
+
+    python benchmarks/bench_load.py [--concurrency 1 4 16 32] [--duration 10]
+        [--mix process=1,verify=4,view=15] [--url http://host:port] [--output load.json]
+"""
+import argparse
+import http.client
+import io
+import itertools
+import json
+import os
+import random
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import defaultdict
+from pathlib import Path
+from urllib.parse import urlsplit
+
+import numpy as np
+from PIL import Image
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+# ─────────────────────────────────────────────────────────
+# Configuration
+# ─────────────────────────────────────────────────────────
+DEFAULT_MIX = 'process=1,verify=4,view=15'
+DEFAULT_CONCURRENCY = (1, 4, 16, 32)
+SEED_IMAGES = 50            # Corpus uploads made before the first level
+UPLOAD_VARIANTS = 400       # Distinct /process payloads prepared up front
+REQUEST_TIMEOUT = 60        # Seconds before a request counts as an error
+STARTUP_TIMEOUT = 60        # Seconds to wait for the spawned server
+PERCENTILES = (50, 95, 99)
+
+# ─────────────────────────────────────────────────────────
+# Server
+# ─────────────────────────────────────────────────────────
+
+def serve(args):
+    """Run app.py against args.db from the current directory (the spawned server)."""
+    import storage
+    storage.use_database(args.db)
+    storage.migrate()
+    import app as web  # uses the database above
+    web.app.run(host='127.0.0.1', port=args.port, threaded=True, use_reloader=False)
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def start_server(workdir):
+    port = free_port()
+    env = {
+        **os.environ,
+        'AUTH0_DOMAIN': 'auth0.invalid',
+        'AUTH0_CLIENT_ID': 'load-test',
+        'AUTH0_CLIENT_SECRET': 'load-test',
+        'FLASK_SECRET_KEY': uuid.uuid4().hex,
+    }
+    log = open(Path(workdir) / 'server.log', 'w')
+    server = subprocess.Popen(
+        [sys.executable, str(Path(__file__).resolve()), 'serve', '--port', str(port),
+         '--db', str(Path(workdir) / 'images.db')],
+        cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT
+    )
+    base_url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            sys.exit(f"server exited with {server.returncode}, see {log.name}")
+        try:
+            if Client(base_url).request('GET', '/metrics')[0] == 200:
+                return server, base_url
+        except OSError:
+            time.sleep(0.2)
+    server.kill()
+    sys.exit(f"server did not answer within {STARTUP_TIMEOUT} s, see {log.name}")
+
+# ─────────────────────────────────────────────────────────
+# Client
+# ─────────────────────────────────────────────────────────
+
+class Client:
+    """One keep-alive HTTP connection, reopened whenever the server closes it."""
+
+    def __init__(self, base_url):
+        parts = urlsplit(base_url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self._conn = None
+
+    def request(self, method, path, body=None, headers=None):
+        """(status, body bytes); raises OSError or HTTPException on failure."""
+        if self._conn is None:
+            self._conn = http.client.HTTPConnection(self.host, self.port, timeout=REQUEST_TIMEOUT)
+        try:
+            self._conn.request(method, path, body=body, headers=headers or {})
+            response = self._conn.getresponse()
+            data = response.read()
+        except (OSError, http.client.HTTPException):
+            self.close()
+            raise
+        if response.will_close:
+            self.close()
+        return response.status, data
+
+    def upload(self, path, data):
+        boundary = uuid.uuid4().hex
+        body = (f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="upload.jpg"\r\n'
+                f'Content-Type: image/jpeg\r\n\r\n').encode() + data + f'\r\n--{boundary}--\r\n'.encode()
+        return self.request('POST', path, body, {'Content-Type': f'multipart/form-data; boundary={boundary}'})
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+def parse_metrics(text):
+    """{(name, frozenset(labels)): value} from Prometheus text format."""
+    samples = {}
+    for line in text.splitlines():
+        match = re.match(r'^([a-zA-Z_:][\w:]*)(?:\{(.*)\})? (\S+)$', line)
+        if match:
+            name, labels, value = match.groups()
+            pairs = frozenset(re.findall(r'(\w+)="((?:[^"\\]|\\.)*)"', labels or ''))
+            samples[(name, pairs)] = float(value)
+    return samples
+
+def scrape(client):
+    try:
+        status, body = client.request('GET', '/metrics')
+    except (OSError, http.client.HTTPException):
+        return {}
+    return parse_metrics(body.decode()) if status == 200 else {}
+
+# ─────────────────────────────────────────────────────────
+# Workload
+# ─────────────────────────────────────────────────────────
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        if name not in WORKLOAD:
+            raise argparse.ArgumentTypeError(f"unknown endpoint {name!r}, expected one of {sorted(WORKLOAD)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+def jpeg(img, quality=90):
+    buffer = io.BytesIO()
+    img.save(buffer, 'JPEG', quality=quality)
+    return buffer.getvalue()
+
+def upload_variants(corpus, count, rng):
+    """
+    count JPEGs cut from the corpus whose (perceptual_hash, color_hash)
+    pairs are all new, so every /process upload inserts a row.
+    """
+    from main import phash_dhash_combo
+
+    seen, variants = set(), []
+    for attempt in range(count * 20):
+        if len(variants) == count:
+            break
+        img = corpus[attempt % len(corpus)]
+        scale = rng.uniform(0.7, 0.95)
+        width, height = int(img.width * scale), int(img.height * scale)
+        left, top = rng.randint(0, img.width - width), rng.randint(0, img.height - height)
+        variant = img.crop((left, top, left + width, top + height))
+        key = phash_dhash_combo(variant)
+        if key not in seen:
+            seen.add(key)
+            variants.append(jpeg(variant))
+    return variants
+
+class Workload:
+    """The payloads every client thread shares."""
+
+    def __init__(self, uploads, verifies, color_hashes):
+        self.verifies = verifies
+        self.color_hashes = color_hashes
+        self._uploads = itertools.cycle(uploads)  # Repeats once exhausted: then duplicates
+        self._lock = threading.Lock()
+
+    def next_upload(self):
+        with self._lock:
+            return next(self._uploads)
+
+def do_process(client, workload, rng):
+    return client.upload('/process', workload.next_upload())
+
+def do_verify(client, workload, rng):
+    return client.upload('/verify', rng.choice(workload.verifies))
+
+def do_view(client, workload, rng):
+    return client.request('GET', f'/{rng.choice(workload.color_hashes)}')
+
+WORKLOAD = {'process': do_process, 'verify': do_verify, 'view': do_view}
+
+def seed(client, corpus):
+    """Upload corpus images; returns their color_hashes and barcoded outputs."""
+    color_hashes, outputs = [], []
+    for img in corpus[:SEED_IMAGES]:
+        status, body = client.upload('/process', jpeg(img))
+        if status != 200:
+            sys.exit(f"seed upload failed with {status}: {body[:200]!r}")
+        color_hash = json.loads(body)['color_hash']
+        status, data = client.request('GET', f'/images/output/{color_hash}.jpg')
+        if status != 200:
+            sys.exit(f"fetching the output of a seed upload failed with {status}")
+        color_hashes.append(color_hash)
+        outputs.append(data)
+    return color_hashes, outputs
+
+# ─────────────────────────────────────────────────────────
+# Load levels
+# ─────────────────────────────────────────────────────────
+
+def run_level(base_url, workload, mix, concurrency, duration, seed_value):
+    """{endpoint: [(latency seconds, ok), ...]} and the wall time of one level."""
+    names, weights = list(mix), list(mix.values())
+    start = threading.Barrier(concurrency + 1)
+    results = [defaultdict(list) for _ in range(concurrency)]
+    deadline = None
+
+    def worker(index):
+        rng = random.Random(seed_value * 1000 + index)
+        client = Client(base_url)
+        start.wait()
+        while time.monotonic() < deadline:
+            name = rng.choices(names, weights)[0]
+            began = time.perf_counter()
+            try:
+                status, _ = WORKLOAD[name](client, workload, rng)
+                ok = status < 400
+            except (OSError, http.client.HTTPException):
+                ok = False
+            results[index][name].append((time.perf_counter() - began, ok))
+        client.close()
+
+    threads = [threading.Thread(target=worker, args=(index,), daemon=True) for index in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    deadline = time.monotonic() + duration
+    began = time.perf_counter()
+    start.wait()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - began
+
+    merged = defaultdict(list)
+    for result in results:
+        for name, records in result.items():
+            merged[name].extend(records)
+    return merged, elapsed
+
+def summarize(records, elapsed):
+    latencies = np.array([latency for latency, _ in records])
+    errors = sum(1 for _, ok in records if not ok)
+    return {
+        'requests': len(records),
+        'rps': len(records) / elapsed,
+        **{f'p{p}': float(np.percentile(latencies, p)) for p in PERCENTILES},
+        'error_rate': errors / len(records),
+    }
+
+def lock_waits(before, after):
+    """{operation: {'waits', 'seconds', 'timeouts'}} between two scrapes."""
+    waits = defaultdict(lambda: {'waits': 0, 'seconds': 0.0, 'timeouts': 0})
+    for (name, labels), value in after.items():
+        operation = dict(labels).get('operation')
+        delta = value - before.get((name, labels), 0.0)
+        if operation is None or not delta:
+            continue
+        if name == 'leviathan_db_lock_wait_seconds_count':
+            waits[operation]['waits'] = int(delta)
+        elif name == 'leviathan_db_lock_wait_seconds_sum':
+            waits[operation]['seconds'] = delta
+        elif name == 'leviathan_db_lock_timeouts_total':
+            waits[operation]['timeouts'] = int(delta)
+    return dict(waits)
+
+def load(args):
+    rng = random.Random(args.seed)
+    corpus = [Image.open(path).convert('RGB') for path in sorted(Path(args.images).glob('*.JPEG'))]
+    if not corpus:
+        sys.exit(f"no *.JPEG files in {args.images}")
+    rng.shuffle(corpus)
+    print(f"preparing {UPLOAD_VARIANTS} distinct uploads from {len(corpus)} corpus images", file=sys.stderr)
+    uploads = upload_variants(corpus, UPLOAD_VARIANTS, rng)
+
+    workdir = server = None
+    base_url = args.url
+    try:
+        if base_url is None:
+            workdir = tempfile.mkdtemp(prefix='leviathan-load-')
+            server, base_url = start_server(workdir)
+        client = Client(base_url)
+        color_hashes, outputs = seed(client, corpus)
+        workload = Workload(uploads, outputs, color_hashes)
+        print(f"{base_url}: seeded {len(color_hashes)} images, mix {args.mix}, {args.duration:g} s per level\n")
+
+        report = {'mix': args.mix, 'duration': args.duration, 'levels': []}
+        for level, concurrency in enumerate(args.concurrency):
+            before = scrape(client)
+            records, elapsed = run_level(base_url, workload, args.mix, concurrency, args.duration, args.seed + level)
+            waits = lock_waits(before, scrape(client))
+            endpoints = {name: summarize(records[name], elapsed) for name in args.mix if records[name]}
+            total = sum(result['requests'] for result in endpoints.values())
+            report['levels'].append({'concurrency': concurrency, 'rps': total / elapsed,
+                                     'endpoints': endpoints, 'lock_waits': waits})
+
+            print(f"concurrency {concurrency}: {total / elapsed:.1f} requests/s")
+            print(f"  {'endpoint':<10} {'requests':>9} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} "
+                  f"{'p99 ms':>9} {'errors':>7}")
+            for name, result in endpoints.items():
+                print(f"  {name:<10} {result['requests']:>9} {result['rps']:>8.1f} {result['p50'] * 1000:>9.1f} "
+                      f"{result['p95'] * 1000:>9.1f} {result['p99'] * 1000:>9.1f} {result['error_rate']:>7.1%}")
+            for operation, wait in sorted(waits.items()):
+                print(f"  lock {operation:<20} {wait['waits']:>6} waits   "
+                      f"{wait['seconds'] / max(wait['waits'], 1) * 1000:7.2f} ms mean   "
+                      f"{wait['timeouts']} timeouts")
+            print()
+
+        if args.output:
+            Path(args.output).write_text(json.dumps(report, indent=2) + '\n')
+            print(f"wrote {args.output}")
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=30)
+        if workdir is not None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    commands = parser.add_subparsers(dest='command')
+
+    serve_parser = commands.add_parser('serve', help=argparse.SUPPRESS)
+    serve_parser.add_argument('--port', type=int, required=True)
+    serve_parser.add_argument('--db', required=True)
+
+    parser.add_argument('--concurrency', type=int, nargs='+', default=list(DEFAULT_CONCURRENCY),
+                        help="client threads per level")
+    parser.add_argument('--duration', type=float, default=10, help="seconds per level")
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix(DEFAULT_MIX),
+                        help=f"endpoint weights (default {DEFAULT_MIX})")
+    parser.add_argument('--url', help="load this running server instead of starting one")
+    parser.add_argument('--images', default=str(ROOT / 'images'), help="corpus directory")
+    parser.add_argument('--seed', type=int, default=1, help="random seed")
+    parser.add_argument('--output', help="write results to this JSON file")
+
+    args = parser.parse_args()
+    if args.command == 'serve':
+        serve(args)
+    else:
+        load(args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Color bar locator timings and recall on barcoded corpus images that have
+been rescaled, padded into a larger screenshot or cropped, compared with
+the fixed bottom-right geometry of verify_image_colors.
+
+A case counts as located if any returned candidate reads back colors that
+pass compare_bar_colors against the embedded ones. Bars narrower than
+MIN_LOCATED_WIDTH are reported separately; they are not searched for.
+
+    python benchmarks/bench_locator.py [image_dir] [num_images]
+"""
+import io
+import sys
+import time
+from collections import defaultdict
+from pathlib import Path
+
+from PIL import Image
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from main import (
+    phash_dhash_combo,
+    generate_color_uuid_from_hash,
+    create_color_bar,
+    verify_image_colors,
+    compare_bar_colors,
+    bar_geometry,
+)
+from locator import MIN_LOCATED_WIDTH, locate_color_bar_candidates, read_located_colors
+
+def recompress(img, quality=85):
+    buffer = io.BytesIO()
+    img.save(buffer, "JPEG", quality=quality)
+    return Image.open(io.BytesIO(buffer.getvalue())).convert("RGB")
+
+def barcoded(path, upscale=4):
+    img = Image.open(path).convert("RGB")
+    img = img.resize((img.width * upscale, img.height * upscale), Image.Resampling.LANCZOS)
+    colors, _ = generate_color_uuid_from_hash(img, None, phash_dhash_combo(img))
+    bar = create_color_bar(colors, *img.size)
+    img.paste(bar, (img.width - bar.width, img.height - bar.height))
+    return recompress(img), colors, bar_geometry(*img.size)[0]
+
+def screenshot(img, scale, size=(3840, 2160), margin=(60, 40)):
+    """Scale img to fit a 4K canvas and paste it with a margin, as a screen capture would."""
+    fit = min((size[0] - 2 * margin[0]) / img.width, (size[1] - 2 * margin[1]) / img.height, scale)
+    shown = img.resize((int(img.width * fit), int(img.height * fit)), Image.Resampling.BILINEAR)
+    canvas = Image.new("RGB", size, (32, 33, 36))
+    canvas.paste(shown, (size[0] - margin[0] - shown.width, size[1] - margin[1] - shown.height))
+    return recompress(canvas), fit
+
+def variants(img, bar_width):
+    yield "intact", img, bar_width
+    for scale in (0.9, 0.6, 1.3):
+        resized = img.resize((int(img.width * scale), int(img.height * scale)), Image.Resampling.BILINEAR)
+        yield f"resize {scale}", recompress(resized), bar_width * scale
+    shot, fit = screenshot(img, 2.0)
+    yield "4K screenshot", shot, bar_width * fit
+    cropped = img.crop((img.width // 5, img.height // 6, img.width, img.height))
+    yield "crop", recompress(cropped), bar_width
+
+def main():
+    image_dir = sys.argv[1] if len(sys.argv) > 1 else "images"
+    limit = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    paths = sorted(Path(image_dir).glob("*.JPEG"))[:limit]
+    print(f"{len(paths)} images from {image_dir}\n")
+
+    stats = defaultdict(lambda: defaultdict(float))
+    for path in paths:
+        img, colors, bar_width = barcoded(path)
+        for name, case, case_width in variants(img, bar_width):
+            row = stats[name]
+            row["cases"] += 1
+            row["readable"] += case_width >= MIN_LOCATED_WIDTH
+            _, _, count, required = compare_bar_colors(colors, verify_image_colors(case))
+            row["fixed"] += count >= required
+
+            start = time.perf_counter()
+            candidates = locate_color_bar_candidates(case)
+            row["ms"] += (time.perf_counter() - start) * 1000
+            row["pixels"] = max(row["pixels"], case.width * case.height)
+            for rank, location in enumerate(candidates):
+                _, _, count, required = compare_bar_colors(colors, read_located_colors(case, location))
+                if count >= required:
+                    row["located"] += 1
+                    row["first"] += rank == 0
+                    break
+
+    print(f"{'case':<15} {'fixed':>6} {'located':>8} {'(first)':>8} {'bar>=4px':>9} {'ms/image':>9} {'max MP':>7}")
+    for name, row in stats.items():
+        n = int(row["cases"])
+        print(f"{name:<15} {int(row['fixed']):>3}/{n:<2} {int(row['located']):>5}/{n:<2} "
+              f"{int(row['first']):>8} {int(row['readable']):>9} {row['ms'] / n:9.1f} {row['pixels'] / 1e6:7.1f}")
+
+if __name__ == "__main__":
+    main()
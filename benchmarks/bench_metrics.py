@@ -0,0 +1,73 @@
+"""
+What the metrics layer costs: each recording call, a /metrics scrape of a
+registry filled the way a busy app fills it, and the slowdown of a request
+while the opt-in stack sampler is profiling it.
+
+A /process request makes about 20 recording calls (6 stage laps and their
+observations, a DB timer, the upload size and image size, the request
+counter and latency), so per-request overhead is roughly 20x the
+per-call figures below.
+
+    python benchmarks/bench_metrics.py [iterations]
+"""
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import metrics
+from main import phash_dhash_combo
+from PIL import Image
+
+def per_call(fn, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - start) / iterations
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    registry = metrics.Registry()
+    histogram = registry.register(metrics.Histogram('bench_seconds', "Bench.", ['stage']))
+    counter = registry.register(metrics.Counter('bench_total', "Bench.", ['endpoint', 'method', 'status']))
+    watch = metrics.Stopwatch()
+
+    def timed():
+        with histogram.time(stage='db'):
+            pass
+
+    calls = [
+        ("Counter.inc", lambda: counter.inc(endpoint='process_image', method='POST', status=200)),
+        ("Histogram.observe", lambda: histogram.observe(0.0123, stage='decode')),
+        ("Histogram.time (empty block)", timed),
+        ("Stopwatch.lap", lambda: watch.lap('decode')),
+    ]
+    print(f"{iterations} calls each\n")
+    for label, fn in calls:
+        print(f"{label:<30} {per_call(fn, iterations) * 1e9:8.0f} ns/call")
+
+    # A scrape: 10 endpoints x 3 statuses, 20 stages, each histogram 13 buckets
+    for endpoint in range(10):
+        for status in (200, 404, 500):
+            counter.inc(endpoint=f'endpoint_{endpoint}', method='GET', status=status)
+    for stage in range(20):
+        histogram.observe(0.01, stage=f'stage_{stage}')
+    scrapes = 200
+    text = registry.render()
+    print(f"\n{'render (' + str(len(text.splitlines())) + ' lines)':<30} "
+          f"{per_call(registry.render, scrapes) * 1000:8.2f} ms/scrape")
+
+    # Profiler: time the perceptual hash of a 12 MP image with and without
+    # a sampler walking this thread's stack every PROFILE_INTERVAL
+    img = Image.new('RGB', (4032, 3024), (120, 80, 40))
+    repeats = 20
+    plain = per_call(lambda: phash_dhash_combo(img), repeats)
+    sampler = metrics.StackSampler().start()
+    sampled = per_call(lambda: phash_dhash_combo(img), repeats)
+    stacks = sampler.stop()
+    print(f"{'phash, 12 MP':<30} {plain * 1000:8.2f} ms   profiled {sampled * 1000:8.2f} ms   "
+          f"x{sampled / plain:.3f}   {sum(stacks.values())} samples")
+
+if __name__ == "__main__":
+    main()
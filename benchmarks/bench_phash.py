@@ -0,0 +1,97 @@
+"""
+phash_dhash_combo timings by image size: the original implementation
+(two full-size grayscale conversions + scipy DCT) against the current one,
+on a full decode and on a reduced-scale decode (hash_image_file).
+
+Also checks that every file in images/ hashes exactly as before.
+
+    python benchmarks/bench_phash.py [image_dir]
+"""
+import io
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from main import phash_dhash_combo, hash_image_file
+
+SIZES = [256, 512, 1024, 2048, 4096, 8192]
+REPEAT = 3
+
+# ─────────────────────────────────────────────────────────
+# Legacy baseline
+# ─────────────────────────────────────────────────────────
+
+def legacy_phash_dhash_combo(image, hash_size=4):
+    from scipy.fftpack import dct  # baseline only; no longer a dependency
+
+    gray_phash = image.convert('L').resize((hash_size, hash_size), Image.Resampling.LANCZOS)
+    phash_pixels = np.asarray(gray_phash, dtype=float)
+    dct_low = dct(dct(phash_pixels, axis=0), axis=1)[:hash_size, :hash_size]
+    avg = (dct_low[0, 1:].sum() + dct_low[1:, :].sum()) / (hash_size * hash_size - 1)
+    phash_bits = ''.join(['1' if val >= avg else '0' for val in dct_low.flatten()[1:]])
+
+    gray_dhash = image.convert('L').resize((hash_size + 1, hash_size), Image.Resampling.LANCZOS)
+    dhash_pixels = np.asarray(gray_dhash, dtype=float)
+    dhash_bits = ''.join([
+        '1' if dhash_pixels[i, j] > dhash_pixels[i, j + 1] else '0'
+        for i in range(hash_size)
+        for j in range(hash_size)
+    ])
+    return hex(int(phash_bits + dhash_bits, 2))[2:].rjust(16, '0')
+
+# ─────────────────────────────────────────────────────────
+# Benchmark
+# ─────────────────────────────────────────────────────────
+
+def check_corpus(image_dir):
+    paths = [p for p in sorted(Path(image_dir).iterdir())
+             if p.suffix.lower() in ('.jpeg', '.jpg', '.png', '.webp')]
+    mismatches = []
+    for path in paths:
+        expected = legacy_phash_dhash_combo(Image.open(path).convert('RGB'))
+        if phash_dhash_combo(Image.open(path).convert('RGB')) != expected:
+            mismatches.append(f"{path.name} (full decode)")
+        if hash_image_file(path) != expected:
+            mismatches.append(f"{path.name} (reduced decode)")
+    print(f"hash check: {len(paths)} files, {len(mismatches)} mismatches")
+    for name in mismatches:
+        print(f"  {name}")
+
+def synthetic_jpeg(side):
+    """A smooth gradient plus noise, saved as a JPEG of side x side*3/4."""
+    rng = np.random.default_rng(side)
+    h, w = side * 3 // 4, side
+    y, x = np.mgrid[0:h, 0:w]
+    base = np.stack([x * 255 // w, y * 255 // h, (x + y) * 255 // (w + h)], axis=-1)
+    noise = rng.integers(0, 32, (h, w, 3))
+    buf = io.BytesIO()
+    Image.fromarray((base + noise).clip(0, 255).astype(np.uint8)).save(buf, 'JPEG', quality=90)
+    return buf.getvalue()
+
+def best_of(fn):
+    times = []
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times) * 1000
+
+def main():
+    image_dir = sys.argv[1] if len(sys.argv) > 1 else "images"
+    check_corpus(image_dir)
+    print()
+    print(f"{'size':>10} {'legacy ms':>10} {'full ms':>10} {'reduced ms':>11} {'speedup':>8}")
+    for side in SIZES:
+        data = synthetic_jpeg(side)
+        legacy = best_of(lambda: legacy_phash_dhash_combo(Image.open(io.BytesIO(data)).convert('RGB')))
+        full = best_of(lambda: phash_dhash_combo(Image.open(io.BytesIO(data)).convert('RGB')))
+        reduced = best_of(lambda: hash_image_file(io.BytesIO(data)))
+        print(f"{side:>10} {legacy:>10.1f} {full:>10.1f} {reduced:>11.1f} {legacy / reduced:>7.1f}x")
+
+if __name__ == "__main__":
+    main()
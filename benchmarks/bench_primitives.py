@@ -0,0 +1,301 @@
+"""
+Micro-benchmarks of the main.py imaging primitives, saved as JSON so two
+runs can be compared.
+
+Each primitive runs over the images/ corpus and over synthetic 16:9
+photos from 256 px wide to 8K (7680x4320). The URL codecs do not depend on
+image size, so they only run over the corpus. For every case the harness
+reports:
+
+- ops/sec
+- per-call latency percentiles (p50/p90/p99)
+- the peak of traced allocations during one call. tracemalloc sees
+  Python objects and numpy arrays, but not Pillow's own image buffers.
+
+Timing runs calls in batches of at least BATCH_SECONDS, with gc disabled
+as in timeit, until a case has run for MIN_SECONDS / ROUNDS and
+MIN_BATCHES, and every case is timed in each of ROUNDS passes. The
+percentiles are over the per-call time of all batches. 'best' is the
+fastest batch.
+
+    python benchmarks/bench_primitives.py run [--output results.json] [--quick] [--rounds N] [--only NAME ...]
+    python benchmarks/bench_primitives.py compare BASE.json NEW.json [--threshold 0.10] [--metric best]
+
+compare prints the ratio new/base for every case in both files and exits
+with status 1 if any case is slower than base by more than the threshold.
+It compares 'best' by default. Noise from other load only ever slows a
+batch down, so best moves far less between identical runs than p50 does.
+Only compare runs made on the same machine.
+"""
+import argparse
+import gc
+import itertools
+import json
+import platform
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from main import (
+    phash_dhash_combo,
+    generate_color_uuid_from_hash,
+    create_color_bar,
+    verify_image_colors,
+    encode_uuid_for_url,
+    decode_url_to_colors,
+)
+
+# ─────────────────────────────────────────────────────────
+# Configuration
+# ─────────────────────────────────────────────────────────
+SYNTHETIC_WIDTHS = (256, 512, 1024, 2048, 4096, 7680)  # 16:9, up to 8K
+CORPUS_PATTERN = '*.JPEG'
+BATCH_SECONDS = 0.01        # Shortest batch of calls timed as one sample
+MIN_SECONDS = 0.6           # Time spent sampling each case, split over ROUNDS
+ROUNDS = 3                  # Passes over every case
+MIN_BATCHES = 7             # Samples taken per case however slow it is
+QUICK_SECONDS = 0.1         # MIN_SECONDS with --quick
+PERCENTILES = (50, 90, 99)
+
+# ─────────────────────────────────────────────────────────
+# Inputs
+# ─────────────────────────────────────────────────────────
+
+def synthetic_image(width):
+    """A smooth gradient plus noise at width x width*9/16, like a photo."""
+    rng = np.random.default_rng(width)
+    height = width * 9 // 16
+    y, x = np.ogrid[0:height, 0:width]
+    base = np.empty((height, width, 3), dtype=np.uint8)
+    base[..., 0] = x * 240 // width
+    base[..., 1] = y * 240 // height
+    base[..., 2] = (x + y) * 240 // (width + height)
+    base += rng.integers(0, 16, (height, width, 3), dtype=np.uint8)
+    return Image.fromarray(base, 'RGB')
+
+def barcoded(img):
+    """img with its color bar pasted in, plus its colors and color_hash."""
+    uuid_colors, color_hash = generate_color_uuid_from_hash(img, None, phash_dhash_combo(img))
+    bar = create_color_bar(uuid_colors, img.width, img.height)
+    painted = img.copy()
+    painted.paste(bar, (img.width - bar.width, img.height - bar.height))
+    return painted, uuid_colors, color_hash
+
+def cases_for(images):
+    """{primitive: [args, ...]} over a set of decoded images."""
+    marked = [barcoded(img) for img in images]
+    return {
+        'phash_dhash_combo': [(img,) for img in images],
+        'create_color_bar': [(colors, img.width, img.height) for img, colors, _ in marked],
+        'verify_image_colors': [(img,) for img, _, _ in marked],
+        'encode_uuid_for_url': [(colors,) for _, colors, _ in marked],
+        'decode_url_to_colors': [(color_hash,) for _, _, color_hash in marked],
+    }
+
+PRIMITIVES = {
+    'phash_dhash_combo': phash_dhash_combo,
+    'create_color_bar': create_color_bar,
+    'verify_image_colors': verify_image_colors,
+    'encode_uuid_for_url': encode_uuid_for_url,
+    'decode_url_to_colors': decode_url_to_colors,
+}
+SIZE_INDEPENDENT = {'encode_uuid_for_url', 'decode_url_to_colors'}
+
+# ─────────────────────────────────────────────────────────
+# Measurement
+# ─────────────────────────────────────────────────────────
+
+def calls_per_batch(fn, inputs):
+    """
+    Calls per timed batch: a pass over every input (so batches of a corpus
+    are alike), doubled until a batch takes BATCH_SECONDS.
+    """
+    number = len(inputs)
+    while True:
+        args = itertools.islice(itertools.cycle(inputs), number)
+        start = time.perf_counter()
+        for call_args in args:
+            fn(*call_args)
+        if time.perf_counter() - start >= BATCH_SECONDS or number >= 1 << 20:
+            return number
+        number *= 2
+
+def time_batches(fn, inputs, min_seconds):
+    """Per-call seconds of each batch, and the calls and seconds they took."""
+    for call_args in inputs:  # Warm caches (DCT matrices, numpy dispatch)
+        fn(*call_args)
+    number = calls_per_batch(fn, inputs)
+    cycle = itertools.cycle(inputs)
+    samples = []
+    total = 0.0
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        while total < min_seconds or len(samples) < MIN_BATCHES:
+            args = list(itertools.islice(cycle, number))
+            start = time.perf_counter()
+            for call_args in args:
+                fn(*call_args)
+            elapsed = time.perf_counter() - start
+            samples.append(elapsed / number)
+            total += elapsed
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+    return samples, len(samples) * number, total
+
+def peak_allocation(fn, inputs):
+    """Largest tracemalloc peak of one call over the inputs."""
+    peak = 0
+    for call_args in inputs:
+        tracemalloc.start()
+        fn(*call_args)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return peak
+
+def summarize(samples, calls, seconds, peak):
+    latencies = np.array(samples)
+    return {
+        'calls': calls,
+        'ops_per_sec': calls / seconds,
+        'best': float(latencies.min()),
+        **{f'p{p}': float(np.percentile(latencies, p)) for p in PERCENTILES},
+        'peak_bytes': peak,
+    }
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def format_seconds(seconds):
+    if seconds < 1e-3:
+        return f"{seconds * 1e6:8.1f} us"
+    return f"{seconds * 1e3:8.2f} ms"
+
+# ─────────────────────────────────────────────────────────
+# Commands
+# ─────────────────────────────────────────────────────────
+
+def run(args):
+    min_seconds = QUICK_SECONDS if args.quick else MIN_SECONDS
+    corpus = [Image.open(path).convert('RGB') for path in sorted(Path(args.images).glob(CORPUS_PATTERN))]
+    if not corpus:
+        sys.exit(f"no {CORPUS_PATTERN} files in {args.images}")
+    widths = SYNTHETIC_WIDTHS[:3] if args.quick else SYNTHETIC_WIDTHS
+
+    sets = [('corpus', corpus)] + [(f'{width}px', [synthetic_image(width)]) for width in widths]
+    cases = {}
+    for label, images in sets:
+        inputs = cases_for(images)
+        for name, fn in PRIMITIVES.items():
+            if args.only and name not in args.only:
+                continue
+            if label != 'corpus' and name in SIZE_INDEPENDENT:
+                continue
+            cases[f'{name}/{label}'] = (fn, inputs[name])
+
+    # Every round times every case, so a spell of load from elsewhere on
+    # the machine lands in one round of a few cases rather than all of one
+    timings = {key: ([], 0, 0.0) for key in cases}
+    for round_number in range(args.rounds):
+        print(f"round {round_number + 1}/{args.rounds}", file=sys.stderr)
+        for key, (fn, inputs) in cases.items():
+            samples, calls, seconds = time_batches(fn, inputs, min_seconds / args.rounds)
+            all_samples, all_calls, all_seconds = timings[key]
+            timings[key] = (all_samples + samples, all_calls + calls, all_seconds + seconds)
+
+    results = {}
+    print(f"{'case':<34} {'ops/sec':>10} {'best':>11} {'p50':>11} {'p90':>11} {'p99':>11} {'peak':>10}")
+    for key, (fn, inputs) in cases.items():
+        result = results[key] = summarize(*timings[key], peak_allocation(fn, inputs))
+        print(f"{key:<34} {result['ops_per_sec']:>10.1f} {format_seconds(result['best'])} "
+              f"{format_seconds(result['p50'])} {format_seconds(result['p90'])} "
+              f"{format_seconds(result['p99'])} {result['peak_bytes'] / 1024:>7.0f} KiB")
+
+    report = {
+        'meta': {
+            'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'pillow': Image.__version__,
+            'machine': f"{platform.system()} {platform.machine()} {platform.processor()}".strip(),
+            'corpus_images': len(corpus),
+            'min_seconds': min_seconds,
+            'rounds': args.rounds,
+            'max_rss_kib': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        },
+        'results': results,
+    }
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2) + '\n')
+        print(f"\nwrote {args.output}")
+
+def compare(args):
+    base = json.loads(Path(args.base).read_text())
+    new = json.loads(Path(args.new).read_text())
+    print(f"base {base['meta'].get('revision')} ({base['meta']['created']})   "
+          f"new {new['meta'].get('revision')} ({new['meta']['created']})   "
+          f"metric {args.metric}, threshold {args.threshold:.0%}\n")
+
+    regressions = []
+    print(f"{'case':<34} {'base':>11} {'new':>11} {'ratio':>7}")
+    for key in sorted(base['results'].keys() & new['results'].keys()):
+        before = base['results'][key][args.metric]
+        after = new['results'][key][args.metric]
+        ratio = after / before
+        flag = ''
+        if ratio > 1 + args.threshold:
+            flag = '  REGRESSION'
+            regressions.append(key)
+        elif ratio < 1 - args.threshold:
+            flag = '  faster'
+        print(f"{key:<34} {format_seconds(before)} {format_seconds(after)} {ratio:>6.2f}x{flag}")
+    for key in sorted(base['results'].keys() - new['results'].keys()):
+        print(f"{key:<34} only in base")
+    for key in sorted(new['results'].keys() - base['results'].keys()):
+        print(f"{key:<34} only in new")
+
+    print(f"\n{len(regressions)} regression(s) beyond {args.threshold:.0%}")
+    return 1 if regressions else 0
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help="benchmark every primitive")
+    run_parser.add_argument('--images', default=str(ROOT / 'images'), help="corpus directory")
+    run_parser.add_argument('--output', help="write results to this JSON file")
+    run_parser.add_argument('--quick', action='store_true', help="shorter runs, synthetic sizes up to 1024 px")
+    run_parser.add_argument('--rounds', type=int, default=ROUNDS, help=f"passes over all cases (default {ROUNDS})")
+    run_parser.add_argument('--only', nargs='+', choices=sorted(PRIMITIVES), help="primitives to run")
+
+    compare_parser = commands.add_parser('compare', help="compare two saved runs")
+    compare_parser.add_argument('base')
+    compare_parser.add_argument('new')
+    compare_parser.add_argument('--threshold', type=float, default=0.10,
+                                help="slowdown ratio counted as a regression (default 0.10)")
+    compare_parser.add_argument('--metric', default='best', choices=['best'] + [f'p{p}' for p in PERCENTILES])
+
+    args = parser.parse_args()
+    if args.command == 'run':
+        run(args)
+    else:
+        sys.exit(compare(args))
+
+if __name__ == "__main__":
+    main()
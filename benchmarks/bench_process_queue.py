@@ -0,0 +1,93 @@
+"""
+/process under a burst of concurrent uploads: the synchronous handler,
+which hashes, paints and saves inside the request thread, against the
+async mode, which queues the upload on the JobQueue process pool and
+answers 202 with a job id to poll.
+
+Reports how long clients wait for the /process response itself, how
+long until every image is done, and how many uploads were turned away
+with 503 once the queue was full.
+
+    python benchmarks/bench_process_queue.py [image_dir] [clients] [uploads_per_client] [queue_size]
+"""
+import io
+import os
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import storage
+
+def percentile(values, fraction):
+    values = sorted(values) or [0.0]
+    return values[min(len(values) - 1, int(len(values) * fraction))] * 1000
+
+def run(client, uploads, num_clients, per_client, asynchronous):
+    latencies = []
+    status_urls = []
+    rejected = [0]
+    lock = threading.Lock()
+    url = '/process?async=1' if asynchronous else '/process'
+
+    def worker(i):
+        for n in range(per_client):
+            name, data = uploads[(i * per_client + n) % len(uploads)]
+            start = time.perf_counter()
+            response = client.post(url, data={'file': (io.BytesIO(data), name)},
+                                   content_type='multipart/form-data')
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                if response.status_code == 503:
+                    rejected[0] += 1
+                elif response.status_code == 202:
+                    status_urls.append(response.json['status_url'])
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(num_clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for status_url in status_urls:
+        while client.get(status_url).status_code == 202:
+            time.sleep(0.01)
+    return latencies, rejected[0], time.perf_counter() - start
+
+def main():
+    image_dir = sys.argv[1] if len(sys.argv) > 1 else "images"
+    num_clients = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    per_client = int(sys.argv[3]) if len(sys.argv) > 3 else 4
+    queue_size = sys.argv[4] if len(sys.argv) > 4 else '64'
+    paths = sorted(Path(image_dir).glob("*.JPEG"))[:num_clients * per_client]
+    print(f"{len(paths)} images, {num_clients} clients x {per_client} uploads, "
+          f"{os.cpu_count()} CPUs, queue size {queue_size}\n")
+
+    uploads = [(path.name, path.read_bytes()) for path in paths]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        storage.use_database(str(Path(tmp) / 'images.db'))
+        storage.migrate()
+        os.environ['PROCESS_QUEUE_SIZE'] = queue_size
+        os.chdir(tmp)
+        import app as appmod
+        appmod.app.config['OUTPUT_FOLDER'] = tmp
+        client = appmod.app.test_client()
+
+        appmod.get_job_queue().submit(len, b'warm up the pool')
+        print(f"{'mode':<8} {'p50 response':>13} {'p99 response':>13} {'all done':>9} {'images/s':>9} {'503s':>5}")
+        for label, asynchronous in (("sync", False), ("async", True)):
+            latencies, rejected, total = run(client, uploads, num_clients, per_client, asynchronous)
+            done = len(latencies) - rejected
+            print(f"{label:<8} {percentile(latencies, 0.5):10.1f} ms {percentile(latencies, 0.99):10.1f} ms "
+                  f"{total:7.2f} s {done / total:9.1f} {rejected:>5}")
+        appmod.get_job_queue().shutdown()
+        storage.view_counts.close()
+        storage.get_pool().close_all()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+Barcode scanning of a firehose-like stream of image blobs, all in memory:
+hashing and reading the bar of every image (then looking it up) against
+BarcodeScanner, which rejects images whose corner fails bar_precheck
+before any of that.
+
+The stream mixes the un-barcoded corpus images (repeated) with a share of
+barcoded, registered images recompressed as a re-upload would be. Reports
+blobs/s, how many plain images the pre-check let through and how many
+barcoded ones became sightings.
+
+    python benchmarks/bench_scanner.py [image_dir] [stream_length] [barcoded_percent]
+"""
+import io
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from PIL import Image
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import storage
+from jobs import JobQueue
+from main import init_db, phash_dhash_combo, process_upload, store_image_hashes, verify_image_colors
+from scanner import BarcodeScanner, bar_precheck, match_registered
+
+def full_scan_blob(data):
+    """No pre-check: hash and read the bar of every image."""
+    img = Image.open(io.BytesIO(data)).convert('RGB')
+    return {'perceptual_hash': phash_dhash_combo(img), 'colors': verify_image_colors(img)}
+
+def recompress(data, quality=75):
+    buffer = io.BytesIO()
+    Image.open(io.BytesIO(data)).convert('RGB').save(buffer, 'JPEG', quality=quality)
+    return buffer.getvalue()
+
+def main():
+    image_dir = sys.argv[1] if len(sys.argv) > 1 else "images"
+    stream_length = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    barcoded_share = float(sys.argv[3]) / 100 if len(sys.argv) > 3 else 0.02
+    paths = sorted(p for p in Path(image_dir).iterdir() if p.suffix.lower() in {'.jpeg', '.jpg', '.png', '.webp'})
+    plain = [path.read_bytes() for path in paths]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        storage.use_database(str(Path(tmp) / 'images.db'))
+        init_db()
+        barcoded = []
+        for data in plain[:50]:
+            try:
+                result = process_upload(data, tmp)
+            except OSError:
+                continue
+            store_image_hashes(result['perceptual_hash'], result['color_hash'], 'creator')
+            barcoded.append(recompress((Path(tmp) / f"{result['color_hash']}.jpg").read_bytes()))
+
+        rng = random.Random(0)
+        stream = [(True, rng.choice(barcoded)) if rng.random() < barcoded_share else (False, rng.choice(plain))
+                  for _ in range(stream_length)]
+        num_barcoded = sum(is_barcoded for is_barcoded, _ in stream)
+        print(f"{stream_length} blobs, {num_barcoded} barcoded, {len(plain)} distinct plain images, "
+              f"{os.cpu_count()} CPUs\n")
+
+        jobs = JobQueue(max_pending=len(stream))  # map() reserves a slot per blob
+        jobs.map(len, [b'warm up'])
+        start = time.perf_counter()
+        outcomes = jobs.map(full_scan_blob, [data for _, data in stream])
+        found = [result is not None and match_registered(result['perceptual_hash'], result['colors']) is not None
+                 for result, _ in outcomes]
+        elapsed = time.perf_counter() - start
+        jobs.shutdown()
+        detected = sum(hit for hit, (is_barcoded, _) in zip(found, stream) if is_barcoded)
+        false_hits = sum(hit for hit, (is_barcoded, _) in zip(found, stream) if not is_barcoded)
+        print(f"verify every blob  {stream_length / elapsed:8.1f} blobs/s   "
+              f"detected {detected}/{num_barcoded}   false detections {false_hits}")
+
+        scanner = BarcodeScanner(queue_size=stream_length)
+        scanner.scan(b'', 'warm-up', 'warm-up')
+        while scanner.jobs.pending():
+            time.sleep(0.01)
+        start = time.perf_counter()
+        for i, (_, data) in enumerate(stream):
+            scanner.scan(data, f'at://did:plc:bench/app.bsky.feed.post/{i}', f'cid{i}')
+        while scanner.jobs.pending():
+            time.sleep(0.001)
+        elapsed = time.perf_counter() - start
+        scanner.close()
+        stats = scanner.stats
+        print(f"bar_precheck first {stream_length / elapsed:8.1f} blobs/s   "
+              f"detected {stats['sightings']}/{num_barcoded}   "
+              f"past the pre-check {stats['scanned'] - stats['rejected']}   dropped {stats['dropped']}")
+
+        plain_passed = sum(bar_precheck(Image.open(io.BytesIO(data))) for data in plain)
+        barcoded_passed = sum(bar_precheck(Image.open(io.BytesIO(data))) for data in barcoded)
+        print(f"\nbar_precheck passes {plain_passed}/{len(plain)} plain images, "
+              f"{barcoded_passed}/{len(barcoded)} barcoded ones")
+        storage.view_counts.close()
+        storage.get_pool().close_all()
+
+if __name__ == "__main__":
+    main()
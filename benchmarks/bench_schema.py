@@ -0,0 +1,108 @@
+"""
+Size and lookup latency of image_hashes before and after migration 6,
+which stores perceptual_hash as a signed 64-bit INTEGER and color_hash as
+its 36 raw bytes instead of 16 hex and 48 base64 characters.
+
+A database is built at schema version 5 (text hashes) and filled with
+random rows, measured, converted in place by storage.migrate(), vacuumed
+and measured again. Lookups take the strings a request carries; after the
+migration that includes converting them to the stored form.
+
+    python benchmarks/bench_schema.py [rows] [lookups]
+"""
+import base64
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import storage
+
+LOOKUPS = [
+    ('verify', 'SELECT user_id, created_at FROM image_hashes WHERE perceptual_hash = ? AND color_hash = ?'),
+    ('near match', 'SELECT color_hash FROM image_hashes WHERE perceptual_hash = ?'),
+    ('show', 'SELECT user_id, perceptual_hash, created_at, query_count FROM image_hashes WHERE color_hash = ?'),
+]
+
+def migrate_to(conn, target):
+    for version, _, step in storage.MIGRATIONS:
+        if version > target:
+            break
+        if callable(step):
+            step(conn)
+        else:
+            for statement in step:
+                conn.execute(statement)
+        conn.execute(f'PRAGMA user_version = {version}')
+
+def sizes(conn, path):
+    """(file bytes, {table or index: bytes}) for the image_hashes b-trees."""
+    conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    btrees = dict(conn.execute(
+        "SELECT name, SUM(pgsize) FROM dbstat WHERE name LIKE '%image_hashes%' GROUP BY name"
+    ).fetchall())
+    return os.path.getsize(path), btrees
+
+def time_lookups(conn, samples, compact):
+    results = {}
+    for label, sql in LOOKUPS:
+        latencies = []
+        for _, perceptual_hash, color_hash in samples:
+            start = time.perf_counter()
+            if compact:
+                perceptual_hash = storage.perceptual_hash_to_int(perceptual_hash)
+                color_hash = base64.urlsafe_b64decode(color_hash)
+            params = {'verify': (perceptual_hash, color_hash), 'near match': (perceptual_hash,),
+                      'show': (color_hash,)}[label]
+            conn.execute(sql, params).fetchone()
+            latencies.append(time.perf_counter() - start)
+        latencies.sort()
+        results[label] = (latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.99)])
+    return results
+
+def report(label, file_size, btrees, lookups):
+    print(f"{label}: file {file_size / 2**20:7.1f} MiB")
+    for name, size in sorted(btrees.items()):
+        print(f"  {name:<36} {size / 2**20:7.1f} MiB")
+    for name, (p50, p99) in lookups.items():
+        print(f"  {name:<12} p50 {p50 * 1e6:6.1f} us  p99 {p99 * 1e6:7.1f} us")
+
+def main():
+    num_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    num_lookups = int(sys.argv[2]) if len(sys.argv) > 2 else 20_000
+    rng = random.Random(0)
+    # Hashes are 31 significant bits in practice (see HammingIndex)
+    rows = [(f'user{rng.randrange(num_rows // 100 or 1)}', f'{rng.getrandbits(31):016x}',
+             base64.urlsafe_b64encode(rng.randbytes(36)).decode('ascii'))
+            for _ in range(num_rows)]
+    samples = rng.sample(rows, min(num_lookups, num_rows))
+    print(f"{num_rows:,} rows, {len(samples):,} lookups of each kind\n")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = str(Path(tmp) / 'images.db')
+        storage.use_database(path)
+        conn = storage.connection()
+        with storage.transaction(conn):
+            migrate_to(conn, 5)
+            conn.executemany('INSERT INTO image_hashes (user_id, perceptual_hash, color_hash) VALUES (?, ?, ?)', rows)
+        before = sizes(conn, path)
+        report("text hashes (version 5)", *before, time_lookups(conn, samples, compact=False))
+
+        start = time.perf_counter()
+        storage.migrate(conn)
+        migrated = time.perf_counter() - start
+        conn.execute('VACUUM')
+        after = sizes(conn, path)
+        print(f"\nmigrated in place in {migrated:.1f} s, then VACUUM\n")
+        report("INTEGER + BLOB (version 6)", *after, time_lookups(conn, samples, compact=True))
+        storage.get_pool().close_all()
+
+    print(f"\nfile x{before[0] / after[0]:.2f} smaller, "
+          f"indexes x{sum(before[1].values()) / sum(after[1].values()):.2f} smaller (table + all indexes)")
+
+if __name__ == "__main__":
+    main()
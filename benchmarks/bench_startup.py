@@ -0,0 +1,132 @@
+"""
+Worker cold start: how long a fresh interpreter takes to import app.py,
+and a check that the import stays within IMPORT_BUDGET_MS and
+TOTAL_BUDGET_MS and touches no database.
+
+Each measurement runs in a new interpreter, in an empty directory:
+
+- libraries: importing flask, numpy and PIL.Image, which every worker
+  needs whatever the app does
+- app: importing app.py once those libraries are loaded, which is the
+  part this repo controls and what the budget applies to
+- total: importing app.py from nothing, what a worker actually pays and
+  what TOTAL_BUDGET_MS applies to (tests/test_startup.py checks it too)
+
+It then lists the slowest modules from python -X importtime and checks
+three things: no images.db appears in the working directory, authlib is
+not imported, and multiprocessing is not imported. Exits with status 1
+if either median exceeds its budget or a check fails.
+
+    python benchmarks/bench_startup.py [--runs 7] [--budget-ms 100] [--total-budget-ms 400] [--root CHECKOUT]
+
+--root measures another checkout (e.g. git worktree add /tmp/old HEAD~1)
+for a before/after comparison.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# ─────────────────────────────────────────────────────────
+# Configuration
+# ─────────────────────────────────────────────────────────
+IMPORT_BUDGET_MS = 100      # Median import time of app.py beyond LIBRARIES
+TOTAL_BUDGET_MS = 400       # Median import time of app.py from nothing
+LIBRARIES = ('flask', 'numpy', 'PIL.Image')
+UNWANTED_MODULES = ('authlib', 'multiprocessing')  # Should load on first use only
+SLOWEST_SHOWN = 12
+
+PROBE = """
+import json, os, sys, time
+sys.path.insert(0, {root!r})
+start = time.perf_counter()
+for name in {preload!r}:
+    __import__(name)
+libraries = time.perf_counter() - start
+start = time.perf_counter()
+import app
+print(json.dumps({{
+    'libraries': libraries,
+    'app': time.perf_counter() - start,
+    'modules': sorted({{name.split('.')[0] for name in sys.modules}} & set({unwanted!r})),
+    'files': sorted(os.listdir('.')),
+}}))
+"""
+
+def probe(root, preload, env):
+    """One fresh interpreter importing app.py from an empty directory."""
+    with tempfile.TemporaryDirectory() as cwd:
+        code = PROBE.format(root=str(root), preload=list(preload), unwanted=list(UNWANTED_MODULES))
+        result = subprocess.run([sys.executable, '-c', code], cwd=cwd, env=env,
+                                capture_output=True, text=True, check=True)
+        return json.loads(result.stdout.strip().splitlines()[-1])
+
+def slowest_modules(root, env):
+    """[(cumulative us, self us, module)] for import app, slowest first."""
+    with tempfile.TemporaryDirectory() as cwd:
+        code = f"import sys; sys.path.insert(0, {str(root)!r}); import app"
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=cwd, env=env,
+                                capture_output=True, text=True, check=True)
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        rows.append((int(cumulative_us), int(self_us), name.strip()))
+    return sorted(rows, reverse=True)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('--runs', type=int, default=7, help="fresh interpreters per measurement")
+    parser.add_argument('--budget-ms', type=float, default=IMPORT_BUDGET_MS,
+                        help=f"allowed median app import time beyond the libraries (default {IMPORT_BUDGET_MS})")
+    parser.add_argument('--total-budget-ms', type=float, default=TOTAL_BUDGET_MS,
+                        help=f"allowed median app import time from nothing (default {TOTAL_BUDGET_MS})")
+    parser.add_argument('--root', default=str(ROOT), help="checkout to measure")
+    args = parser.parse_args()
+    root = Path(args.root).resolve()
+    # Dummy Auth0 settings, as a worker would have; nothing contacts them
+    env = {**os.environ, 'AUTH0_DOMAIN': 'auth0.invalid'}
+
+    probe(root, LIBRARIES, env)  # Compile and cache bytecode before timing
+    preloaded = [probe(root, LIBRARIES, env) for _ in range(args.runs)]
+    cold = [probe(root, (), env) for _ in range(args.runs)]
+    libraries = statistics.median(run['libraries'] for run in preloaded) * 1000
+    app_only = statistics.median(run['app'] for run in preloaded) * 1000
+    total = statistics.median(run['app'] for run in cold) * 1000
+
+    print(f"{root}, median of {args.runs} fresh interpreters\n")
+    print(f"{'libraries (' + ', '.join(LIBRARIES) + ')':<40} {libraries:7.1f} ms")
+    print(f"{'app.py beyond the libraries':<40} {app_only:7.1f} ms   budget {args.budget_ms:g} ms")
+    print(f"{'app.py from nothing':<40} {total:7.1f} ms   budget {args.total_budget_ms:g} ms\n")
+
+    print("slowest imports (python -X importtime):")
+    print(f"  {'cumulative':>10} {'self':>8}  module")
+    for cumulative_us, self_us, name in slowest_modules(root, env)[:SLOWEST_SHOWN]:
+        print(f"  {cumulative_us / 1000:>8.1f}ms {self_us / 1000:>6.1f}ms  {name}")
+    print()
+
+    failures = []
+    if app_only > args.budget_ms:
+        failures.append(f"app.py import takes {app_only:.1f} ms beyond the libraries, over {args.budget_ms:g} ms")
+    if total > args.total_budget_ms:
+        failures.append(f"app.py import takes {total:.1f} ms from nothing, over {args.total_budget_ms:g} ms")
+    databases = [name for name in cold[0]['files'] if name.startswith('images.db')]
+    if databases:
+        failures.append(f"importing app.py created {', '.join(databases)} in the working directory")
+    for name in cold[0]['modules']:
+        failures.append(f"importing app.py imports {name}")
+    if failures:
+        for failure in failures:
+            print(f"FAIL {failure}")
+        sys.exit(1)
+    print("OK")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Repeat visits to a gallery's images: the previous serve_image (every
+response no-cache, no-store, so each view re-downloads every file) against
+immutable caching with strong ETags.
+
+A browser holding the new responses makes no request at all within
+IMAGE_MAX_AGE; on a forced reload it revalidates and gets 304s with empty
+bodies. Reports server time and body bytes per view of every output image,
+through the Flask test client.
+
+    python benchmarks/bench_static.py [views]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from flask import send_from_directory
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import storage
+
+def legacy_serve_image(filename):
+    """The previous route; add_header then marked it no-cache, no-store."""
+    return send_from_directory(os.path.join(os.getcwd(), 'images/output'), filename)
+
+def view(client, names, prefix, etags=None):
+    """Fetch every image once; returns (seconds, body bytes, statuses)."""
+    start = time.perf_counter()
+    total, statuses = 0, set()
+    for name in names:
+        headers = {'If-None-Match': etags[name]} if etags else {}
+        response = client.get(f'{prefix}/{name}', headers=headers)
+        total += len(response.data)
+        statuses.add(response.status_code)
+    return time.perf_counter() - start, total, statuses
+
+def main():
+    views = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+
+    with tempfile.TemporaryDirectory() as tmp:
+        shutil.copytree(ROOT / 'images' / 'output', Path(tmp) / 'images' / 'output')
+        os.chdir(tmp)
+        storage.use_database(str(Path(tmp) / 'images.db'))
+        storage.migrate()
+        import app as web  # uses the database above
+
+        web.app.add_url_rule('/legacy/<filename>', 'legacy_serve_image', legacy_serve_image)
+        client = web.app.test_client()
+        names = sorted(path.name for path in Path('images/output').glob('*.jpg'))
+        print(f"{len(names)} output images, {views} views each\n")
+
+        headers = client.get(f'/legacy/{names[0]}').headers
+        print(f"previous   Cache-Control: {headers['Cache-Control']}")
+        headers = client.get(f'/images/output/{names[0]}').headers
+        print(f"now        Cache-Control: {headers['Cache-Control']}   ETag: {headers['ETag']}\n")
+
+        etags = {name: client.get(f'/images/output/{name}').headers['ETag'] for name in names}
+        cases = [
+            ("previous: full 200s", lambda: view(client, names, '/legacy')),
+            ("now, first visit", lambda: view(client, names, '/images/output')),
+            ("now, revalidate (304)", lambda: view(client, names, '/images/output', etags)),
+        ]
+        for label, run in cases:
+            results = [run() for _ in range(views)]
+            seconds = sum(result[0] for result in results) / views
+            body = results[0][1]
+            statuses = sorted(set().union(*(result[2] for result in results)))
+            print(f"{label:<24} {seconds * 1000:7.2f} ms/view   {body / 1024:8.1f} KiB/view   status {statuses}")
+        print(f"{'now, within max-age':<24} {0:7.2f} ms/view   {0:8.1f} KiB/view   no requests")
+        storage.view_counts.close()
+        storage.get_pool().close_all()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+"""
+Concurrent read/write throughput of images.db access: the original
+connect-per-request pattern (rollback journal, no secondary indexes)
+against storage.py (per-thread pooled connections, WAL, migrations with
+color_hash and (user_id, created_at) indexes).
+
+Each worker thread replays the app's mix of requests against a seeded
+copy of the schema in a temporary directory:
+
+    verify   exact (perceptual_hash, color_hash) lookup       50 %
+    show     /<color_hash>: bump query_count, read the row    20 %
+    gallery  /user/<id>: images newest first, plus stats      20 %
+    process  insert a new pair                                10 %
+
+    python benchmarks/bench_storage.py [rows] [threads] [seconds]
+"""
+import base64
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import storage
+
+LEGACY_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS image_hashes (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id TEXT NOT NULL,
+        perceptual_hash TEXT NOT NULL,
+        color_hash TEXT NOT NULL,
+        query_count INTEGER DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE(perceptual_hash, color_hash)
+    )
+'''
+
+MIX = [('verify', 50), ('show', 20), ('gallery', 20), ('process', 10)]
+GALLERY_PAGE_SIZE = 48      # app.py's default /user/<id> page
+
+# ─────────────────────────────────────────────────────────
+# Legacy baseline: a fresh connection for every request
+# ─────────────────────────────────────────────────────────
+
+class LegacyStore:
+    def __init__(self, path):
+        self.path = path
+
+    def verify(self, perceptual_hash, color_hash):
+        conn = sqlite3.connect(self.path)
+        c = conn.cursor()
+        c.execute('SELECT user_id, created_at FROM image_hashes WHERE perceptual_hash = ? AND color_hash = ?',
+                  (perceptual_hash, color_hash))
+        row = c.fetchone()
+        conn.close()
+        return row
+
+    def show(self, color_hash):
+        conn = sqlite3.connect(self.path)
+        c = conn.cursor()
+        c.execute('UPDATE image_hashes SET query_count = query_count + 1 WHERE color_hash = ?', (color_hash,))
+        c.execute('SELECT user_id, perceptual_hash, created_at, query_count FROM image_hashes WHERE color_hash = ?',
+                  (color_hash,))
+        row = c.fetchone()
+        conn.commit()
+        conn.close()
+        return row
+
+    def gallery(self, user_id):
+        conn = sqlite3.connect(self.path)
+        c = conn.cursor()
+        c.execute('SELECT color_hash, perceptual_hash, created_at, query_count FROM image_hashes '
+                  'WHERE user_id = ? ORDER BY created_at DESC', (user_id,))
+        rows = c.fetchall()
+        c.execute('SELECT COUNT(*), SUM(query_count), MIN(created_at) FROM image_hashes WHERE user_id = ?',
+                  (user_id,))
+        stats = c.fetchone()
+        conn.close()
+        return rows, stats
+
+    def process(self, user_id, perceptual_hash, color_hash):
+        conn = sqlite3.connect(self.path)
+        c = conn.cursor()
+        try:
+            c.execute('INSERT INTO image_hashes (user_id, perceptual_hash, color_hash) VALUES (?, ?, ?)',
+                      (user_id, perceptual_hash, color_hash))
+            conn.commit()
+        except sqlite3.IntegrityError:
+            pass
+        finally:
+            conn.close()
+
+
+class PooledStore:
+    """storage.py takes hashes in stored form; requests carry the strings."""
+
+    def verify(self, perceptual_hash, color_hash):
+        return storage.find_image(storage.perceptual_hash_to_int(perceptual_hash), color_bytes(color_hash))
+
+    def show(self, color_hash):
+        return storage.record_image_query(color_bytes(color_hash))
+
+    def gallery(self, user_id):
+        return storage.user_images(user_id, GALLERY_PAGE_SIZE + 1), storage.user_stats(user_id)
+
+    def process(self, user_id, perceptual_hash, color_hash):
+        storage.insert_image_hash(user_id, storage.perceptual_hash_to_int(perceptual_hash), color_bytes(color_hash))
+
+# ─────────────────────────────────────────────────────────
+# Benchmark
+# ─────────────────────────────────────────────────────────
+
+def random_color_hash(rng):
+    return base64.urlsafe_b64encode(rng.randbytes(36)).decode('ascii')
+
+def color_bytes(color_hash):
+    return base64.urlsafe_b64decode(color_hash)
+
+def seed_rows(num_rows, num_users, rng):
+    return [
+        (f'user{rng.randrange(num_users)}', f'{rng.getrandbits(64):016x}', random_color_hash(rng))
+        for _ in range(num_rows)
+    ]
+
+def run(store, rows, num_users, num_threads, seconds):
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+    ops, weights = zip(*MIX)
+    stop = time.perf_counter() + seconds
+    lock = threading.Lock()
+
+    def worker(seed):
+        rng = random.Random(seed)
+        local = defaultdict(list)
+        local_errors = defaultdict(int)
+        n = 0
+        while time.perf_counter() < stop:
+            op = rng.choices(ops, weights)[0]
+            user_id, perceptual_hash, color_hash = rows[rng.randrange(len(rows))]
+            start = time.perf_counter()
+            try:
+                if op == 'verify':
+                    store.verify(perceptual_hash, color_hash)
+                elif op == 'show':
+                    store.show(color_hash)
+                elif op == 'gallery':
+                    store.gallery(f'user{rng.randrange(num_users)}')
+                else:
+                    store.process(user_id, f'{rng.getrandbits(64):016x}', random_color_hash(rng))
+            except sqlite3.OperationalError:
+                local_errors[op] += 1
+            local[op].append(time.perf_counter() - start)
+            n += 1
+        with lock:
+            for op, values in local.items():
+                latencies[op].extend(values)
+            for op, count in local_errors.items():
+                errors[op] += count
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(num_threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors
+
+def report(label, latencies, errors, seconds):
+    total = sum(len(values) for values in latencies.values())
+    print(f"{label}: {total / seconds:,.0f} requests/s")
+    for op, _ in MIX:
+        values = sorted(latencies[op]) or [0.0]
+        p50 = values[len(values) // 2] * 1000
+        p99 = values[int(len(values) * 0.99)] * 1000
+        print(f"  {op:<8} {len(values):>8} calls  p50 {p50:7.2f} ms  p99 {p99:8.2f} ms  locked errors {errors[op]}")
+    return total / seconds
+
+def main():
+    num_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+    num_threads = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    seconds = float(sys.argv[3]) if len(sys.argv) > 3 else 5.0
+    num_users = max(1, num_rows // 100)
+    rows = seed_rows(num_rows, num_users, random.Random(0))
+    print(f"{num_rows:,} rows, {num_users:,} users, {num_threads} threads, {seconds:.0f} s per run\n")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy_path = str(Path(tmp) / 'legacy.db')
+        conn = sqlite3.connect(legacy_path)
+        conn.execute(LEGACY_SCHEMA)
+        conn.executemany('INSERT INTO image_hashes (user_id, perceptual_hash, color_hash) VALUES (?, ?, ?)', rows)
+        conn.commit()
+        conn.close()
+        before = report("connect per request", *run(LegacyStore(legacy_path), rows, num_users, num_threads, seconds),
+                        seconds)
+
+        storage.use_database(str(Path(tmp) / 'pooled.db'))
+        storage.migrate()
+        with storage.transaction() as conn:
+            conn.executemany('INSERT INTO image_hashes (user_id, perceptual_hash, color_hash) VALUES (?, ?, ?)',
+                             [(user_id, storage.perceptual_hash_to_int(perceptual_hash), color_bytes(color_hash))
+                              for user_id, perceptual_hash, color_hash in rows])
+        print()
+        after = report("pooled + WAL + indexes", *run(PooledStore(), rows, num_users, num_threads, seconds), seconds)
+        storage.view_counts.close()
+        storage.get_pool().close_all()
+
+    print(f"\nthroughput x{after / before:.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+/verify latency for a viral image uploaded again and again: with the
+verify caches emptied before every request (what each verify used to cost:
+decode, hash, bar sampling and DB lookups) against warm caches, where only
+the digest of the bytes, the nearest-color lookup and the bar comparison
+remain.
+
+Uses a barcoded corpus image at its own size and upscaled to 12 MP, through
+the Flask test client against a temporary database.
+
+    python benchmarks/bench_verify_cache.py [requests]
+"""
+import io
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from PIL import Image
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import storage
+
+def post(client, data):
+    return client.post('/verify', data={'file': (io.BytesIO(data), 'upload.jpg')}).get_json()
+
+def median_latency(client, data, repeats, before=None):
+    latencies = []
+    for _ in range(repeats):
+        if before is not None:
+            before()
+        start = time.perf_counter()
+        result = post(client, data)
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    return latencies[len(latencies) // 2], result
+
+def main():
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    source = (ROOT / 'images' / 'n01443537_goldfish.JPEG').read_bytes()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        storage.use_database(str(Path(tmp) / 'images.db'))
+        storage.migrate()
+        import app as web  # uses the database above
+        from main import process_upload, store_image_hashes
+
+        uploads = {}
+        for label, size in (("corpus size", None), ("12 MP", (4032, 3024))):
+            img = Image.open(io.BytesIO(source)).convert('RGB')
+            buffer = io.BytesIO()
+            (img.resize(size, Image.BICUBIC) if size else img).save(buffer, 'JPEG', quality=90)
+            result = process_upload(buffer.getvalue(), web.app.config['OUTPUT_FOLDER'])
+            store_image_hashes(result['perceptual_hash'], result['color_hash'], 'creator')
+            uploads[label] = (Path(web.app.config['OUTPUT_FOLDER']) / f"{result['color_hash']}.jpg").read_bytes()
+
+        client = web.app.test_client()
+        print(f"median of {repeats} /verify requests of the same barcoded file\n")
+
+        def empty_caches():
+            web.upload_cache.clear()
+            web.registration_cache.clear()
+
+        for label, data in uploads.items():
+            cold, cold_result = median_latency(client, data, repeats, empty_caches)
+            warm, warm_result = median_latency(client, data, repeats)
+            print(f"{label:<12} {len(data) / 1024:7.0f} KiB   uncached {cold * 1000:8.2f} ms   "
+                  f"cached {warm * 1000:6.2f} ms   x{cold / warm:5.1f}   "
+                  f"verified {warm_result['verified']}   same result {cold_result == warm_result}")
+        print(f"\n{web.upload_cache.info()}")
+        storage.view_counts.close()
+        storage.get_pool().close_all()
+
+if __name__ == "__main__":
+    main()
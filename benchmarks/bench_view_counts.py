@@ -0,0 +1,76 @@
+"""
+Page-view throughput on a few viral images: a synchronous
+UPDATE query_count + commit per view (the previous record_image_query)
+against the write-behind view_counts buffer in storage.py.
+
+Both runs use the pooled WAL connections; the final query_count in the
+database is checked against the number of views served.
+
+    python benchmarks/bench_view_counts.py [threads] [seconds] [hot_images]
+"""
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import storage
+
+def synchronous_record_image_query(color_hash):
+    with storage.transaction() as conn:
+        conn.execute('UPDATE image_hashes SET query_count = query_count + 1 WHERE color_hash = ?', (color_hash,))
+        return conn.execute(
+            'SELECT user_id, perceptual_hash, created_at, query_count FROM image_hashes WHERE color_hash = ?',
+            (color_hash,)
+        ).fetchone()
+
+def run(record, hashes, num_threads, seconds):
+    served = [0] * num_threads
+    stop = time.perf_counter() + seconds
+
+    def worker(i):
+        n = 0
+        while time.perf_counter() < stop:
+            record(hashes[n % len(hashes)])
+            n += 1
+        served[i] = n
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(num_threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sum(served)
+
+def stored_total():
+    return storage.connection().execute('SELECT SUM(query_count) FROM image_hashes').fetchone()[0] or 0
+
+def main():
+    num_threads = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 5.0
+    num_hot = int(sys.argv[3]) if len(sys.argv) > 3 else 3
+    hashes = [bytes([i]) * 36 for i in range(num_hot)]
+    print(f"{num_threads} threads, {seconds:.0f} s per run, {num_hot} hot images\n")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        results = {}
+        for label, record in (("synchronous UPDATE", synchronous_record_image_query),
+                              ("write-behind", storage.record_image_query)):
+            storage.use_database(str(Path(tmp) / f"{len(results)}.db"))
+            storage.migrate()
+            for i, color_hash in enumerate(hashes):
+                storage.insert_image_hash('viral', i, color_hash)
+
+            served = run(record, hashes, num_threads, seconds)
+            storage.view_counts.flush()
+            results[label] = served / seconds
+            print(f"{label:<20} {served / seconds:10,.0f} views/s   stored {stored_total():,} / served {served:,}")
+        storage.get_pool().close_all()
+
+    before, after = results.values()
+    print(f"\nthroughput x{after / before:.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,355 @@
+"""
+Bulk barcoding and verification of image directories from the command line.
+
+    python bulk.py embed SOURCE_DIR [--output images/output] [--user-id backfill]
+    python bulk.py verify DIR
+    python bulk.py derivatives [--output images/output]
+
+embed walks SOURCE_DIR, barcodes every image on a process pool with
+/process's own process_upload (same pixel caps, same hashing, animations
+also saved as <color_hash>.gif) and saves it as <output>/<color_hash>.jpg.
+Images over the caps are reported as errors. The hashes are
+stored in batched transactions. Each stored file is appended to a JSON-lines
+manifest (<output>/manifest.jsonl by default) once its batch has committed,
+so an interrupted run skips what is already done when restarted.
+
+verify reads the color bar of every image under DIR, decoded and hashed
+as /verify does, and passes it if it
+matches the bar recomputed from the image's perceptual hash, the bar
+registered for that hash, or the nearest registered bar (as /verify's
+barcode_match does). It prints pass/fail counts.
+
+derivatives makes the downscaled JPEG/WebP copies served via srcset for
+every <color_hash>.jpg in the output folder that lacks them (images
+barcoded before they existed); embed makes them as it goes.
+
+Both modes print throughput and the time spent in each stage.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from pathlib import Path
+
+from PIL import Image
+
+import metrics
+import storage
+from main import (
+    process_upload,
+    decode_upload,
+    open_upload,
+    is_animated,
+    sample_animation_colors,
+    generate_color_uuid_from_hash,
+    make_derivatives,
+    derivative_filename,
+    DERIVATIVE_WIDTHS,
+    verify_image_colors,
+    compare_bar_colors,
+    decode_url_to_colors,
+    bytes_to_colors,
+    color_hash_to_bytes,
+    find_nearest_color_hash,
+    load_indexes,
+)
+
+# ─────────────────────────────────────────────────────────
+# Configuration
+# ─────────────────────────────────────────────────────────
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.webp', '.bmp', '.gif', '.tif', '.tiff'}
+DB_BATCH_SIZE = 500         # Hash rows written per transaction
+IN_FLIGHT_PER_WORKER = 4    # Files queued per pool worker before waiting on results
+MANIFEST_NAME = 'manifest.jsonl'
+
+# ─────────────────────────────────────────────────────────
+# Per-image work (runs in pool workers)
+# ─────────────────────────────────────────────────────────
+
+def embed_file(path, output_folder):
+    """Barcode one file with process_upload; returns its hashes, verification and stage timings."""
+    result = process_upload(path, output_folder)
+    watch = metrics.Stopwatch()
+    make_derivatives(result['color_hash'], output_folder)
+    watch.lap('derivatives')
+    return {
+        'perceptual_hash': result['perceptual_hash'],
+        'color_hash': result['color_hash'],
+        'verified': result['verification']['success'],
+        'timings': {**result['timings'], **watch.timings}
+    }
+
+def derive_file(path):
+    """Make the derivatives of one output <color_hash>.jpg."""
+    watch = metrics.Stopwatch()
+    path = Path(path)
+    widths = make_derivatives(path.stem, path.parent)
+    watch.lap('derivatives')
+    return {'widths': widths, 'timings': watch.timings}
+
+def verify_file(path):
+    """
+    Read one file's color bar and the bar its perceptual hash implies,
+    decoding and hashing it with decode_upload as /verify does.
+    """
+    watch = metrics.Stopwatch()
+    img, perceptual_hash = decode_upload(path, watch=watch)
+    expected_colors, _ = generate_color_uuid_from_hash(img, None, perceptual_hash)
+    watch.lap('barcode')
+    with open_upload(path) as source:
+        detected_colors = sample_animation_colors(source) if is_animated(source) else verify_image_colors(img)
+    _, _, match_count, required_matches = compare_bar_colors(expected_colors, detected_colors)
+    watch.lap('verify')
+    return {
+        'perceptual_hash': perceptual_hash,
+        'detected_colors': detected_colors,
+        'barcode_match': bool(match_count >= required_matches),
+        'timings': watch.timings
+    }
+
+# ─────────────────────────────────────────────────────────
+# Driver
+# ─────────────────────────────────────────────────────────
+
+def find_images(root, exclude=None):
+    """Image files under root in a stable order, skipping the exclude directory."""
+    root = Path(root)
+    exclude = Path(exclude).resolve() if exclude else None
+    for dirpath, dirnames, filenames in os.walk(root):
+        if exclude is not None and Path(dirpath).resolve() == exclude:
+            dirnames[:] = []
+            continue
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if Path(filename).suffix.lower() in IMAGE_EXTENSIONS:
+                yield Path(dirpath) / filename
+
+def run_pool(fn, paths, workers, *args):
+    """
+    Yield (path, result, error) as fn(path, *args) finishes on a process
+    pool, keeping only a few files per worker in flight so huge trees are
+    never queued all at once. workers defaults to the CPU count.
+    """
+    paths = iter(paths)
+    workers = workers or os.cpu_count() or 1
+    limit = workers * IN_FLIGHT_PER_WORKER
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        running = {}
+        while True:
+            for path in paths:
+                running[executor.submit(fn, str(path), *args)] = path
+                if len(running) >= limit:
+                    break
+            if not running:
+                return
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                path = running.pop(future)
+                try:
+                    yield path, future.result(), None
+                except Exception as e:
+                    yield path, None, str(e)
+
+def read_manifest(path):
+    """Source paths already recorded in a manifest from an earlier run."""
+    done = set()
+    if path.exists():
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    done.add(json.loads(line)['source'])
+                except (ValueError, KeyError):
+                    pass  # Torn last line from an interrupted write
+    return done
+
+def print_summary(label, counts, timings, elapsed):
+    processed = counts['processed']
+    print(f"\n{label}: {processed} images in {elapsed:.1f} s ({processed / elapsed if elapsed else 0:.1f} images/s)")
+    for name, value in counts.items():
+        if name != 'processed':
+            print(f"  {name:<12} {value}")
+    total = sum(timings.values()) or 1
+    print("  stage         ms/image   share")
+    for stage, seconds in timings.items():
+        print(f"  {stage:<12} {seconds / max(processed, 1) * 1000:9.1f} {seconds / total:7.0%}")
+
+def embed(args):
+    source = Path(args.source)
+    output = Path(args.output)
+    output.mkdir(parents=True, exist_ok=True)
+    manifest_path = Path(args.manifest) if args.manifest else output / MANIFEST_NAME
+    done = read_manifest(manifest_path)
+    storage.migrate()
+
+    paths = [path for path in find_images(source, exclude=output) if str(path.relative_to(source)) not in done]
+    if args.limit:
+        paths = paths[:args.limit]
+    print(f"{len(paths)} images to embed from {source} ({len(done)} already in {manifest_path})")
+
+    counts = defaultdict(int)
+    timings = defaultdict(float)
+    pending = []
+    start = time.perf_counter()
+
+    with open(manifest_path, 'a', encoding='utf-8') as manifest:
+        def flush():
+            db_start = time.perf_counter()
+            pairs = [(storage.perceptual_hash_to_int(result['perceptual_hash']), color_hash_to_bytes(result['color_hash']))
+                     for _, result in pending]
+            inserted = storage.insert_image_hashes(args.user_id, pairs)
+            timings['db'] += time.perf_counter() - db_start
+            for (source_name, result), new in zip(pending, inserted):
+                counts['new rows'] += new
+                manifest.write(json.dumps({
+                    'source': source_name,
+                    'perceptual_hash': result['perceptual_hash'],
+                    'color_hash': result['color_hash'],
+                    'verified': result['verified'],
+                    'new': new
+                }) + '\n')
+            manifest.flush()
+            os.fsync(manifest.fileno())
+            pending.clear()
+
+        for path, result, error in run_pool(embed_file, paths, args.workers, str(output)):
+            if error is not None:
+                counts['errors'] += 1
+                print(f"Error embedding {path}: {error}")
+                continue
+            counts['processed'] += 1
+            counts['unverified'] += not result['verified']
+            for stage, seconds in result['timings'].items():
+                timings[stage] += seconds
+            pending.append((str(path.relative_to(source)), result))
+            if len(pending) >= args.batch_size:
+                flush()
+            if counts['processed'] % 1000 == 0:
+                elapsed = time.perf_counter() - start
+                print(f"  {counts['processed']}/{len(paths)} ({counts['processed'] / elapsed:.1f} images/s)")
+        if pending:
+            flush()
+
+    print_summary("embed", counts, timings, time.perf_counter() - start)
+
+def verify(args):
+    storage.migrate()
+    load_indexes()
+    paths = list(find_images(args.directory))
+    if args.limit:
+        paths = paths[:args.limit]
+    print(f"{len(paths)} images to verify in {args.directory}")
+
+    counts = defaultdict(int)
+    timings = defaultdict(float)
+    failures = []
+    start = time.perf_counter()
+
+    for path, result, error in run_pool(verify_file, paths, args.workers):
+        if error is not None:
+            counts['errors'] += 1
+            print(f"Error verifying {path}: {error}")
+            continue
+        counts['processed'] += 1
+        for stage, seconds in result['timings'].items():
+            timings[stage] += seconds
+
+        db_start = time.perf_counter()
+        registered = storage.find_color_hash(storage.perceptual_hash_to_int(result['perceptual_hash']))
+        passed = result['barcode_match']
+        if registered is not None:
+            counts['registered'] += 1
+            _, _, match_count, required_matches = compare_bar_colors(
+                bytes_to_colors(registered), result['detected_colors']
+            )
+            passed = passed or match_count >= required_matches
+        if not passed:
+            nearest = find_nearest_color_hash(result['detected_colors'])
+            if nearest is not None:
+                _, _, match_count, required_matches = compare_bar_colors(
+                    decode_url_to_colors(nearest[0]), result['detected_colors']
+                )
+                passed = match_count >= required_matches
+        timings['db'] += time.perf_counter() - db_start
+
+        if passed:
+            counts['passed'] += 1
+        else:
+            counts['failed'] += 1
+            failures.append(path)
+
+    print_summary("verify", counts, timings, time.perf_counter() - start)
+    for path in failures[:args.show_failures]:
+        print(f"  FAIL {path}")
+    return 1 if failures else 0
+
+def is_derivative(path):
+    """Whether path is <color_hash>_<width>.jpg next to its <color_hash>.jpg."""
+    color_hash, _, width = path.stem.rpartition('_')
+    return width.isdigit() and int(width) in DERIVATIVE_WIDTHS and (path.parent / f"{color_hash}.jpg").exists()
+
+def image_width(path):
+    """Width of the image at path, read from its header alone."""
+    with Image.open(path) as img:
+        return img.width
+
+def derivatives(args):
+    output = Path(args.output)
+    smallest = min(DERIVATIVE_WIDTHS)
+    originals = [path for path in sorted(output.glob('*.jpg')) if not is_derivative(path)]
+    paths = [path for path in originals if not (output / derivative_filename(path.stem, smallest, 'webp')).exists()
+             and image_width(path) > smallest]
+    if args.limit:
+        paths = paths[:args.limit]
+    print(f"{len(paths)} images in {output} without derivatives")
+
+    counts = defaultdict(int)
+    timings = defaultdict(float)
+    start = time.perf_counter()
+    for path, result, error in run_pool(derive_file, paths, args.workers):
+        if error is not None:
+            counts['errors'] += 1
+            print(f"Error making derivatives of {path}: {error}")
+            continue
+        counts['processed'] += 1
+        counts['files written'] += 2 * len(result['widths'])
+        for stage, seconds in result['timings'].items():
+            timings[stage] += seconds
+
+    print_summary("derivatives", counts, timings, time.perf_counter() - start)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk color barcode embedding and verification.")
+    parser.add_argument('--db', default=storage.DB_PATH, help="SQLite database (default: %(default)s)")
+    parser.add_argument('--workers', type=int, default=None, help="Pool size (default: CPU count)")
+    parser.add_argument('--limit', type=int, default=0, help="Stop after this many images")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    embed_parser = commands.add_parser('embed', help="Barcode every image under a directory")
+    embed_parser.add_argument('source')
+    embed_parser.add_argument('--output', default='images/output')
+    embed_parser.add_argument('--user-id', default='backfill')
+    embed_parser.add_argument('--manifest', default=None, help=f"(default: <output>/{MANIFEST_NAME})")
+    embed_parser.add_argument('--batch-size', type=int, default=DB_BATCH_SIZE)
+    embed_parser.set_defaults(run=embed)
+
+    verify_parser = commands.add_parser('verify', help="Check the color bars of every image under a directory")
+    verify_parser.add_argument('directory')
+    verify_parser.add_argument('--show-failures', type=int, default=20)
+    verify_parser.set_defaults(run=verify)
+
+    derivatives_parser = commands.add_parser('derivatives', help="Make missing srcset sizes of barcoded images")
+    derivatives_parser.add_argument('--output', default='images/output')
+    derivatives_parser.set_defaults(run=derivatives)
+
+    args = parser.parse_args(argv)
+    storage.use_database(args.db)
+    try:
+        return args.run(args)
+    finally:
+        storage.get_pool().close_all()
+
+if __name__ == "__main__":
+    sys.exit(main())
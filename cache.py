@@ -0,0 +1,80 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """
+    Thread-safe LRU cache whose entries also expire ttl seconds after
+    they were stored. Holds at most max_entries and, if max_bytes is set,
+    at most max_bytes as estimated by weigh(value); the least recently
+    used entries are dropped first. stats counts hits, misses and
+    evictions.
+    """
+
+    def __init__(self, max_entries=1024, ttl=None, max_bytes=None, weigh=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.weigh = weigh
+        self.stats = {'hits': 0, 'misses': 0, 'evicted': 0}
+        self._entries = OrderedDict()  # key -> (expires, value, size)
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def info(self):
+        """stats plus current entries and estimated bytes."""
+        with self._lock:
+            return {**self.stats, 'entries': len(self._entries), 'bytes': self._bytes}
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or (entry[0] is not None and entry[0] <= time.monotonic()):
+                if entry is not None:
+                    self._remove(key)
+                self.stats['misses'] += 1
+                return default
+            self._entries.move_to_end(key)
+            self.stats['hits'] += 1
+            return entry[1]
+
+    def put(self, key, value):
+        expires = time.monotonic() + self.ttl if self.ttl is not None else None
+        size = self.weigh(value) if self.weigh is not None else 0
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (expires, value, size)
+            self._bytes += size
+            while self._entries and (len(self._entries) > self.max_entries or
+                                     (self.max_bytes is not None and self._bytes > self.max_bytes)):
+                self._remove(next(iter(self._entries)))
+                self.stats['evicted'] += 1
+
+    def invalidate(self, match):
+        """Drop every entry whose key satisfies match(key). Returns how many."""
+        with self._lock:
+            stale = [key for key in self._entries if match(key)]
+            for key in stale:
+                self._remove(key)
+        return len(stale)
+
+    def discard(self, keys):
+        """Drop the entries of any of keys, without scanning the rest. Returns how many."""
+        with self._lock:
+            stale = self._entries.keys() & keys
+            for key in stale:
+                self._remove(key)
+        return len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def _remove(self, key):
+        self._bytes -= self._entries.pop(key)[2]
@@ -0,0 +1,118 @@
+import threading
+from itertools import product
+
+import numpy as np
+
+
+class ColorIndex:
+    """
+    Quantized-bucket index for nearest-neighbour lookup of bar color
+    vectors (num_bars RGB triples, i.e. 36 dimensions for 12 bars).
+
+    Bars are grouped into adjacent pairs and each pair is quantized into a
+    6-D cell of cell_size per channel, one bucket table per pair. A query
+    probes every cell within radius of the detected pair colors and ranks
+    the candidates by Euclidean distance over the full vector. Any stored
+    vector with at least one pair of bars within radius per channel of the
+    query is guaranteed to be considered.
+    """
+
+    def __init__(self, num_bars=12, cell_size=32, radius=16):
+        if num_bars % 2:
+            raise ValueError("num_bars must be even")
+        self.num_bars = num_bars
+        self.cell_size = cell_size
+        self.radius = radius
+        self._levels = -(-256 // cell_size)
+        self._weights = self._levels ** np.arange(5, -1, -1, dtype=np.int64)
+        self._tables = [{} for _ in range(num_bars // 2)]
+        self._vectors = np.empty((1024, num_bars * 3), dtype=np.uint8)
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._size
+
+    def add(self, colors):
+        """Add a color vector: raw bytes or an iterable of (R, G, B)."""
+        self.update([colors])
+
+    def update(self, vectors):
+        """Add many color vectors at once; keys are computed in bulk."""
+        vectors = list(vectors)
+        if not vectors:
+            return
+        if all(isinstance(colors, bytes) for colors in vectors):
+            block = _as_vector(b''.join(vectors), self.num_bars * len(vectors)).reshape(len(vectors), -1)
+        else:
+            block = np.stack([_as_vector(colors, self.num_bars) for colors in vectors])
+        keys = self._pair_keys(block)
+        with self._lock:
+            start = self._size
+            self._reserve(start + len(block))
+            self._vectors[start:start + len(block)] = block
+            self._size += len(block)
+            rows = np.arange(start, start + len(block))
+            for table, pair_keys in zip(self._tables, keys.T):
+                order = np.argsort(pair_keys, kind='stable')
+                unique_keys, first = np.unique(pair_keys[order], return_index=True)
+                sorted_rows = rows[order].tolist()
+                bounds = first.tolist() + [len(sorted_rows)]
+                for key, lo, hi in zip(unique_keys.tolist(), bounds, bounds[1:]):
+                    table.setdefault(key, []).extend(sorted_rows[lo:hi])
+
+    def _reserve(self, size):
+        if size <= len(self._vectors):
+            return
+        capacity = len(self._vectors)
+        while capacity < size:
+            capacity *= 2
+        grown = np.empty((capacity, self._vectors.shape[1]), dtype=np.uint8)
+        grown[:self._size] = self._vectors[:self._size]
+        self._vectors = grown
+
+    def nearest(self, colors):
+        """
+        Return (color_bytes, distance) for the closest stored vector to the
+        given colors, or None if no candidate shares a probed cell.
+        """
+        vector = _as_vector(colors, self.num_bars).astype(np.int32)
+        with self._lock:
+            candidates = set()
+            for pair, table in enumerate(self._tables):
+                for key in self._probe_keys(vector[pair * 6:pair * 6 + 6]):
+                    candidates.update(table.get(key, ()))
+            if not candidates:
+                return None
+            rows = np.fromiter(candidates, dtype=np.int64, count=len(candidates))
+            stored = self._vectors[rows]
+        distances = np.sqrt(((stored.astype(np.int32) - vector) ** 2).sum(axis=1))
+        best = int(distances.argmin())
+        return stored[best].tobytes(), float(distances[best])
+
+    def _pair_keys(self, block):
+        """(n, num_bars * 3) vectors -> (n, num_bars // 2) bucket keys."""
+        cells = (block // self.cell_size).astype(np.int64).reshape(len(block), -1, 6)
+        return cells @ self._weights
+
+    def _probe_keys(self, pair_vector):
+        ranges = [
+            range(max(0, int(v) - self.radius) // self.cell_size,
+                  min(255, int(v) + self.radius) // self.cell_size + 1)
+            for v in pair_vector
+        ]
+        for cells in product(*ranges):
+            key = 0
+            for cell in cells:
+                key = key * self._levels + cell
+            yield key
+
+
+def _as_vector(colors, num_bars):
+    if isinstance(colors, (bytes, bytearray)):
+        vector = np.frombuffer(colors, dtype=np.uint8)
+    else:
+        vector = np.asarray(colors, dtype=np.uint8).reshape(-1)
+    if vector.size != num_bars * 3:
+        raise ValueError(f"expected {num_bars * 3} color values, got {vector.size}")
+    return vector
@@ -0,0 +1,83 @@
+import threading
+from itertools import combinations
+
+
+class HammingIndex:
+    """
+    Multi-index hash table over perceptual hashes for "all hashes within
+    Hamming distance k" queries.
+
+    The significant bits of each hash are split into chunks and every chunk
+    value gets its own bucket table. Two hashes within distance k must agree
+    to within k // num_chunks bits on at least one chunk, so a query only
+    probes the buckets near each of its own chunks and checks those
+    candidates with a popcount, instead of scanning every stored hash.
+    """
+
+    def __init__(self, bits=31, chunk_bits=16):
+        self.bits = bits
+        self.chunk_bits = chunk_bits
+        self.num_chunks = -(-bits // chunk_bits)
+        self._shifts = [i * chunk_bits for i in range(self.num_chunks)]
+        self._masks = [(1 << min(chunk_bits, bits - shift)) - 1 for shift in self._shifts]
+        self._tables = [{} for _ in range(self.num_chunks)]
+        self._hashes = set()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._hashes)
+
+    def __contains__(self, value):
+        return _as_int(value) in self._hashes
+
+    def add(self, value):
+        """Add a hash (int or hex string). Adding a known hash is a no-op."""
+        value = _as_int(value)
+        with self._lock:
+            if value in self._hashes:
+                return
+            self._hashes.add(value)
+            for table, shift, mask in zip(self._tables, self._shifts, self._masks):
+                table.setdefault((value >> shift) & mask, []).append(value)
+
+    def update(self, values):
+        for value in values:
+            self.add(value)
+
+    def query(self, value, max_distance):
+        """
+        Return [(hash, distance), ...] for every stored hash within
+        max_distance of value, closest first.
+        """
+        value = _as_int(value)
+        chunk_radius = max_distance // self.num_chunks
+        seen = set()
+        results = []
+        with self._lock:
+            for table, shift, mask in zip(self._tables, self._shifts, self._masks):
+                for probe in _neighbors((value >> shift) & mask, mask.bit_length(), chunk_radius):
+                    for candidate in table.get(probe, ()):
+                        if candidate in seen:
+                            continue
+                        seen.add(candidate)
+                        distance = (candidate ^ value).bit_count()
+                        if distance <= max_distance:
+                            results.append((candidate, distance))
+        results.sort(key=lambda item: item[1])
+        return results
+
+
+def _as_int(value):
+    # Hashes come as hex strings or as the signed 64-bit ints stored in the DB
+    return int(value, 16) if isinstance(value, str) else int(value) & 0xFFFFFFFFFFFFFFFF
+
+
+def _neighbors(value, width, radius):
+    """Yield every width-bit value within Hamming distance radius of value."""
+    yield value
+    for r in range(1, radius + 1):
+        for positions in combinations(range(width), r):
+            flipped = value
+            for bit in positions:
+                flipped ^= 1 << bit
+            yield flipped
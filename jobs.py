@@ -0,0 +1,186 @@
+import math
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+
+# ─────────────────────────────────────────────────────────
+# Configuration
+# ─────────────────────────────────────────────────────────
+JOB_QUEUE_SIZE = 32         # Jobs queued or running before new ones are refused
+JOB_RESULTS_KEPT = 1000     # Finished jobs remembered for status polling
+JOB_TIMINGS_KEPT = 50       # Recent job run times used to estimate Retry-After
+
+
+class QueueFull(Exception):
+    """Raised by JobQueue.submit when max_pending jobs are already waiting."""
+
+    def __init__(self, retry_after):
+        super().__init__(f"job queue full, retry after {retry_after} s")
+        self.retry_after = retry_after
+
+
+class JobQueue:
+    """
+    Bounded queue of jobs served by a process pool (a thread pool with
+    threads=True, for work that releases the GIL and must not fork),
+    which map() also uses for synchronous batches.
+
+    submit() returns a job id straight away and map() reserves a slot per
+    item, or either raises QueueFull, so callers can answer 503 instead of
+    letting requests pile up. on_done(result), if given, runs in this
+    process once a job succeeds, on a results thread of its own so a slow
+    one (a DB write) never stalls the pool's bookkeeping; its return value
+    becomes the job's result (used to store hashes in the parent, where
+    the DB pool and in-memory indexes live); the job stays pending until
+    it returns. on_error(message), if given, runs on the same thread once
+    the job or its on_done has failed. Finished jobs are kept for status()
+    until JOB_RESULTS_KEPT newer ones have finished.
+
+    Job state lives in this process only: with several server worker
+    processes, a job id is only known to the worker that accepted it.
+    """
+
+    def __init__(self, max_workers=None, max_pending=JOB_QUEUE_SIZE, threads=False):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.threads = threads
+        self._executor = None
+        self._lock = threading.Lock()
+        self._running = {}
+        self._mapped = 0
+        self._finished = OrderedDict()
+        self._done = queue.SimpleQueue()
+        self._storer = None
+        self._durations = deque(maxlen=JOB_TIMINGS_KEPT)
+
+    def submit(self, fn, *args, on_done=None, on_error=None):
+        with self._lock:
+            if len(self._running) + self._mapped >= self.max_pending:
+                raise QueueFull(self._retry_after())
+            job_id = uuid.uuid4().hex
+            future = self._pool().submit(_timed, fn, *args)
+            self._running[job_id] = future
+        future.add_done_callback(lambda future: self._finish(job_id, future, on_done, on_error))
+        return job_id
+
+    def map(self, fn, items, *args):
+        """
+        Run fn(item, *args) for every item on the pool and wait for all of
+        them. Returns (result, None) or (None, error message) per item, in
+        order, so one bad item does not sink the rest. Raises QueueFull
+        unless there are free slots for every item.
+        """
+        items = list(items)
+        with self._lock:
+            if len(self._running) + self._mapped + len(items) > self.max_pending:
+                raise QueueFull(self._retry_after())
+            futures = []
+            try:
+                for item in items:
+                    futures.append(self._pool().submit(fn, item, *args))
+            except Exception:
+                for future in futures:
+                    future.cancel()
+                raise
+            # Only once every item is on the pool, so a failed submit
+            # (a broken pool) leaves no slots reserved
+            self._mapped += len(items)
+        outcomes = []
+        try:
+            for future in futures:
+                try:
+                    outcomes.append((future.result(), None))
+                except Exception as e:
+                    outcomes.append((None, str(e)))
+        finally:
+            with self._lock:
+                self._mapped -= len(items)
+        return outcomes
+
+    def status(self, job_id):
+        """
+        ('pending', None), ('done', result), ('error', message), or None
+        for an unknown or expired job id.
+        """
+        with self._lock:
+            if job_id in self._running:
+                return 'pending', None
+            return self._finished.get(job_id)
+
+    def pending(self):
+        with self._lock:
+            return len(self._running) + self._mapped
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait, cancel_futures=not wait)
+
+    def _pool(self):
+        """The worker pool, started on first use. Call with _lock held."""
+        if self._executor is None:
+            if self.threads:
+                from concurrent.futures import ThreadPoolExecutor
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+            else:
+                # Imported here: multiprocessing is slow to import and most
+                # processes using this module never start a pool
+                from concurrent.futures import ProcessPoolExecutor
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        return self._executor
+
+    def _finish(self, job_id, future, on_done, on_error):
+        """
+        Done callback, run on the pool's own thread: jobs with an on_done
+        or on_error are handed to the results thread, started on first use.
+        """
+        if on_done is None and on_error is None:
+            self._store(job_id, future, None, None)
+            return
+        with self._lock:
+            if self._storer is None:
+                self._storer = threading.Thread(target=self._store_results, name='job-results', daemon=True)
+                self._storer.start()
+        self._done.put((job_id, future, on_done, on_error))
+
+    def _store_results(self):
+        while True:
+            try:
+                self._store(*self._done.get())
+            except Exception as e:
+                print(f"Job on_error callback failed: {e}")  # Keep serving the other jobs
+
+    def _store(self, job_id, future, on_done, on_error):
+        elapsed = None
+        try:
+            elapsed, result = future.result()
+            if on_done is not None:
+                result = on_done(result)
+            outcome = ('done', result)
+        except Exception as e:
+            outcome = ('error', str(e))
+        with self._lock:
+            self._running.pop(job_id)
+            if elapsed is not None:
+                self._durations.append(elapsed)
+            self._finished[job_id] = outcome
+            while len(self._finished) > JOB_RESULTS_KEPT:
+                self._finished.popitem(last=False)
+        if outcome[0] == 'error' and on_error is not None:
+            on_error(outcome[1])
+
+    def _retry_after(self):
+        """Whole seconds a job has recently taken to run: about when a slot frees up."""
+        if not self._durations:
+            return 1
+        return max(1, math.ceil(sum(self._durations) / len(self._durations)))
+
+
+def _timed(fn, *args):
+    """Run fn in the worker and report how long it took, excluding queueing."""
+    start = time.perf_counter()
+    result = fn(*args)
+    return time.perf_counter() - start, result
@@ -0,0 +1,335 @@
+import math
+
+import numpy as np
+
+from main import (
+    BAR_HEIGHT_MULTIPLIER,
+    NUM_BARS,
+    bar_geometry,
+)
+
+# ─────────────────────────────────────────────────────────
+# Search parameters
+# ─────────────────────────────────────────────────────────
+SEARCH_PERCENT = 25         # Search the bottom-right SEARCH_PERCENT % of each dimension
+MIN_SCALE = 0.5             # Smallest bar width tried, relative to bar_geometry()
+MAX_SCALE = 3.0             # Largest bar width tried; MIN_BAR_WIDTH bars of small images run large
+MIN_LOCATED_WIDTH = 4       # Narrower bars are not reliably readable after JPEG
+SCALE_STEP = 1.06           # Ratio between consecutive coarse bar widths
+FLAT_THRESHOLD = 24         # Max summed channel difference for a "flat" bar center
+EDGE_THRESHOLD = 40         # Min summed channel step across a bar boundary
+UNIFORMITY_SCALE = 25       # Bar interior std (0-255) at which confidence drops to 1/e
+READ_INSET = 0.2            # Fraction of a bar trimmed from each side when reading colors
+SCORE_INSET = 0.15          # Smaller trim when scoring, so misaligned grids show variance
+COARSE_INSET = 0.3          # Wider trim for coarse hits, which may be a sixth of a bar off
+WORST_BARS = 3              # Bars whose interior std sets the uniformity score
+MAX_BAR_MISSES = 3          # Bars allowed to fail the coarse flat/edge tests
+COARSE_LIMIT = 1024         # Coarse hits per bar width that get scored, most good bars first
+HITS_PER_SCALE = 2          # Coarse hits kept per candidate bar width
+REFINE_CANDIDATES = 24      # Best coarse hits refined with summed-area tables
+LOCATE_CANDIDATES = 6       # Locations returned by locate_color_bar_candidates
+MIN_CONFIDENCE = 0.35       # Below this, a location is not reported
+
+def locate_color_bar(img):
+    """
+    Search near the bottom-right corner of img for a row of NUM_BARS
+    uniform-color rectangles at any bar width between MIN_SCALE and
+    MAX_SCALE times the expected one, allowing for rescaled, padded or
+    cropped screenshots.
+
+    Returns a dict with the bar's top-left 'x', 'y', its (fractional)
+    'bar_width' and 'bar_height', and a 'confidence' in [0, 1], or None
+    if nothing bar-like was found.
+    """
+    candidates = locate_color_bar_candidates(img, limit=1)
+    return candidates[0] if candidates else None
+
+
+def locate_color_bar_candidates(img, limit=LOCATE_CANDIDATES):
+    """
+    Like locate_color_bar, but return up to limit distinct locations,
+    best first. A row of uniform bars next to a flat background scores
+    almost the same when shifted by one bar, so the neighbours of the
+    best hit are always included; callers that know the expected colors
+    should try each candidate.
+
+    A coarse pass tests bar centers and boundaries on a grid of about a
+    third of a bar width at each candidate width; the best hits are then
+    scored with summed-area tables over each bar interior and refined at
+    single-pixel steps.
+    """
+    w, h = img.size
+    expected_width, _, _ = bar_geometry(w, h)
+    max_total = math.ceil(expected_width * MAX_SCALE * NUM_BARS)
+    max_height = math.ceil(expected_width * MAX_SCALE * BAR_HEIGHT_MULTIPLIER)
+    region_w = min(w, max(max_total, int(w * SEARCH_PERCENT / 100)))
+    region_h = min(h, max(max_height, int(h * SEARCH_PERCENT / 100)))
+    origin_x, origin_y = w - region_w, h - region_h
+
+    region = img.crop((origin_x, origin_y, w, h))
+    if region.mode != "RGB":
+        region = region.convert("RGB")
+    pixels = np.asarray(region)
+    # Separate channel planes: per-channel ops on (H, W) arrays are several
+    # times faster than reducing over the trailing axis of (H, W, 3)
+    planes = [pixels[:, :, channel].astype(np.int16) for channel in range(3)]
+    flat = _flat_map(planes)
+    edges = _edge_map(planes)
+
+    hits = []
+    dilated = {}
+    for bar_width in _candidate_widths(expected_width):
+        stride = max(1, int(bar_width / 3))
+        if stride not in dilated:
+            dilated[stride] = _dilate_columns(edges, stride // 2 + 1)
+        hits.extend(_coarse_hits(pixels, flat, dilated[stride], bar_width, stride))
+    hits.sort(key=lambda hit: hit[0], reverse=True)
+
+    refined = []
+    for _, x, y, bar_width in hits[:REFINE_CANDIDATES]:
+        best = _refine(pixels, x, y, bar_width)
+        if best and best[0] >= MIN_CONFIDENCE:
+            refined.append(best)
+    if not refined:
+        return []
+    refined.sort(reverse=True)
+
+    # Shifted-by-one-bar neighbours of the best hit
+    confidence, x, y, bar_width = refined[0]
+    for shift in (-1, 1):
+        shifted = _refine(pixels, x + int(round(shift * bar_width)), y, bar_width)
+        if shifted and shifted[0] >= MIN_CONFIDENCE:
+            refined.insert(1, shifted)
+
+    locations = []
+    for confidence, x, y, bar_width in refined:
+        if any(abs(x - other[1]) < bar_width / 2 and abs(y - other[2]) < bar_width / 2
+               for other in locations):
+            continue
+        locations.append((confidence, x, y, bar_width))
+        if len(locations) == limit:
+            break
+    return [
+        {
+            'x': origin_x + x,
+            'y': origin_y + y,
+            'bar_width': bar_width,
+            'bar_height': bar_width * BAR_HEIGHT_MULTIPLIER,
+            'confidence': round(confidence, 3),
+        }
+        for confidence, x, y, bar_width in locations
+    ]
+
+
+def read_located_colors(img, location):
+    """
+    Average each bar interior of a bar found by locate_color_bar.
+    Returns a list of (R,G,B), like verify_image_colors.
+    """
+    x, y, bar_width = location['x'], location['y'], location['bar_width']
+    bar_height = location['bar_height']
+    region = img.crop((x, y, math.ceil(x + bar_width * NUM_BARS), math.ceil(y + bar_height)))
+    if region.mode != "RGB":
+        region = region.convert("RGB")
+    table = _summed_area_table(np.asarray(region))
+    means, _ = _bar_stats(table, np.zeros(1, dtype=int), np.zeros(1, dtype=int), bar_width)
+    return [tuple(color) for color in np.rint(means[0]).astype(int).tolist()]
+
+
+# ─────────────────────────────────────────────────────────
+# Internals
+# ─────────────────────────────────────────────────────────
+
+def _candidate_widths(expected_width):
+    smallest = max(MIN_LOCATED_WIDTH, expected_width * MIN_SCALE)
+    largest = max(smallest, expected_width * MAX_SCALE)
+    count = int(math.log(largest / smallest) / math.log(SCALE_STEP)) + 1
+    return [smallest * SCALE_STEP ** i for i in range(count)]
+
+
+def _flat_map(planes):
+    """True where a pixel matches the pixels directly above and below it."""
+    steps = sum(np.abs(np.diff(plane, axis=0)) for plane in planes) <= FLAT_THRESHOLD
+    flat = np.zeros(planes[0].shape, dtype=bool)
+    flat[1:-1] = steps[:-1] & steps[1:]
+    return flat
+
+
+def _edge_map(planes):
+    """True where the color steps sharply across columns x-2 .. x+1."""
+    edges = np.zeros(planes[0].shape, dtype=bool)
+    edges[:, 2:-1] = sum(np.abs(plane[:, 3:] - plane[:, :-3]) for plane in planes) >= EDGE_THRESHOLD
+    return edges
+
+
+def _dilate_columns(mask, radius):
+    """Spread True values radius columns to each side."""
+    dilated = mask.copy()
+    for shift in range(1, radius + 1):
+        dilated[:, shift:] |= mask[:, :-shift]
+        dilated[:, :-shift] |= mask[:, shift:]
+    return dilated
+
+
+def _grid(limit, stride):
+    """0..limit at the given stride, always including limit itself (a flush bar)."""
+    points = np.arange(0, limit + 1, stride)
+    return points if points[-1] == limit else np.append(points, limit)
+
+
+def _coarse_hits(pixels, flat, edges, bar_width, stride):
+    """
+    Grid positions (a third of a bar apart) where at least
+    NUM_BARS - MAX_BAR_MISSES bars have a flat center and a sharp edge
+    against the previous bar. Returns the best HITS_PER_SCALE as
+    [(score, x, y, bar_width), ...], scored from a few pixels per bar kept
+    far enough from its edges that positions half a stride off still see
+    uniform bar interiors.
+    """
+    height, width = flat.shape
+    total_width = math.ceil(bar_width * NUM_BARS)
+    bar_height = math.ceil(bar_width * BAR_HEIGHT_MULTIPLIER)
+    if total_width > width or bar_height > height:
+        return []
+    ys = _grid(height - bar_height, max(1, int(bar_width * 0.9)))
+    xs = _grid(width - total_width, stride)
+    cy = int(bar_width * BAR_HEIGHT_MULTIPLIER / 2)
+    centers = [int((i + 0.5) * bar_width) for i in range(NUM_BARS)]
+    boundaries = [int(round(i * bar_width)) for i in range(NUM_BARS)]
+
+    # Grid positions in a grid row share their bar-center row, so those
+    # rows are taken once. The columns of bar i are then xs + an offset:
+    # a strided view of the rows for the regular part of the grid, plus
+    # the flush column _grid may append. Count the good bars per position.
+    flat_rows, edge_rows = flat[ys + cy], edges[ys + cy]
+    regular = len(xs) - (len(xs) > 1 and xs[-1] - xs[-2] != stride)
+    span = stride * (regular - 1) + 1
+
+    def columns(rows, offset):
+        view = rows[:, offset:offset + span:stride]
+        if regular == len(xs):
+            return view
+        return np.concatenate([view, rows[:, offset + xs[-1:]]], axis=1)
+
+    good = columns(flat_rows, centers[0]).astype(np.int8)
+    for i in range(1, NUM_BARS):
+        good += columns(flat_rows, centers[i]) & columns(edge_rows, boundaries[i])
+    good = good.ravel()
+    keep = np.flatnonzero(good >= NUM_BARS - MAX_BAR_MISSES)
+    if not len(keep):
+        return []
+    if len(keep) > COARSE_LIMIT:
+        keep = keep[np.argsort(-good[keep], kind='stable')[:COARSE_LIMIT]]
+    hit_ys, hit_xs = ys[keep // len(xs)], xs[keep % len(xs)]
+
+    # Sample each bar at its center, a quarter bar above and below it, and
+    # COARSE_INSET in from its left and right edges
+    dy = max(1, int(bar_width / 4))
+    offsets = []
+    for i, cx in enumerate(centers):
+        left = math.ceil(i * bar_width + bar_width * COARSE_INSET)
+        right = math.floor((i + 1) * bar_width - bar_width * COARSE_INSET)
+        offsets.append([(0, cx), (-dy, cx), (dy, cx), (0, left), (0, right)])
+    offsets = np.array(offsets)
+    rows = hit_ys[:, None, None] + cy + offsets[None, :, :, 0]
+    columns = hit_xs[:, None, None] + offsets[None, :, :, 1]
+    # np.take on flat pixel indices and explicit sums over the five samples
+    # are several times faster than 2-D fancy indexing and .mean(axis=2)
+    samples = np.take(pixels.reshape(-1, 3), rows * width + columns, axis=0).astype(np.float32)
+    samples = [samples[:, :, k] for k in range(samples.shape[2])]
+    means = sum(samples) / len(samples)
+    spread = np.sqrt(sum(((sample - means) ** 2).sum(axis=2) for sample in samples) / (len(samples) * 3))
+    scores = _confidence(means, spread)
+    top = np.argsort(scores)[::-1][:HITS_PER_SCALE]
+    return [(float(scores[i]), int(hit_xs[i]), int(hit_ys[i]), bar_width) for i in top]
+
+
+def _summed_area_table(pixels):
+    """(H+1, W+1, 4) cumulative sums of R, G, B and R² + G² + B²."""
+    pixels = pixels.astype(np.int32)
+    planes = np.concatenate([pixels, (pixels * pixels).sum(axis=2, keepdims=True)], axis=2)
+    table = np.zeros((pixels.shape[0] + 1, pixels.shape[1] + 1, 4), dtype=np.int64)
+    np.cumsum(planes, axis=0, out=planes)
+    np.cumsum(planes, axis=1, dtype=np.int64, out=table[1:, 1:])
+    return table
+
+
+def _interiors(bar_width, inset_fraction=READ_INSET):
+    """Per-bar interior column offsets x0, x1 (arrays) and the (y0, y1) row span."""
+    inset = bar_width * inset_fraction
+    edges = np.arange(NUM_BARS + 1) * bar_width
+    x0 = np.ceil(edges[:-1] + inset).astype(np.int64)
+    x1 = np.maximum(x0 + 1, np.floor(edges[1:] - inset).astype(np.int64))
+    y0 = math.ceil(inset)
+    return (x0, x1), (y0, max(y0 + 1, math.floor(bar_width * BAR_HEIGHT_MULTIPLIER - inset)))
+
+
+def _bar_stats(table, xs, ys, bar_width, inset_fraction=READ_INSET):
+    """Mean color (n, NUM_BARS, 3) and std (n, NUM_BARS) of each bar interior."""
+    (x0, x1), (y0, y1) = _interiors(bar_width, inset_fraction)
+    top, bottom = (ys + y0)[:, None], (ys + y1)[:, None]
+    left, right = xs[:, None] + x0, xs[:, None] + x1
+    sums = table[bottom, right] - table[top, right] - table[bottom, left] + table[top, left]
+    area = (x1 - x0) * (y1 - y0)
+    means = sums[..., :3] / area[:, None]
+    variance = np.maximum(sums[..., 3] / area - (means * means).sum(axis=2), 0) / 3
+    return means, np.sqrt(variance)
+
+
+def _score(table, xs, ys, bar_width, inset_fraction=SCORE_INSET):
+    """Confidence of the bar grids at (xs, ys) from summed-area table sums."""
+    means, stds = _bar_stats(table, xs, ys, bar_width, inset_fraction)
+    return _confidence(means, stds)
+
+
+def _confidence(means, stds):
+    """
+    Confidence in [0, 1]: uniform bar interiors with distinct neighbours.
+    Uniformity is taken from the worst few bars, so a grid that straddles
+    real bar edges is penalised even if most of its cells are clean, and
+    contrast is squared, so a grid at half the true width (every other
+    neighbour identical) cannot win on uniformity alone.
+    """
+    spread = np.sort(stds, axis=1)[:, -WORST_BARS:].mean(axis=1)
+    steps = np.linalg.norm(np.diff(means, axis=1), axis=2)
+    contrast = (steps >= EDGE_THRESHOLD).mean(axis=1)
+    return np.exp(-spread / UNIFORMITY_SCALE) * contrast ** 2
+
+
+def _refine(pixels, x, y, bar_width):
+    """
+    Score every position within half a bar of a coarse hit, then a few
+    widths around the best one, using a summed-area table of just that
+    window. Returns (confidence, x, y, bar_width) or None.
+    """
+    height, width = pixels.shape[:2]
+    radius = max(1, int(bar_width / 2))
+    widest = bar_width * math.sqrt(SCALE_STEP)
+    left, top = max(0, x - radius - 1), max(0, y - radius - 1)
+    right = min(width, x + radius + math.ceil(widest * NUM_BARS) + 2)
+    bottom = min(height, y + radius + math.ceil(widest * BAR_HEIGHT_MULTIPLIER) + 2)
+    window = pixels[top:bottom, left:right]
+    table = _summed_area_table(window)
+
+    def best_in(x0, x1, y0, y1, bar_width):
+        max_x = window.shape[1] - math.ceil(bar_width * NUM_BARS)
+        max_y = window.shape[0] - math.ceil(bar_width * BAR_HEIGHT_MULTIPLIER)
+        rows = np.arange(max(0, y0), min(max_y, y1) + 1)
+        columns = np.arange(max(0, x0), min(max_x, x1) + 1)
+        if not len(rows) or not len(columns):
+            return None
+        ys, xs = (grid.ravel() for grid in np.meshgrid(rows, columns, indexing='ij'))
+        scores = _score(table, xs, ys, bar_width)
+        i = int(scores.argmax())
+        return float(scores[i]), int(xs[i]), int(ys[i]), float(bar_width)
+
+    best = best_in(x - left - radius, x - left + radius, y - top - radius, y - top + radius, bar_width)
+    if best is None:
+        return None
+    _, bx, by, _ = best
+    for fine_width in bar_width * np.linspace(1 / math.sqrt(SCALE_STEP), math.sqrt(SCALE_STEP), 5):
+        found = best_in(bx - 1, bx + 1, by - 1, by + 1, fine_width)
+        if found and found[0] > best[0]:
+            best = found
+    confidence, bx, by, bar_width = best
+    return confidence, left + bx, top + by, bar_width
@@ -1,14 +1,20 @@
+import io
 import os
 import random
+import threading
 import time
 import colorsys
 import base64
-import sqlite3
 from datetime import datetime
+from functools import lru_cache
 from pathlib import Path
-from PIL import Image
+from PIL import GifImagePlugin, Image, ImageSequence
 import numpy as np
-from scipy.fftpack import dct
+
+import metrics
+import storage
+from color_index import ColorIndex
+from hash_index import HammingIndex
 
 # ─────────────────────────────────────────────────────────
 # Configuration / Constants
@@ -17,56 +23,119 @@ MAX_IMAGES_TO_PROCESS = 4   # Max number of images for batch processing
 BAR_SIZE_PERCENT = 0.5      # Color bar size as percent of smallest dimension (can be a float)
 COLOR_TOLERANCE = 40        # Tolerance for color-matching
 JPG_QUALITY = 85            # JPEG compression quality
+WEBP_QUALITY = 80           # WebP compression quality for downscaled derivatives
+DERIVATIVE_WIDTHS = (320, 640, 1280)  # Widths (px) of the downscaled copies offered via srcset, ascending
 REQUIRED_MATCH_PERCENT = 75 # % of bars that must match
 MIN_BAR_WIDTH = 5           # Minimum width (in px) for each color bar
 BAR_HEIGHT_MULTIPLIER = 2   # Height is this times the bar width
 NUM_BARS = 12               # Number of vertical bars in the color "barcode"
 NUM_PALETTE_COLORS = 24     # If using color palettes, how many distinct colors
+HASH_DECODE_MIN_SIZE = 256  # Smallest side (px) kept by reduced-scale decodes for hashing
+MAX_IMAGE_PIXELS = 64_000_000    # Uploads with more pixels are refused from the header, before decoding
+LARGE_IMAGE_PIXELS = 16_000_000  # Uploads with more pixels are hashed from a reduced-scale decode
+HASH_BITS = 31              # Significant bits in a phash_dhash_combo hash (15 pHash + 16 dHash)
+HASH_MATCH_DISTANCE = 3     # Max Hamming distance for a near-duplicate hash match
+NEAR_MATCH_CANDIDATES = 8   # Closest near-duplicate hashes whose bars /verify checks
+COLOR_INDEX_RADIUS = 16     # Per-channel drift the color index always probes for
+GIF_COLORS = 256            # Palette entries per animated GIF frame, the last NUM_BARS kept for the bar
+ANIMATION_SAMPLE_FRAMES = 3 # Frames of an animated upload whose bars /verify reads
+ANIMATION_SAMPLE_SPAN = 50  # Those frames are spread over at most this many leading frames
+MAX_ANIMATION_FRAMES = 300  # Animations with more frames are refused from the header
+MAX_ANIMATION_PIXELS = 100_000_000  # Refused when frames x width x height exceeds this (~2 s of re-encoding)
 
 # Seed random for any globally used random calls.
 random.seed(int(time.time()))
 
+# In-process near-duplicate index over every stored perceptual_hash.
+perceptual_index = HammingIndex(bits=HASH_BITS)
+
+# In-process nearest-neighbour index over every stored color_hash vector.
+color_index = ColorIndex(num_bars=NUM_BARS, radius=COLOR_INDEX_RADIUS)
+
+# Highest image_hashes id already in both indexes: load_indexes reads only
+# newer rows, whichever process stored them.
+indexes_watermark = 0
+indexes_lock = threading.Lock()
+
+# Called with each batch of rows load_indexes adds, as stored
+# [(perceptual_hash, color_hash, user_id), ...], e.g. to drop cached
+# lookups or pages they change.
+index_listeners = []
+
 # ─────────────────────────────────────────────────────────
 # Utility and Core Functions
 # ─────────────────────────────────────────────────────────
 
 def init_db():
     """
-    Initialize SQLite database (images.db) and create tables if not exist.
-    """
-    conn = sqlite3.connect('images.db')
-    c = conn.cursor()
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS image_hashes (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id TEXT NOT NULL,
-            perceptual_hash TEXT NOT NULL,
-            color_hash TEXT NOT NULL,
-            query_count INTEGER DEFAULT 0,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            UNIQUE(perceptual_hash, color_hash)
-        )
-    ''')
-    conn.commit()
-    conn.close()
+    Create or upgrade the SQLite database (images.db) to the latest schema.
+    """
+    storage.migrate()
 
 def store_image_hashes(perceptual_hash, color_hash, user_id='anonymous'):
     """
     Insert the combination of perceptual_hash and color_hash into DB.
-    Now accepts the Auth0 user ID directly.
+    Now accepts the Auth0 user ID directly. The in-memory indexes and
+    index_listeners see it through load_indexes.
     """
-    conn = sqlite3.connect('images.db')
-    c = conn.cursor()
-    try:
-        c.execute('''
-            INSERT INTO image_hashes (user_id, perceptual_hash, color_hash)
-            VALUES (?, ?, ?)
-        ''', (user_id, perceptual_hash, color_hash))
-        conn.commit()
-    except sqlite3.IntegrityError:
-        pass  # This combination already exists
-    finally:
-        conn.close()
+    storage.insert_image_hash(user_id, storage.perceptual_hash_to_int(perceptual_hash), color_hash_to_bytes(color_hash))
+    load_indexes()
+
+def store_image_hashes_batch(pairs, user_id='anonymous'):
+    """
+    Insert several (perceptual_hash, color_hash) pairs for one user in a
+    single DB transaction, then bring the in-memory indexes up to date.
+    """
+    rows = [(storage.perceptual_hash_to_int(perceptual_hash), color_hash_to_bytes(color_hash))
+            for perceptual_hash, color_hash in pairs]
+    storage.insert_image_hashes(user_id, rows)
+    load_indexes()
+
+def load_indexes():
+    """
+    Add the rows stored since the last call to perceptual_index and
+    color_index, whichever process stored them (other server workers,
+    bulk.py), then passes them to index_listeners; the first call loads
+    every row. Returns how many rows were added.
+    """
+    global indexes_watermark
+    with indexes_lock:
+        rows = storage.image_hashes_since(indexes_watermark)
+        if not rows:
+            return 0
+        indexes_watermark = rows[-1][0]
+        perceptual_index.update(perceptual_hash for _, perceptual_hash, _, _ in rows)
+        color_index.update([color_bytes for _, _, color_bytes, _ in rows])
+    stored = [row[1:] for row in rows]
+    for listener in index_listeners:
+        listener(stored)
+    return len(rows)
+
+def find_similar_hashes(perceptual_hash, max_distance=HASH_MATCH_DISTANCE):
+    """
+    Return [(perceptual_hash, distance), ...] for registered hashes within
+    max_distance bits of perceptual_hash, closest first.
+    """
+    return [
+        (format(value, '016x'), distance)
+        for value, distance in perceptual_index.query(perceptual_hash, max_distance)
+    ]
+
+@lru_cache(maxsize=None)
+def _dct_matrix(n):
+    """
+    Unnormalized type-II DCT as an (n, n) matrix, matching scipy's
+    dct(x, norm=None): D @ x == dct(x).
+    """
+    k = np.arange(n).reshape(-1, 1)
+    i = np.arange(n).reshape(1, -1)
+    return 2 * np.cos(np.pi * k * (2 * i + 1) / (2 * n))
+
+def _bits_to_hex(bits, width=16):
+    """Pack a 0/1 array (most significant bit first) into a hex string."""
+    bits = np.asarray(bits, dtype=np.uint8)
+    padded = np.concatenate([np.zeros(-len(bits) % 8, dtype=np.uint8), bits])
+    return format(int.from_bytes(np.packbits(padded).tobytes(), 'big'), 'x').rjust(width, '0')
 
 def phash_dhash_combo(image, hash_size=4):
     """
@@ -75,28 +144,127 @@ def phash_dhash_combo(image, hash_size=4):
     - Difference hash (dHash).
     Merges both bit strings into one 64-bit hex string.
     """
+    gray = image if image.mode == 'L' else image.convert('L')
+
     # pHash
-    gray_phash = image.convert('L').resize((hash_size, hash_size), Image.Resampling.LANCZOS)
-    phash_pixels = np.array(gray_phash.getdata(), dtype=float).reshape((hash_size, hash_size))
-    dct_result = dct(dct(phash_pixels, axis=0), axis=1)
-    dct_low = dct_result[:hash_size, :hash_size]
+    phash_pixels = np.asarray(gray.resize((hash_size, hash_size), Image.Resampling.LANCZOS), dtype=float)
+    dct_matrix = _dct_matrix(hash_size)
+    # Round away float noise so exact ties (e.g. flat images) compare equal
+    dct_low = np.round(dct_matrix @ phash_pixels @ dct_matrix.T, 6)[:hash_size, :hash_size]
     # Exclude the first DC term from average
     avg = (dct_low[0, 1:].sum() + dct_low[1:, :].sum()) / (hash_size * hash_size - 1)
-    phash_bits = ''.join(['1' if val >= avg else '0' for val in dct_low.flatten()[1:]])
+    phash_bits = dct_low.flatten()[1:] >= avg
 
     # dHash
-    gray_dhash = image.convert('L').resize((hash_size + 1, hash_size), Image.Resampling.LANCZOS)
-    dhash_pixels = np.array(gray_dhash.getdata(), dtype=float).reshape((hash_size, hash_size + 1))
-    dhash_bits = ''.join([
-        '1' if dhash_pixels[i, j] > dhash_pixels[i, j + 1] else '0'
-        for i in range(hash_size)
-        for j in range(hash_size)
-    ])
+    dhash_pixels = np.asarray(gray.resize((hash_size + 1, hash_size), Image.Resampling.LANCZOS), dtype=float)
+    dhash_bits = (dhash_pixels[:, :-1] > dhash_pixels[:, 1:]).flatten()
 
     # Combine to 64 bits
-    combined_bits = phash_bits + dhash_bits
-    hashcode = hex(int(combined_bits, 2))[2:].rjust(16, '0')  # 16 hex chars = 64 bits
-    return hashcode
+    return _bits_to_hex(np.concatenate([phash_bits, dhash_bits]))  # 16 hex chars = 64 bits
+
+def load_image_for_hashing(fp, min_size=HASH_DECODE_MIN_SIZE):
+    """
+    Open an image for hashing only. JPEGs are decoded at a reduced DCT
+    scale (PIL draft mode) that still keeps both sides >= min_size;
+    other formats decode normally. Returns a grayscale image.
+    """
+    img = Image.open(fp)
+    if img.format == 'JPEG':
+        img.draft('RGB', (min_size, min_size))
+    return img.convert('L')
+
+def hash_image_file(fp, hash_size=4):
+    """
+    Compute phash_dhash_combo from a file path or stream via a
+    reduced-scale decode. Matches phash_dhash_combo on the full image
+    for everything in images/; on very large JPEGs a few bits may differ.
+    """
+    return phash_dhash_combo(load_image_for_hashing(fp), hash_size)
+
+class ImageTooLarge(ValueError):
+    """An upload whose header declares more pixels or frames than allowed."""
+
+def open_upload(fp, max_pixels=MAX_IMAGE_PIXELS, max_frames=MAX_ANIMATION_FRAMES,
+                max_animation_pixels=MAX_ANIMATION_PIXELS):
+    """
+    Open an upload (path, file object or bytes) without decoding its
+    pixels. Raises ImageTooLarge if the header declares more than
+    max_pixels, so an image that would decode to hundreds of megabytes
+    is refused before any are allocated. An animation is also refused
+    past max_frames frames or max_animation_pixels pixels over all its
+    frames, since re-encoding it costs time (and output) per frame; the
+    frame count is parsed from the file without decoding any frame.
+    """
+    if isinstance(fp, (bytes, bytearray)):
+        fp = io.BytesIO(fp)
+    img = Image.open(fp)
+    if img.width * img.height > max_pixels:
+        raise ImageTooLarge(f"Image is {img.width}x{img.height}, over the limit of {max_pixels:,} pixels")
+    if is_animated(img):
+        frames = img.n_frames
+        if frames > max_frames:
+            raise ImageTooLarge(f"Animation has {frames} frames, over the limit of {max_frames}")
+        if frames * img.width * img.height > max_animation_pixels:
+            raise ImageTooLarge(f"Animation is {frames} frames of {img.width}x{img.height}, "
+                                f"over the limit of {max_animation_pixels:,} pixels in all")
+    return img
+
+def decode_rgb(img):
+    """Decode an opened image as RGB; unlike convert(), an RGB image is not copied."""
+    if img.mode == 'RGB':
+        img.load()
+        return img
+    return img.convert('RGB')
+
+def decode_upload(fp, max_pixels=MAX_IMAGE_PIXELS, max_frames=MAX_ANIMATION_FRAMES,
+                  max_animation_pixels=MAX_ANIMATION_PIXELS, watch=None):
+    """
+    (RGB image, perceptual_hash) for an upload checked by open_upload,
+    with 'decode' and 'hash' laps on watch. Images over LARGE_IMAGE_PIXELS are hashed from a
+    reduced-scale decode before the full one, so the full-size pixels are
+    the only large buffer ever held; /process and /verify both go through
+    here, so an image is hashed the same way by both.
+    """
+    watch = watch or metrics.Stopwatch()
+    if isinstance(fp, (bytes, bytearray)):
+        fp = io.BytesIO(fp)
+    img = open_upload(fp, max_pixels, max_frames, max_animation_pixels)
+    if img.width * img.height > LARGE_IMAGE_PIXELS:
+        perceptual_hash = upload_perceptual_hash(fp, img)
+        watch.lap('hash')
+        if hasattr(fp, 'seek'):
+            fp.seek(0)
+        img = decode_rgb(Image.open(fp))
+        watch.lap('decode')
+    else:
+        img = decode_rgb(img)
+        watch.lap('decode')
+        perceptual_hash = upload_perceptual_hash(fp, img)
+        watch.lap('hash')
+    return img, perceptual_hash
+
+def upload_perceptual_hash(fp, img):
+    """
+    perceptual_hash of the upload in fp, opened or decoded as img, the way
+    decode_upload computes it: from a reduced-scale decode of fp over
+    LARGE_IMAGE_PIXELS, from img itself otherwise.
+    """
+    if img.width * img.height > LARGE_IMAGE_PIXELS:
+        if hasattr(fp, 'seek'):
+            fp.seek(0)
+        return hash_image_file(fp)
+    return phash_dhash_combo(img)
+
+def find_nearest_color_hash(colors):
+    """
+    Return (color_hash, distance) for the registered color_hash closest to
+    the given bar colors in NUM_BARS * 3 dimensional RGB space, or None.
+    """
+    nearest = color_index.nearest(colors)
+    if nearest is None:
+        return None
+    color_bytes, distance = nearest
+    return bytes_to_color_hash(color_bytes), distance
 
 def generate_color_uuid_from_hash(img, colors, hash_value):
     """
@@ -133,50 +301,263 @@ def encode_uuid_for_url(uuid_colors):
     url_safe = base64.urlsafe_b64encode(binary_data).decode('ascii').rstrip('=')
     return url_safe
 
+def bar_geometry(img_width, img_height):
+    """
+    Return (bar_width, bar_height, total_width) for the color bar of an
+    image with the given dimensions.
+    """
+    bar_width = max(MIN_BAR_WIDTH, int((min(img_width, img_height) * BAR_SIZE_PERCENT) / 100))
+    bar_height = bar_width * BAR_HEIGHT_MULTIPLIER
+    return bar_width, bar_height, bar_width * NUM_BARS
+
 def create_color_bar(uuid_colors, img_width, img_height):
     """
     Create a vertical color bar image from a list of colors (uuid_colors).
     Each bar is a set width and (width * BAR_HEIGHT_MULTIPLIER) in height.
+    The whole bar is built with a single array broadcast.
     """
-    num_bars = len(uuid_colors)
-    bar_width = max(MIN_BAR_WIDTH, int((min(img_width, img_height) * BAR_SIZE_PERCENT) / 100))
-    bar_height = bar_width * BAR_HEIGHT_MULTIPLIER
-    total_width = bar_width * num_bars
+    bar_width, bar_height, _ = bar_geometry(img_width, img_height)
+    row = np.repeat(np.asarray(uuid_colors, dtype=np.uint8).reshape(-1, 3), bar_width, axis=0)
+    bar = np.ascontiguousarray(np.broadcast_to(row, (bar_height,) + row.shape))
+    return Image.fromarray(bar, mode="RGB")
 
-    bar_img = Image.new("RGB", (total_width, bar_height), color=(255, 255, 255))
-    for i, (r, g, b) in enumerate(uuid_colors):
-        for x in range(bar_width):
-            for y in range(bar_height):
-                bar_img.putpixel((i * bar_width + x, y), (r, g, b))
+def bar_interiors(img):
+    """
+    Pixels of every bar in the bottom-right color bar, shaped
+    (rows, NUM_BARS, cols, 3). A small border is trimmed from each bar so
+    JPEG ringing at the bar edges does not skew its statistics.
+    """
+    w, h = img.size
+    bar_width, bar_height, total_width = bar_geometry(w, h)
+    region = img.crop((w - total_width, h - bar_height, w, h))
+    if region.mode != "RGB":
+        region = region.convert("RGB")
+    bars = np.asarray(region).reshape(bar_height, NUM_BARS, bar_width, 3)
 
-    return bar_img
+    inset_x = bar_width // 5
+    inset_y = bar_height // 5
+    return bars[inset_y:bar_height - inset_y, :, inset_x:bar_width - inset_x]
+
+def sample_bar_colors(img):
+    """
+    Average the interior of every bar in the bottom-right color bar.
+    Returns a (NUM_BARS, 3) float array.
+    """
+    return bar_interiors(img).mean(axis=(0, 2))
 
 def verify_image_colors(img):
     """
     Given an image with color bars appended, read the bar region and
     extract the average color of each bar. Returns a list of (R,G,B).
     """
-    w, h = img.size
-    bar_width = max(MIN_BAR_WIDTH, int((min(w, h) * BAR_SIZE_PERCENT) / 100))
-    bar_height = bar_width * BAR_HEIGHT_MULTIPLIER
-    total_width = bar_width * NUM_BARS
-    bar_x = w - total_width
-    bar_y = h - bar_height
-
-    detected = []
-    for i in range(NUM_BARS):
-        x_center = bar_x + i * bar_width + bar_width // 2
-        y_center = bar_y + bar_height // 2
-
-        # Sample center pixel and neighbors for a small smoothing
-        left_color = img.getpixel((x_center - 1, y_center))
-        center_color = img.getpixel((x_center, y_center))
-        right_color = img.getpixel((x_center + 1, y_center))
-        avg_r = (left_color[0] + center_color[0] + right_color[0]) // 3
-        avg_g = (left_color[1] + center_color[1] + right_color[1]) // 3
-        avg_b = (left_color[2] + center_color[2] + right_color[2]) // 3
-        detected.append((avg_r, avg_g, avg_b))
-    return detected
+    means = np.rint(sample_bar_colors(img)).astype(int)
+    return [tuple(color) for color in means.tolist()]
+
+def verify_batch_colors(images):
+    """
+    Sample the color bars of several images at once.
+    Returns an (N, NUM_BARS, 3) integer array, one row per image.
+    """
+    if not images:
+        return np.empty((0, NUM_BARS, 3), dtype=int)
+    return np.rint(np.stack([sample_bar_colors(img) for img in images])).astype(int)
+
+def compare_bar_colors(expected, detected, tolerance=COLOR_TOLERANCE):
+    """
+    Vectorized tolerance check between expected and detected bar colors.
+    Accepts (NUM_BARS, 3) arrays or batches shaped (N, NUM_BARS, 3).
+    Returns (diffs, matches, match_count, required_matches); a bar matches
+    when every channel is within the tolerance.
+    """
+    expected = np.asarray(expected, dtype=np.int16)
+    detected = np.asarray(detected, dtype=np.int16)
+    diffs = np.abs(expected - detected)
+    matches = (diffs <= tolerance).all(axis=-1)
+    match_count = matches.sum(axis=-1)
+    required_matches = int(matches.shape[-1] * REQUIRED_MATCH_PERCENT / 100)
+    return diffs, matches, match_count, required_matches
+
+def is_animated(img):
+    """Whether an opened image has more than one frame (animated GIF or WebP)."""
+    return getattr(img, 'is_animated', False)
+
+def animation_frames(source):
+    """
+    Yield (RGB frame, duration in ms) for each frame of an opened
+    animation, decoding one frame per step, so memory holds a single frame
+    however long the animation is.
+    """
+    for frame in ImageSequence.Iterator(source):
+        rgb = frame.convert('RGB')  # Loads the frame, which sets its duration
+        yield rgb, frame.info.get('duration', 0)
+
+def save_barcoded_gif(source, uuid_colors, path):
+    """
+    Re-encode an opened animation as an animated GIF at path with the
+    color bar on every frame, keeping frame durations and the loop count.
+    Frames are written as they are decoded: each is quantized to
+    GIF_COLORS - NUM_BARS colors (fast octree; median cut is ~70x slower on
+    photos), the bar's exact colors fill the rest of its palette and the
+    bar is pasted as those indexes, so quantizing never shifts the bar.
+    Returns the number of frames.
+    """
+    width, height = source.size
+    bar_width, bar_height, total_width = bar_geometry(width, height)
+    photo_colors = GIF_COLORS - NUM_BARS
+    row = np.repeat(np.arange(photo_colors, GIF_COLORS, dtype=np.uint8), bar_width)
+    bar = Image.frombytes('P', (total_width, bar_height), np.tile(row, bar_height).tobytes())
+    bar_palette = [channel for color in uuid_colors for channel in color]
+
+    frames = 0
+    with open(path, 'wb') as fp:
+        for frame, duration in animation_frames(source):
+            indexed = frame.quantize(photo_colors, method=Image.Quantize.FASTOCTREE)
+            palette = indexed.getpalette()[:3 * photo_colors]
+            indexed.putpalette(palette + [0] * (3 * photo_colors - len(palette)) + bar_palette)
+            indexed.paste(bar, (width - total_width, height - bar_height))
+            if frames == 0:
+                indexed.info['version'] = b'89a'  # Frame durations need GIF89a
+                header, _ = GifImagePlugin.getheader(indexed, None, {'loop': source.info.get('loop')})
+                fp.write(b''.join(header))
+            fp.write(b''.join(GifImagePlugin.getdata(indexed, include_color_table=True, duration=duration)))
+            frames += 1
+        fp.write(b';')  # GIF trailer
+    return frames
+
+def sample_animation_colors(source, count=ANIMATION_SAMPLE_FRAMES):
+    """
+    Bar colors of an opened animation, read from count frames spread over
+    its first ANIMATION_SAMPLE_SPAN frames rather than the whole file: the
+    per-bar median of those readings, so one frame a re-encode has smeared
+    does not decide it. Returns a list of (R,G,B).
+    """
+    span = min(source.n_frames, ANIMATION_SAMPLE_SPAN)
+    readings = []
+    for index in sorted(set(np.linspace(0, span - 1, count).round().astype(int).tolist())):
+        source.seek(index)
+        readings.append(sample_bar_colors(source.convert('RGB')))
+    means = np.rint(np.median(readings, axis=0)).astype(int)
+    return [tuple(color) for color in means.tolist()]
+
+def process_upload(fp, output_folder, max_pixels=MAX_IMAGE_PIXELS, max_frames=MAX_ANIMATION_FRAMES,
+                   max_animation_pixels=MAX_ANIMATION_PIXELS):
+    """
+    Hash an uploaded image, paint its color bar, check the bar reads back
+    and save the result as output_folder/<color_hash>.jpg.
+    fp is a path, a file object or the raw upload bytes; images over
+    max_pixels, and animations over max_frames or max_animation_pixels,
+    raise ImageTooLarge without being decoded. The bar is
+    painted into the decoded buffer itself, so a request holds one
+    full-size copy of the pixels.
+
+    An animated GIF or WebP is hashed and saved as above from its first
+    frame, and also re-encoded frame by frame, bar on every frame, as
+    output_folder/<color_hash>.gif ('animation' in the result, else None).
+
+    Touches neither the DB nor the in-memory indexes, so it can run in a
+    worker process; the caller stores the hashes. Returns a dict with
+    perceptual_hash, color_hash, color_pattern and verification, plus the
+    image size and per-stage timings (seconds) for metrics.
+    """
+    watch = metrics.Stopwatch()
+    if isinstance(fp, (bytes, bytearray)):
+        fp = io.BytesIO(fp)
+    img, perceptual_hash = decode_upload(fp, max_pixels, max_frames, max_animation_pixels, watch=watch)
+    uuid_colors, color_hash = generate_color_uuid_from_hash(img, None, perceptual_hash)
+    watch.lap('barcode')
+
+    # Create color bar and paste onto the image
+    bar_img = create_color_bar(uuid_colors, img.width, img.height)
+    img.paste(bar_img, (img.width - bar_img.width, img.height - bar_img.height))
+    watch.lap('paint')
+
+    # Verify color bars (optional, but we do it to show success/fail in one step)
+    detected_colors = verify_image_colors(img)
+    _, matches, match_count, required_matches = compare_bar_colors(uuid_colors, detected_colors)
+    watch.lap('verify')
+
+    # Save final result
+    output_path = Path(output_folder) / f"{color_hash}.jpg"
+    img.save(output_path, format="JPEG", quality=JPG_QUALITY)
+    watch.lap('encode')
+
+    animation = None
+    if hasattr(fp, 'seek'):
+        fp.seek(0)
+    with Image.open(fp) as source:
+        if is_animated(source):
+            animation = f"{color_hash}.gif"
+            save_barcoded_gif(source, uuid_colors, Path(output_folder) / animation)
+            watch.lap('animate')
+
+    return {
+        'perceptual_hash': perceptual_hash,
+        'color_hash': color_hash,
+        'color_pattern': uuid_colors,
+        'verification': {
+            'success': bool(match_count >= required_matches),
+            'matches': int(match_count),
+            'total': len(matches),
+            'required': required_matches
+        },
+        'animation': animation,
+        'size': img.size,
+        'timings': watch.timings
+    }
+
+def derivative_filename(color_hash, width, ext):
+    """
+    File name of the width-px derivative of <color_hash>.jpg; ext is 'jpg' or 'webp'.
+    """
+    return f"{color_hash}_{width}.{ext}"
+
+def save_derivatives(img, uuid_colors, color_hash, output_folder):
+    """
+    Save downscaled copies of a barcoded image, one JPEG and one WebP per
+    DERIVATIVE_WIDTHS entry narrower than img. Scaling the painted bar down
+    with the image would leave a few blurred pixels, so each copy gets the
+    bar repainted at its own size, where bar_geometry keeps it readable and
+    it covers the scaled-down original. Returns the widths written.
+    """
+    widths = [width for width in DERIVATIVE_WIDTHS if width < img.width]
+    for width in widths:
+        height = max(1, round(img.height * width / img.width))
+        small = img.resize((width, height), Image.LANCZOS, reducing_gap=3.0)
+        bar_img = create_color_bar(uuid_colors, width, height)
+        small.paste(bar_img, (width - bar_img.width, height - bar_img.height))
+        small.save(Path(output_folder) / derivative_filename(color_hash, width, 'jpg'), format="JPEG", quality=JPG_QUALITY)
+        small.save(Path(output_folder) / derivative_filename(color_hash, width, 'webp'), format="WEBP", quality=WEBP_QUALITY)
+    return widths
+
+def make_derivatives(color_hash, output_folder):
+    """
+    save_derivatives for output_folder/<color_hash>.jpg, as saved by
+    process_upload. Meant for a worker process, off the request path. The
+    JPEG is decoded at the smallest power-of-two scale still wider than
+    the largest derivative.
+    """
+    with Image.open(Path(output_folder) / f"{color_hash}.jpg") as img:
+        largest = max(DERIVATIVE_WIDTHS)
+        img.draft('RGB', (largest, largest * img.height // img.width))
+        return save_derivatives(img.convert('RGB'), decode_url_to_colors(color_hash), color_hash, output_folder)
+
+def color_hash_to_bytes(url_uuid):
+    """
+    Decode a base64 URL-safe color hash into its raw RGB bytes.
+    """
+    return base64.urlsafe_b64decode(url_uuid + '=' * (-len(url_uuid) % 4))
+
+def bytes_to_color_hash(color_bytes):
+    """
+    Base64 URL-safe color hash (no padding) for raw RGB bytes.
+    """
+    return base64.urlsafe_b64encode(color_bytes).decode('ascii').rstrip('=')
+
+def bytes_to_colors(color_bytes):
+    """
+    Split raw RGB bytes, as stored in the DB, into a list of RGB tuples.
+    """
+    return [tuple(color_bytes[i:i + 3]) for i in range(0, len(color_bytes), 3)]
 
 def decode_url_to_colors(url_uuid, palette=None):
     """
@@ -0,0 +1,240 @@
+"""
+In-process metrics in the Prometheus text exposition format, plus an
+opt-in stack sampler for slow requests.
+
+Histograms and counters live in one registry and are rendered by render()
+for a /metrics endpoint. Each process keeps its own numbers: work done in
+pool workers is timed there and observed back in the parent (see
+process_upload's 'timings'), and every app process is scraped on its own.
+"""
+import bisect
+import math
+import os
+import sys
+import threading
+import time
+from collections import Counter as _Tally
+from contextlib import contextmanager
+
+# ─────────────────────────────────────────────────────────
+# Configuration
+# ─────────────────────────────────────────────────────────
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BYTES_BUCKETS = tuple(1024 * 4 ** i for i in range(9))     # 1 KiB .. 64 MiB
+PIXELS_BUCKETS = (64, 128, 256, 512, 1024, 2048, 4096, 8192)  # Longest image side
+PROFILE_INTERVAL = 0.005    # Seconds between stack samples of a profiled request
+PROFILE_MAX_DEPTH = 64      # Innermost frames kept per sample
+
+
+class _Metric:
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def _labels(self, key, extra=()):
+        pairs = list(zip(self.labelnames, key)) + list(extra)
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+class Counter(_Metric):
+    """Monotonic count per label set; name should end in _total."""
+    type = 'counter'
+
+    def __init__(self, name, help, labelnames=()):
+        super().__init__(name, help, labelnames)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        return [f'{self.name}{self._labels(key)} {_number(value)}' for key, value in sorted(values.items())]
+
+
+class Histogram(_Metric):
+    """Cumulative-bucket histogram per label set."""
+    type = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}  # key -> [bucket counts..., +Inf count, sum]
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [0] * (len(self.buckets) + 2)
+            counts[index] += 1
+            counts[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the seconds the block took, also when it raises."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        with self._lock:
+            values = {key: list(counts) for key, counts in self._values.items()}
+        lines = []
+        for key, counts in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{self._labels(key, [("le", _number(bound))])} {cumulative}')
+            lines.append(f'{self.name}_sum{self._labels(key)} {_number(counts[-1])}')
+            lines.append(f'{self.name}_count{self._labels(key)} {cumulative}')
+        return lines
+
+
+class Callback(_Metric):
+    """
+    A gauge or counter read at scrape time: read() returns
+    {label tuple: value}, for numbers another object already keeps.
+    """
+
+    def __init__(self, name, help, read, labelnames=(), type='gauge'):
+        super().__init__(name, help, labelnames)
+        self.read = read
+        self.type = type
+
+    def samples(self):
+        return [f'{self.name}{self._labels(key)} {_number(value)}' for key, value in sorted(self.read().items())]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"metric {metric.name} already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def render(self):
+        """Every metric in the Prometheus text exposition format (version 0.0.4)."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+def counter(name, help, labelnames=()):
+    return registry.register(Counter(name, help, labelnames))
+
+def histogram(name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+    return registry.register(Histogram(name, help, labelnames, buckets))
+
+def callback(name, help, read, labelnames=(), type='gauge'):
+    return registry.register(Callback(name, help, read, labelnames, type))
+
+def render():
+    return registry.render()
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Shared by main.py (pipeline stages, observed from returned timings) and app.py
+stage_seconds = histogram('leviathan_stage_seconds', "Time spent in each image pipeline stage.", ['pipeline', 'stage'])
+db_seconds = histogram('leviathan_db_seconds', "Time spent in each SQLite call.", ['query'])
+
+# ─────────────────────────────────────────────────────────
+# Stage timing
+# ─────────────────────────────────────────────────────────
+
+class Stopwatch:
+    """
+    Accumulate the seconds spent in consecutive named stages. Works in
+    pool workers: the timings dict travels back with the result and is
+    observed with observe_stages() in the parent.
+    """
+
+    def __init__(self):
+        self.timings = {}
+        self._last = time.perf_counter()
+
+    def lap(self, stage):
+        now = time.perf_counter()
+        self.timings[stage] = self.timings.get(stage, 0.0) + now - self._last
+        self._last = now
+
+def observe_stages(timings, pipeline):
+    """Record a Stopwatch's timings under pipeline ('process', 'verify', ...)."""
+    for stage, seconds in timings.items():
+        stage_seconds.observe(seconds, pipeline=pipeline, stage=stage)
+
+# ─────────────────────────────────────────────────────────
+# Sampling profiler
+# ─────────────────────────────────────────────────────────
+
+class StackSampler:
+    """
+    Samples one thread's Python stack every interval seconds from a
+    background thread, tallying them as folded stacks ("outer;inner N",
+    the input of flamegraph.pl and speedscope). Costs nothing for threads
+    that are not being sampled.
+    """
+
+    def __init__(self, thread_id=None, interval=PROFILE_INTERVAL):
+        self.thread_id = thread_id or threading.get_ident()
+        self.interval = interval
+        self.stacks = _Tally()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return self.stacks
+
+    def folded(self):
+        return ''.join(f'{stack} {count}\n' for stack, count in self.stacks.most_common())
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            frames = []
+            while frame is not None and len(frames) < PROFILE_MAX_DEPTH:
+                code = frame.f_code
+                frames.append(f'{os.path.basename(code.co_filename)}:{code.co_name}')
+                frame = frame.f_back
+            if frames:
+                self.stacks[';'.join(reversed(frames))] += 1
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _number(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
@@ -0,0 +1,301 @@
+"""
+Content-addressed store for downloaded firehose blobs.
+
+Blobs live at <root>/<aa>/<bb>/<cid>.png, where aa/bb are the first two
+bytes of blake2b(cid). CIDv1 strings all start with the same multibase and
+codec header, so hashing the CID is what spreads them evenly over the
+65,536 shard directories. An in-memory Bloom filter of every CID ever
+stored (saved to <root>/seen.bloom and reloaded on restart) answers
+"seen before?" without touching disk or network, so reposted memes are
+downloaded once. Evicted blobs stay in the filter: they were already
+processed. When max_bytes is set, the oldest blobs are evicted once the
+store outgrows it.
+
+Blob sizes, oldest first, are appended to <root>/sizes.log as blobs are
+stored and evicted, so a restart replays one file instead of walking and
+statting every shard. The directory is only walked when there is no log
+yet (a store from before it existed).
+"""
+import hashlib
+import math
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict
+
+# ─────────────────────────────────────────────────────────
+# Configuration
+# ─────────────────────────────────────────────────────────
+BLOOM_CAPACITY = 10_000_000  # CIDs the filter is sized for
+BLOOM_ERROR_RATE = 0.0001    # False-positive rate at capacity (a new blob wrongly skipped)
+BLOOM_SAVE_EVERY = 10_000    # Save the filter after this many new CIDs...
+BLOOM_SAVE_INTERVAL = 60.0   # ...or this many seconds, whichever comes first
+EVICT_TO = 0.9               # Evict down to this share of max_bytes
+BLOOM_FILE = "seen.bloom"
+BLOOM_OFFSET_FILE = "seen.bloom.offset"  # Bytes of sizes.log the saved filter covers
+SIZES_LOG = "sizes.log"
+SIZES_LOG_COMPACT = 2        # Rewrite sizes.log on open once it has this many lines per live blob
+BLOB_SUFFIX = ".png"
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over 16-byte key digests, stored as a bytearray."""
+
+    _HEADER = struct.Struct("<4sQIQ")  # magic, bits, hashes, count
+    _MAGIC = b"BLM1"
+
+    def __init__(self, capacity=BLOOM_CAPACITY, error_rate=BLOOM_ERROR_RATE):
+        self.num_bits = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, digest):
+        # Kirsch-Mitzenmacher: k positions from two 64-bit halves of one digest
+        h1, h2 = struct.unpack_from("<QQ", digest)
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def add(self, digest):
+        """Add a key by its 16+ byte digest; False if it was (probably) present already."""
+        new = False
+        for position in self._positions(digest):
+            byte, mask = position >> 3, 1 << (position & 7)
+            if not self.bits[byte] & mask:
+                self.bits[byte] |= mask
+                new = True
+        self.count += new
+        return new
+
+    def __contains__(self, digest):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(digest))
+
+    def save(self, path):
+        tmp = f"{path}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(self._HEADER.pack(self._MAGIC, self.num_bits, self.num_hashes, self.count))
+            f.write(self.bits)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        """The filter saved at path, or None if it is missing or unreadable."""
+        try:
+            with open(path, "rb") as f:
+                magic, num_bits, num_hashes, count = cls._HEADER.unpack(f.read(cls._HEADER.size))
+                bits = bytearray(f.read())
+        except (OSError, struct.error):
+            return None
+        if magic != cls._MAGIC or len(bits) != (num_bits + 7) // 8:
+            return None
+        bloom = cls.__new__(cls)
+        bloom.num_bits, bloom.num_hashes, bloom.bits, bloom.count = num_bits, num_hashes, bits, count
+        return bloom
+
+
+class BlobStore:
+    """
+    Sharded blob directory plus a persisted Bloom filter of seen CIDs.
+
+    seen(cid) is the pre-download check; put(cid, content) stores a blob
+    and marks it seen. Safe to call from several threads. stats counts
+    lookups, dedup hits, bytes written, estimated bytes saved and
+    evictions.
+    """
+
+    def __init__(self, root="images/bluesky", max_bytes=None, capacity=BLOOM_CAPACITY,
+                 error_rate=BLOOM_ERROR_RATE):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.stats = {'lookups': 0, 'hits': 0, 'stored': 0, 'bytes_written': 0, 'bytes_saved': 0, 'evicted': 0}
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()  # Serializes writers of the filter file, not lookups
+        self._sizes = OrderedDict()  # cid -> size, oldest first
+        self._total_bytes = 0
+        self._unsaved = 0
+        self._last_save = time.monotonic()
+        os.makedirs(root, exist_ok=True)
+
+        self._bloom_path = os.path.join(root, BLOOM_FILE)
+        self._offset_path = os.path.join(root, BLOOM_OFFSET_FILE)
+        self._log_path = os.path.join(root, SIZES_LOG)
+        self.bloom = BloomFilter.load(self._bloom_path)
+        if self.bloom is None:
+            self.bloom = BloomFilter(capacity, error_rate)
+            _remove(self._offset_path)
+        self._index()
+
+    def path_for(self, cid):
+        digest = _digest(cid)
+        return os.path.join(self.root, f"{digest[0]:02x}", f"{digest[1]:02x}", cid + BLOB_SUFFIX)
+
+    def seen(self, cid):
+        """Whether cid was stored before (now or in an earlier run); counts dedup hits."""
+        with self._lock:
+            self.stats['lookups'] += 1
+            if _digest(cid) not in self.bloom:
+                return False
+            self.stats['hits'] += 1
+            self.stats['bytes_saved'] += self._sizes.get(cid) or self._average_size()
+            return True
+
+    def put(self, cid, content):
+        """Store a blob under its CID and mark it seen."""
+        path = self.path_for(cid)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(content)
+        os.replace(tmp, path)
+        with self._lock:
+            if cid not in self._sizes:
+                self._total_bytes += len(content)
+            self._sizes[cid] = len(content)
+            self._log.write(f"{cid}\t{len(content)}\n")
+            self.stats['stored'] += 1
+            self.stats['bytes_written'] += len(content)
+            if self.bloom.add(_digest(cid)):
+                self._unsaved += 1
+            evict = self._over_budget()
+            save = self._unsaved >= BLOOM_SAVE_EVERY or (
+                self._unsaved and time.monotonic() - self._last_save >= BLOOM_SAVE_INTERVAL)
+        if evict:
+            self.evict()
+        if save:
+            self.save()
+
+    def evict(self):
+        """Delete the oldest blobs until the store is back under EVICT_TO of max_bytes."""
+        if self.max_bytes is None:
+            return
+        victims = []
+        with self._lock:
+            while self._sizes and self._total_bytes > self.max_bytes * EVICT_TO:
+                cid, size = self._sizes.popitem(last=False)
+                self._total_bytes -= size
+                self._log.write(f"{cid}\t-\n")
+                victims.append(cid)
+            self.stats['evicted'] += len(victims)
+        for cid in victims:
+            try:
+                os.remove(self.path_for(cid))
+            except FileNotFoundError:
+                pass
+
+    def save(self):
+        """
+        Persist the Bloom filter so a restart still knows every CID seen.
+        The write runs outside the lock seen() takes, on the live filter:
+        bits are only ever set, so the file holds at least every CID
+        logged before offset, and the open replays the ones after it.
+        """
+        with self._save_lock:
+            with self._lock:
+                self._log.flush()
+                offset = self._log.tell()
+                self._unsaved = 0
+                self._last_save = time.monotonic()
+            self.bloom.save(self._bloom_path)
+            _write_atomic(self._offset_path, str(offset).encode())
+
+    def close(self):
+        self.save()
+        with self._lock:
+            self._log.close()
+
+    def total_bytes(self):
+        with self._lock:
+            return self._total_bytes
+
+    def _over_budget(self):
+        return self.max_bytes is not None and self._total_bytes > self.max_bytes
+
+    def _average_size(self):
+        return self._total_bytes // len(self._sizes) if self._sizes else 0
+
+    def _index(self):
+        """
+        Load sizes of the blobs on disk, oldest first, for eviction, from
+        sizes.log, and add the CIDs logged after the filter was last saved
+        to it. Without a log, walk the shards once and write one. Flat
+        <root>/<cid>.png files from before sharding are moved into place.
+        """
+        moved = False
+        for entry in os.scandir(self.root):
+            if entry.is_file() and entry.name.endswith(BLOB_SUFFIX):
+                cid = entry.name[:-len(BLOB_SUFFIX)]
+                path = self.path_for(cid)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(entry.path, path)
+                moved = True
+        if moved or not os.path.exists(self._log_path):
+            self._walk()
+        else:
+            self._replay()
+        if self._over_budget():
+            self.evict()
+
+    def _replay(self):
+        try:
+            with open(self._offset_path, "rb") as f:
+                saved = int(f.read())
+        except (OSError, ValueError):
+            saved = 0
+        lines = 0
+        with open(self._log_path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # Torn last write: the blob is downloaded again
+                lines += 1
+                cid, _, size = line[:-1].decode().partition("\t")
+                if size == "-":
+                    self._total_bytes -= self._sizes.pop(cid, 0)
+                    continue
+                if cid not in self._sizes:
+                    self._total_bytes += int(size)
+                self._sizes[cid] = int(size)
+                if f.tell() > saved:
+                    self.bloom.add(_digest(cid))
+        if lines > SIZES_LOG_COMPACT * max(len(self._sizes), 1):
+            self._rewrite_log()
+        else:
+            self._log = open(self._log_path, "a", encoding="utf-8")
+
+    def _walk(self):
+        found = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                if filename.endswith(BLOB_SUFFIX):
+                    stat = os.stat(os.path.join(dirpath, filename))
+                    found.append((stat.st_mtime, filename[:-len(BLOB_SUFFIX)], stat.st_size))
+        found.sort()
+        for _, cid, size in found:
+            self._sizes[cid] = size
+            self._total_bytes += size
+            self.bloom.add(_digest(cid))
+        self._rewrite_log()
+
+    def _rewrite_log(self):
+        """Write sizes.log afresh from the live blobs; the filter holds all of them."""
+        _remove(self._offset_path)  # Offsets into the old log mean nothing in the new one
+        _write_atomic(self._log_path, "".join(f"{cid}\t{size}\n" for cid, size in self._sizes.items()).encode())
+        self._log = open(self._log_path, "a", encoding="utf-8")
+        self.bloom.save(self._bloom_path)
+        _write_atomic(self._offset_path, str(self._log.tell()).encode())
+
+def _digest(cid):
+    return hashlib.blake2b(cid.encode(), digest_size=16).digest()
+
+
+def _write_atomic(path, data):
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
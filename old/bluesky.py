@@ -1,96 +1,119 @@
 import json
 from atproto_client.models import get_or_create
-from atproto import CAR, models
+from atproto import models
 from atproto_firehose import FirehoseSubscribeReposClient, parse_subscribe_repos_message
 from termcolor import colored
 import random
 from multiformats import CID
-import os
-import requests
+from libipld import decode_dag_cbor
+import asyncio
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from main import init_db, load_indexes
+from scanner import BarcodeScanner
+from firehose_filter import IMAGE_EMBED_TYPE, FilterStats, mentions, records_for, wanted_ops
+from blob_store import BlobStore
+from image_pipeline import ImagePipeline
+
+BLOB_STORE_MAX_BYTES = 50 * 1024 ** 3  # Oldest downloaded images are evicted past this
+
+text_stats = FilterStats("text recorder")
+image_stats = FilterStats("image recorder")
 
 def text_recorder(message):
     """Records only text content from Bluesky posts"""
     commit = parse_subscribe_repos_message(message)
     if not isinstance(commit, models.ComAtprotoSyncSubscribeRepos.Commit):
         return
-    car = CAR.from_bytes(commit.blocks)
-    for op in commit.ops:
-        if op.action in ["create"] and op.cid:
-            raw = car.blocks.get(op.cid)
-            if raw.get("$type") == "app.bsky.feed.post":
-                text_content = raw.get("text", "")
-                colors = ['red', 'green', 'yellow', 'blue', 'magenta', 'cyan', 'white']
-                color = random.choice(colors)
-                print(colored(text_content, color))
-                with open("bluesky.txt", "a", encoding="utf-8") as f:
-                    f.write(text_content + "\n")
+    # Skip likes, follows, reposts etc. before decoding any blocks
+    ops = wanted_ops(commit)
+    text_stats.count(skipped=not ops)
+    if not ops:
+        return
+    records = records_for(commit, ops, decode_dag_cbor)
+    for op in ops:
+        raw = records.get(str(op.cid), {})
+        if raw.get("$type") == "app.bsky.feed.post":
+            text_content = raw.get("text", "")
+            colors = ['red', 'green', 'yellow', 'blue', 'magenta', 'cyan', 'white']
+            color = random.choice(colors)
+            print(colored(text_content, color))
+            with open("bluesky.txt", "a", encoding="utf-8") as f:
+                f.write(text_content + "\n")
 
 def image_recorder(message):
-    """Records only image URLs from Bluesky posts"""
+    """Queues image (did, cid, alt) from Bluesky posts for the download pipeline"""
     commit = parse_subscribe_repos_message(message)
     if not isinstance(commit, models.ComAtprotoSyncSubscribeRepos.Commit):
         return
     
-    car = CAR.from_bytes(commit.blocks)
-    for op in commit.ops:
-        if op.action in ["create"] and op.cid:
-            raw = car.blocks.get(op.cid)
+    # Skip everything but post creates with an image embed before decoding any blocks
+    ops = wanted_ops(commit)
+    skipped = not ops or not mentions(commit, IMAGE_EMBED_TYPE)
+    image_stats.count(skipped)
+    if skipped:
+        return
+    records = records_for(commit, ops, decode_dag_cbor)
+    for op in ops:
+        raw = records.get(str(op.cid), {})
+        
+        # Only process posts
+        if raw.get("$type") != "app.bsky.feed.post":
+            continue
+            
+        # Check for images in different possible embed types
+        if "embed" in raw:
+            embed = raw["embed"]
             
-            # Only process posts
-            if raw.get("$type") != "app.bsky.feed.post":
-                continue
-                
-            # Check for images in different possible embed types
-            if "embed" in raw:
-                embed = raw["embed"]
-                
-                # Handle direct image embeds
-                if embed.get("$type") == "app.bsky.embed.images":
-                    for image in embed.get("images", []):
-                        if isinstance(image, dict) and "image" in image:
-                            # Get the image blob
-                            blob = image["image"]
-                            if isinstance(blob, dict) and "ref" in blob:
-                                # Get the DID from the commit
-                                did = commit.repo
-                                
-                                # Get the CID from the blob reference
-                                ref = blob["ref"]
-                                if isinstance(ref, bytes):
-                                    # Convert raw bytes to IPFS CID
-                                    cid = str(CID.decode(ref))
-                                else:
-                                    cid = str(ref)
-                                
-                                # Construct CDN URL
-                                full_url = f"https://cdn.bsky.app/img/feed_fullsize/plain/{did}/{cid}@png"
-                                
-                                alt_text = image.get("alt", "No description provided")
-                                # Truncate the display URL at "png"
-                                display_url = full_url[:full_url.find("@png") + 4]
-                                
-                                # Create images/bluesky directory if it doesn't exist
-                                os.makedirs("images/bluesky", exist_ok=True)
-                                
-                                # Download and save the image
-                                try:
-                                    response = requests.get(full_url)
-                                    if response.status_code == 200:
-                                        # Use CID as filename to ensure uniqueness
-                                        filename = f"images/bluesky/{cid}.png"
-                                        with open(filename, "wb") as f:
-                                            f.write(response.content)
-                                        print(colored(f"Found image: {display_url}", 'green'))
-                                        
-                                        # Still log to the text file
-                                        with open("bluesky_images.txt", "a", encoding="utf-8") as f:
-                                            f.write(f"{full_url}\t{alt_text}\n")
-                                    else:
-                                        print(colored(f"Failed to download image: {display_url}", 'red'))
-                                except Exception as e:
-                                    print(colored(f"Error downloading image: {e}", 'red'))
+            # Handle direct image embeds
+            if embed.get("$type") == "app.bsky.embed.images":
+                for image in embed.get("images", []):
+                    if isinstance(image, dict) and "image" in image:
+                        # Get the image blob
+                        blob = image["image"]
+                        if isinstance(blob, dict) and "ref" in blob:
+                            # Get the CID from the blob reference
+                            ref = blob["ref"]
+                            if isinstance(ref, bytes):
+                                # Convert raw bytes to IPFS CID
+                                cid = str(CID.decode(ref))
+                            else:
+                                cid = str(ref)
+                            
+                            alt_text = image.get("alt", "No description provided")
+                            # Downloading and scanning happen off the firehose thread
+                            pipeline.offer(commit.repo, cid, alt_text, f"at://{commit.repo}/{op.path}")
+
+def report_download(url, ok):
+    # Truncate the display URL at "png"
+    display_url = url[:url.find("@png") + 4]
+    if ok:
+        print(colored(f"Found image: {display_url}", 'green'))
+    else:
+        print(colored(f"Failed to download image: {display_url}", 'red'))
+
+def report_sighting(color_hash, post_uri, image_cid):
+    print(colored(f"Barcode sighting: {color_hash} in {post_uri}", 'magenta'))
+
+scanner = BarcodeScanner(on_sighting=report_sighting)
+store = BlobStore("images/bluesky", max_bytes=BLOB_STORE_MAX_BYTES)
+pipeline = ImagePipeline(store=store, on_result=report_download, on_blob=scanner.scan,
+                         on_duplicate=scanner.seen_again)
 
 if __name__ == "__main__":
     print(colored("Starting Bluesky image recorder...", 'green'))
+    init_db()
+    load_indexes()
     client = FirehoseSubscribeReposClient()
-    client.start(image_recorder)
\ No newline at end of file
+    try:
+        asyncio.run(pipeline.run(lambda: client.start(image_recorder), stop=client.stop))
+    except KeyboardInterrupt:
+        pass
+    scanner.close()
+    store.close()
+    hit_rate = store.stats['hits'] / max(store.stats['lookups'], 1)
+    print(colored(f"Stopped: {pipeline.summary()}, scanner {scanner.stats}", 'yellow'))
+    print(colored(f"Blob store: {hit_rate:.1%} dedup hits, {store.stats['bytes_saved'] / 1e6:,.1f} MB not downloaded", 'yellow'))
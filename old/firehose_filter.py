@@ -0,0 +1,114 @@
+"""
+Cheap pre-filtering of firehose commits before any CAR decoding.
+
+Most commits are likes, follows and reposts. wanted_ops() picks the ops
+worth looking at from commit.ops alone (action and collection path), and
+mentions() checks the raw block bytes for a record $type. DAG-CBOR stores
+strings verbatim, so a commit whose bytes lack "app.bsky.embed.images"
+cannot hold an image post. Only then does records_for() walk the CAR and
+decode just the blocks those ops point at, skipping the MST nodes and
+commit block that CAR.from_bytes decodes as well.
+"""
+import base64
+import time
+
+# ─────────────────────────────────────────────────────────
+# Configuration
+# ─────────────────────────────────────────────────────────
+POST_COLLECTION = "app.bsky.feed.post"
+IMAGE_EMBED_TYPE = "app.bsky.embed.images"
+STATS_INTERVAL = 10.0       # Seconds between events/sec reports
+
+
+def wanted_ops(commit, collection=POST_COLLECTION, action="create"):
+    """The ops of commit that act on a record in collection, without decoding anything."""
+    prefix = collection + "/"
+    return [op for op in commit.ops if op.action == action and op.cid and op.path.startswith(prefix)]
+
+def mentions(commit, record_type):
+    """Whether any block of commit could contain a record of record_type."""
+    return record_type.encode() in commit.blocks
+
+def records_for(commit, ops, decode):
+    """
+    Decode only the blocks the given ops point at. decode turns one raw
+    block into a record (libipld.decode_dag_cbor for real commits).
+    Returns {str(op.cid): record}.
+    """
+    wanted = {_cid_bytes(str(op.cid)): str(op.cid) for op in ops}
+    records = {}
+    for cid, block in iter_car_blocks(commit.blocks):
+        key = wanted.get(cid)
+        if key is not None:
+            records[key] = decode(block)
+            if len(records) == len(wanted):
+                break
+    return records
+
+# ─────────────────────────────────────────────────────────
+# CAR framing
+# ─────────────────────────────────────────────────────────
+
+def iter_car_blocks(data):
+    """
+    Yield (cid_bytes, block) for each block of a CARv1 file without
+    decoding the header or any block.
+    """
+    header_length, pos = _read_varint(data, 0)
+    pos += header_length
+    while pos < len(data):
+        section_length, pos = _read_varint(data, pos)
+        end = pos + section_length
+        cid_end = pos + _cid_length(data, pos)
+        yield bytes(data[pos:cid_end]), data[cid_end:end]
+        pos = end
+
+def _read_varint(data, pos):
+    value = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+def _cid_length(data, pos):
+    """Byte length of the binary CID starting at pos."""
+    if data[pos] == 0x12 and data[pos + 1] == 0x20:
+        return 34  # CIDv0: bare sha2-256 multihash
+    start = pos
+    _, pos = _read_varint(data, pos)  # version
+    _, pos = _read_varint(data, pos)  # content codec
+    _, pos = _read_varint(data, pos)  # multihash code
+    digest_length, pos = _read_varint(data, pos)
+    return pos + digest_length - start
+
+def _cid_bytes(cid):
+    """Binary form of a base32 ('b...') CIDv1 string, as atproto writes them."""
+    encoded = cid[1:].upper()
+    return base64.b32decode(encoded + "=" * (-len(encoded) % 8))
+
+
+class FilterStats:
+    """Events/sec and the share skipped before decoding, reported every interval seconds."""
+
+    def __init__(self, label, interval=STATS_INTERVAL, report=print):
+        self.label = label
+        self.interval = interval
+        self.report = report
+        self.events = self.skipped = 0
+        self._window_events = self._window_skipped = 0
+        self._window_start = time.monotonic()
+
+    def count(self, skipped):
+        self.events += 1
+        self.skipped += skipped
+        self._window_events += 1
+        self._window_skipped += skipped
+        elapsed = time.monotonic() - self._window_start
+        if elapsed >= self.interval:
+            self.report(f"{self.label}: {self._window_events / elapsed:,.0f} events/s, "
+                        f"{self._window_skipped / self._window_events:.1%} skipped before decoding")
+            self._window_events = self._window_skipped = 0
+            self._window_start = time.monotonic()
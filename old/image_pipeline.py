@@ -0,0 +1,198 @@
+"""
+Asyncio ingestion pipeline for images seen on the Bluesky firehose.
+
+The firehose callback only hands (did, cid, alt) to ImagePipeline.offer,
+which never blocks: posts go on a bounded queue and are dropped (and
+counted) if the downloaders fall that far behind. A pool of async download
+workers drains the queue over one keep-alive requests.Session, retrying
+timeouts, connection errors and 429/5xx responses with backoff. A single
+writer task appends to the URL log through one buffered file handle.
+With a BlobStore, CIDs it has seen before are skipped before any network
+call and downloads are stored in it.
+"""
+import asyncio
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# ─────────────────────────────────────────────────────────
+# Configuration
+# ─────────────────────────────────────────────────────────
+CDN_URL = "https://cdn.bsky.app/img/feed_fullsize/plain/{did}/{cid}@png"
+QUEUE_SIZE = 1000           # Posts waiting for a downloader before new ones are dropped
+DOWNLOAD_WORKERS = 32       # Concurrent downloads (and pooled connections)
+DOWNLOAD_TIMEOUT = (3, 10)  # Connect / read timeout in seconds
+DOWNLOAD_RETRIES = 3        # Extra attempts after a timeout, connection error or retryable status
+RETRY_BACKOFF = 0.5         # Seconds before the first retry, doubled each time
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+LOG_FLUSH_LINES = 100       # Flush the URL log after this many lines...
+LOG_FLUSH_INTERVAL = 1.0    # ...or this many seconds, whichever comes first
+LAGS_KEPT = 10000           # Recent offer-to-saved times kept for lag percentiles
+
+
+class ImagePipeline:
+    """
+    Download firehose images concurrently without stalling the firehose.
+
+    Run it with `await pipeline.run(source)`, where source is a blocking
+    callable (e.g. the firehose client's start) that calls
+    pipeline.offer(did, cid, alt, post_uri) from its own thread. When
+    source returns the queue is drained and the log flushed. on_result(url,
+    ok), if given, is called on the event loop after each download, and
+    on_blob(content, post_uri, cid) with the bytes of each downloaded image
+    so it can be scanned without re-reading it from disk. Images are kept
+    in store, if given; a CID already in it is not downloaded again and
+    on_duplicate(post_uri, cid) is called instead. A CID offered again
+    while it is still downloading waits for that download, and gets its
+    on_duplicate right after the download's on_blob.
+    """
+
+    def __init__(self, store=None, log_path="bluesky_images.txt", cdn_url=CDN_URL,
+                 workers=DOWNLOAD_WORKERS, queue_size=QUEUE_SIZE, timeout=DOWNLOAD_TIMEOUT,
+                 retries=DOWNLOAD_RETRIES, on_result=None, on_blob=None, on_duplicate=None):
+        self.store = store
+        self.log_path = log_path
+        self.cdn_url = cdn_url
+        self.workers = workers
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.retries = retries
+        self.on_result = on_result
+        self.on_blob = on_blob
+        self.on_duplicate = on_duplicate
+        self.stats = {'offered': 0, 'dropped': 0, 'duplicates': 0, 'downloaded': 0, 'failed': 0, 'retries': 0}
+        self.lags = deque(maxlen=LAGS_KEPT)
+        self._loop = None
+        self._queue = None
+        self._lines = None
+        self._downloading = {}  # cid -> post_uris offered again while it downloads
+
+    def offer(self, did, cid, alt, post_uri=None):
+        """Queue one image from any thread; never blocks the caller."""
+        self._loop.call_soon_threadsafe(self._enqueue, (did, cid, alt, post_uri, time.perf_counter()))
+
+    def summary(self):
+        """Counters plus p50/p99 offer-to-saved lag in seconds."""
+        lags = sorted(self.lags) or [0.0]
+        return {
+            **self.stats,
+            'queued': self._queue.qsize() if self._queue else 0,
+            'lag_p50': lags[len(lags) // 2],
+            'lag_p99': lags[min(len(lags) - 1, int(len(lags) * 0.99))]
+        }
+
+    async def run(self, source, stop=None):
+        """
+        Run source() in a thread while downloading what it offers. stop(),
+        if given, is called to end source early when run() is cancelled.
+        """
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue(self.queue_size)
+        self._lines = asyncio.Queue()
+
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.workers)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='download')
+        downloaders = [asyncio.create_task(self._download_worker(session, executor)) for _ in range(self.workers)]
+        writer = asyncio.create_task(self._log_writer())
+        try:
+            await self._loop.run_in_executor(None, source)
+        finally:
+            if stop is not None:
+                stop()
+            await self._queue.join()
+            await self._lines.join()
+            for task in downloaders + [writer]:
+                task.cancel()
+            await asyncio.gather(*downloaders, writer, return_exceptions=True)
+            executor.shutdown()
+            session.close()
+
+    def _enqueue(self, item):
+        self.stats['offered'] += 1
+        try:
+            self._queue.put_nowait(item)
+        except asyncio.QueueFull:
+            self.stats['dropped'] += 1
+
+    async def _download_worker(self, session, executor):
+        while True:
+            did, cid, alt, post_uri, offered = await self._queue.get()
+            try:
+                if cid in self._downloading:
+                    self.stats['duplicates'] += 1
+                    self._downloading[cid].append(post_uri)
+                    continue
+                if self.store is not None and self.store.seen(cid):
+                    self.stats['duplicates'] += 1
+                    if self.on_duplicate is not None:
+                        self.on_duplicate(post_uri, cid)
+                    continue
+                url = self.cdn_url.format(did=did, cid=cid)
+                self._downloading[cid] = []
+                try:
+                    content = await self._download(session, executor, url, cid)
+                finally:
+                    reposts = self._downloading.pop(cid)
+                ok = content is not None
+                if ok:
+                    self.stats['downloaded'] += 1
+                    self.lags.append(time.perf_counter() - offered)
+                    self._lines.put_nowait(f"{url}\t{alt}\n")
+                    if self.on_blob is not None:
+                        self.on_blob(content, post_uri, cid)
+                    # After on_blob, so a scanner already has the blob in flight
+                    if self.on_duplicate is not None:
+                        for repost_uri in reposts:
+                            self.on_duplicate(repost_uri, cid)
+                else:
+                    self.stats['failed'] += 1
+                if self.on_result is not None:
+                    self.on_result(url, ok)
+            finally:
+                self._queue.task_done()
+
+    async def _download(self, session, executor, url, cid):
+        for attempt in range(self.retries + 1):
+            if attempt:
+                self.stats['retries'] += 1
+                await asyncio.sleep(RETRY_BACKOFF * 2 ** (attempt - 1))
+            try:
+                status, content = await self._loop.run_in_executor(executor, self._fetch, session, url, cid)
+            except requests.RequestException:
+                continue
+            if status == 200:
+                return content
+            if status not in RETRY_STATUSES:
+                return None
+        return None
+
+    def _fetch(self, session, url, cid):
+        response = session.get(url, timeout=self.timeout)
+        if response.status_code == 200 and self.store is not None:
+            self.store.put(cid, response.content)
+        return response.status_code, response.content
+
+    async def _log_writer(self):
+        with open(self.log_path, "a", encoding="utf-8") as f:
+            unflushed = 0
+            last_flush = time.monotonic()
+            while True:
+                try:
+                    line = await asyncio.wait_for(self._lines.get(), LOG_FLUSH_INTERVAL)
+                except asyncio.TimeoutError:
+                    line = None
+                if line is not None:
+                    f.write(line)
+                    unflushed += 1
+                    self._lines.task_done()
+                if unflushed and (unflushed >= LOG_FLUSH_LINES or self._lines.empty()
+                                  or time.monotonic() - last_flush >= LOG_FLUSH_INTERVAL):
+                    f.flush()
+                    unflushed = 0
+                    last_flush = time.monotonic()
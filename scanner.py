@@ -0,0 +1,190 @@
+"""
+Scan images seen in the wild for our color bars and record sightings.
+
+Blobs are scanned straight from memory on the JobQueue process pool. The
+bottom-right corner is pre-checked first: a registered bar is NUM_BARS
+flat blocks that differ sharply from their neighbours, which almost no
+ordinary image corner is. Only images that pass are hashed and have their
+bar read. Matching against image_hashes happens back in this process,
+where the in-memory indexes live, and each detection is stored in the
+sightings table with the post it came from.
+"""
+import io
+import threading
+
+import numpy as np
+
+import storage
+from jobs import QueueFull, JobQueue
+from main import (
+    NUM_BARS,
+    REQUIRED_MATCH_PERCENT,
+    bar_geometry,
+    bar_interiors,
+    open_upload,
+    decode_rgb,
+    upload_perceptual_hash,
+    ImageTooLarge,
+    verify_image_colors,
+    compare_bar_colors,
+    bytes_to_color_hash,
+    bytes_to_colors,
+    color_hash_to_bytes,
+    find_nearest_color_hash,
+)
+
+# ─────────────────────────────────────────────────────────
+# Configuration
+# ─────────────────────────────────────────────────────────
+PRECHECK_MAX_BAR_STD = 28   # Per-channel std (0-255) a bar interior may have and still count as flat
+PRECHECK_MIN_STEP = 30      # Channel difference that makes two neighbouring bars distinct
+PRECHECK_FLAT_BARS = int(NUM_BARS * REQUIRED_MATCH_PERCENT / 100)
+PRECHECK_DISTINCT_STEPS = (NUM_BARS - 1) // 2
+SCAN_QUEUE_SIZE = 256       # Blobs queued or being scanned before new ones are dropped
+
+
+def bar_precheck(img):
+    """
+    Whether the bottom-right corner of img could hold a color bar: most
+    bar interiors flat, and most neighbouring bars clearly different.
+    Reads only the corner, but an image that is not decoded yet is
+    decoded whole: neither JPEG nor PNG can decode a region, and bars are
+    too narrow (BAR_SIZE_PERCENT of the short side) to survive a
+    reduced-scale decode.
+    """
+    w, h = img.size
+    _, bar_height, total_width = bar_geometry(w, h)
+    if total_width > w or bar_height > h:
+        return False
+    interior = bar_interiors(img).astype(np.float32)
+    if interior.size == 0:
+        return False
+    flat = interior.std(axis=(0, 2)).max(axis=1) <= PRECHECK_MAX_BAR_STD
+    means = interior.mean(axis=(0, 2))
+    steps = np.abs(np.diff(means, axis=0)).max(axis=1) >= PRECHECK_MIN_STEP
+    return flat.sum() >= PRECHECK_FLAT_BARS and steps.sum() >= PRECHECK_DISTINCT_STEPS
+
+def scan_blob(data):
+    """
+    Decode an image blob and, if it passes bar_precheck, return its
+    perceptual_hash and detected bar colors; None otherwise, including for
+    blobs over /process's pixel and frame caps. The blob is decoded once:
+    the precheck, the hash and the colors all read that image, and the
+    hash is computed the way /process computed the registered one.
+    Runs in pool workers, so it touches neither the DB nor the indexes.
+    """
+    fp = io.BytesIO(data)
+    try:
+        img = decode_rgb(open_upload(fp))
+    except ImageTooLarge:
+        return None
+    if not bar_precheck(img):
+        return None
+    return {'perceptual_hash': upload_perceptual_hash(fp, img), 'colors': verify_image_colors(img)}
+
+def match_registered(perceptual_hash, colors):
+    """
+    (color_bytes, matches) for the registered bar the detected colors
+    belong to, or None: the bar registered for this perceptual_hash is
+    tried first, then the nearest registered bar.
+    """
+    candidates = [storage.find_color_hash(storage.perceptual_hash_to_int(perceptual_hash))]
+    nearest = find_nearest_color_hash(colors)
+    if nearest is not None:
+        candidates.append(color_hash_to_bytes(nearest[0]))
+    for color_bytes in candidates:
+        if color_bytes is None:
+            continue
+        _, _, match_count, required_matches = compare_bar_colors(bytes_to_colors(color_bytes), colors)
+        if match_count >= required_matches:
+            return color_bytes, int(match_count)
+    return None
+
+
+class BarcodeScanner:
+    """
+    Feed it blobs with scan(); sightings of registered bars are written to
+    the DB and passed to on_sighting(color_hash, post_uri, image_cid).
+    scan() never blocks: when SCAN_QUEUE_SIZE blobs are already in flight
+    the blob is dropped and counted. A blob seen again while its scan is
+    still in flight has the new post queued on the scan, and gets its
+    sighting once the scan completes. Call load_indexes() first so nearest
+    bar lookups see every registered image.
+    """
+
+    def __init__(self, workers=None, queue_size=SCAN_QUEUE_SIZE, on_sighting=None):
+        self.jobs = JobQueue(max_workers=workers, max_pending=queue_size)
+        self.on_sighting = on_sighting
+        self.stats = {'scanned': 0, 'dropped': 0, 'failed': 0, 'rejected': 0, 'unmatched': 0, 'sightings': 0}
+        self._lock = threading.Lock()
+        self._scanning = {}     # image_cid -> post_uris seen again during its scan
+
+    def scan(self, data, post_uri, image_cid):
+        with self._lock:
+            if image_cid in self._scanning:
+                self._scanning[image_cid].append(post_uri)
+                return
+            self._scanning[image_cid] = []
+        try:
+            self.jobs.submit(scan_blob, data, on_done=lambda result: self._done(result, post_uri, image_cid),
+                             on_error=lambda message: self._failed(image_cid))
+        except QueueFull:
+            self._resolve(image_cid)
+            self._count('dropped')
+
+    def seen_again(self, post_uri, image_cid):
+        """
+        A blob already scanned turned up in another post (the blob store
+        skipped downloading it): record a sighting for the new post if the
+        blob carried a registered bar. While the blob's first scan is still
+        running the post waits for it instead.
+        """
+        with self._lock:
+            if image_cid in self._scanning:
+                self._scanning[image_cid].append(post_uri)
+                return
+        previous = storage.find_sighting(image_cid)
+        if previous is None:
+            return
+        color_bytes, perceptual_hash, matches = previous
+        self._sighting(color_bytes, perceptual_hash, post_uri, image_cid, matches)
+
+    def close(self):
+        self.jobs.shutdown()
+
+    def _done(self, result, post_uri, image_cid):
+        self._count('scanned')
+        match = None
+        if result is None:
+            self._count('rejected')
+        else:
+            match = match_registered(result['perceptual_hash'], result['colors'])
+            if match is None:
+                self._count('unmatched')
+        if match is not None:
+            color_bytes, matches = match
+            perceptual_hash = storage.perceptual_hash_to_int(result['perceptual_hash'])
+            self._sighting(color_bytes, perceptual_hash, post_uri, image_cid, matches)
+        # Only now, so a post seen_again finds either the entry or the sighting
+        for repost_uri in self._resolve(image_cid):
+            if match is not None:
+                self._sighting(color_bytes, perceptual_hash, repost_uri, image_cid, matches)
+
+    def _failed(self, image_cid):
+        self._resolve(image_cid)
+        self._count('failed')
+
+    def _resolve(self, image_cid):
+        """End image_cid's in-flight scan; returns the posts that waited on it."""
+        with self._lock:
+            return self._scanning.pop(image_cid, [])
+
+    def _sighting(self, color_bytes, perceptual_hash, post_uri, image_cid, matches):
+        if storage.insert_sighting(color_bytes, perceptual_hash, post_uri, image_cid, matches):
+            self._count('sightings')
+            if self.on_sighting is not None:
+                self.on_sighting(bytes_to_color_hash(color_bytes), post_uri, image_cid)
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
@@ -0,0 +1,606 @@
+import atexit
+import base64
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+import metrics
+
+# ─────────────────────────────────────────────────────────
+# Configuration
+# ─────────────────────────────────────────────────────────
+DB_PATH = 'images.db'
+BUSY_TIMEOUT_MS = 5000      # How long a writer waits for the lock before "database is locked"
+CACHED_STATEMENTS = 256     # Prepared statements kept per connection
+VIEW_FLUSH_INTERVAL = 1.0   # Seconds between write-behind flushes of query_count
+VIEW_FLUSH_THRESHOLD = 1000 # Pending views that trigger an early flush
+PENDING_LOOKUP_CHUNK = 500  # Buffered keys per user_stats lookup, under SQLite's bound-parameter limit
+
+# Applied to every new connection. WAL lets readers run alongside the
+# single writer; synchronous=NORMAL is durable across application crashes
+# in WAL mode and only loses the last commits on power loss.
+PRAGMAS = (
+    'PRAGMA journal_mode = WAL',
+    'PRAGMA synchronous = NORMAL',
+    f'PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}',
+    'PRAGMA cache_size = -16000',
+    'PRAGMA temp_store = MEMORY',
+    'PRAGMA mmap_size = 134217728',
+)
+
+# ─────────────────────────────────────────────────────────
+# Connections
+# ─────────────────────────────────────────────────────────
+
+class ConnectionPool:
+    """
+    One long-lived sqlite3 connection per thread for a database file.
+
+    Connections are opened in autocommit mode (isolation_level=None), so a
+    single statement commits on its own and multi-statement writes use
+    transaction(). Because a connection outlives the request that opened
+    it, sqlite3's per-connection statement cache means each SQL string
+    below is only prepared once per thread.
+    """
+
+    def __init__(self, path=DB_PATH):
+        self.path = path
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = []
+
+    def connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(
+                self.path,
+                timeout=BUSY_TIMEOUT_MS / 1000,
+                isolation_level=None,
+                cached_statements=CACHED_STATEMENTS,
+                # Only this thread uses it; close_all() may run elsewhere
+                check_same_thread=False,
+            )
+            for pragma in PRAGMAS:
+                conn.execute(pragma)
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def close_all(self):
+        """Close every connection this pool has handed out (e.g. at shutdown)."""
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            conn.close()
+        self._local = threading.local()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    """Return the shared pool, creating it for DB_PATH on first use."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(DB_PATH)
+    return _pool
+
+def use_database(path):
+    """Point the shared pool at another database file (scripts, benchmarks)."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close_all()
+        _pool = ConnectionPool(path)
+    return _pool
+
+def connection():
+    """This thread's connection to the shared database."""
+    return get_pool().connection()
+
+lock_wait_seconds = metrics.histogram('leviathan_db_lock_wait_seconds',
+                                      "Time spent waiting for SQLite's write lock.", ['operation'])
+lock_timeouts = metrics.counter('leviathan_db_lock_timeouts_total',
+                                "Writes that gave up after BUSY_TIMEOUT_MS with SQLITE_BUSY.", ['operation'])
+
+@contextmanager
+def transaction(conn=None, immediate=True, operation='transaction'):
+    """
+    Run a block of statements as one transaction. BEGIN IMMEDIATE takes the
+    write lock up front, so two writers wait on busy_timeout instead of
+    failing half-way through with SQLITE_BUSY on lock upgrade. The wait
+    is recorded per operation in leviathan_db_lock_wait_seconds.
+    """
+    conn = conn or connection()
+    if immediate:
+        start = time.perf_counter()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+        except sqlite3.OperationalError as e:
+            if e.sqlite_errorcode == sqlite3.SQLITE_BUSY:
+                lock_timeouts.inc(operation=operation)
+            raise
+        finally:
+            lock_wait_seconds.observe(time.perf_counter() - start, operation=operation)
+    else:
+        conn.execute('BEGIN')
+    try:
+        yield conn
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+    else:
+        conn.execute('COMMIT')
+
+# ─────────────────────────────────────────────────────────
+# Migrations
+# ─────────────────────────────────────────────────────────
+
+def _add_query_count(conn):
+    """Databases created before view counting lack query_count."""
+    columns = {row[1] for row in conn.execute('PRAGMA table_info(image_hashes)')}
+    if 'query_count' not in columns:
+        conn.execute('ALTER TABLE image_hashes ADD COLUMN query_count INTEGER DEFAULT 0')
+
+def perceptual_hash_to_int(perceptual_hash):
+    """16-digit hex perceptual hash as the signed 64-bit INTEGER it is stored as."""
+    value = int(perceptual_hash, 16)
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+def int_to_perceptual_hash(value):
+    """Stored INTEGER perceptual hash back to its 16-digit hex form."""
+    return format(value & 0xFFFFFFFFFFFFFFFF, '016x')
+
+def _color_hash_to_blob(color_hash):
+    return base64.urlsafe_b64decode(color_hash + '=' * (-len(color_hash) % 4))
+
+def _compact_hashes(conn):
+    """
+    Store perceptual_hash as a signed 64-bit INTEGER and color_hash as its
+    raw RGB bytes (a 36-byte BLOB) instead of 16 hex and 48 base64
+    characters. SQLite cannot change a column's type, so image_hashes and
+    sightings are rebuilt with their rows converted, then re-indexed.
+    """
+    conn.create_function('hash_to_int', 1, perceptual_hash_to_int, deterministic=True)
+    conn.create_function('color_to_blob', 1, _color_hash_to_blob, deterministic=True)
+    conn.execute('''
+        CREATE TABLE image_hashes_compact (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT NOT NULL,
+            perceptual_hash INTEGER NOT NULL,
+            color_hash BLOB NOT NULL,
+            query_count INTEGER DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE(perceptual_hash, color_hash)
+        )
+    ''')
+    conn.execute(
+        'INSERT INTO image_hashes_compact (id, user_id, perceptual_hash, color_hash, query_count, created_at) '
+        'SELECT id, user_id, hash_to_int(perceptual_hash), color_to_blob(color_hash), query_count, created_at '
+        'FROM image_hashes'
+    )
+    conn.execute('''
+        CREATE TABLE sightings_compact (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            color_hash BLOB NOT NULL,
+            perceptual_hash INTEGER NOT NULL,
+            post_uri TEXT NOT NULL,
+            image_cid TEXT NOT NULL,
+            matches INTEGER NOT NULL,
+            seen_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE(post_uri, image_cid)
+        )
+    ''')
+    conn.execute(
+        'INSERT INTO sightings_compact (id, color_hash, perceptual_hash, post_uri, image_cid, matches, seen_at) '
+        'SELECT id, color_to_blob(color_hash), hash_to_int(perceptual_hash), post_uri, image_cid, matches, seen_at '
+        'FROM sightings'
+    )
+    for table in ('image_hashes', 'sightings'):
+        conn.execute(f'DROP TABLE {table}')
+        conn.execute(f'ALTER TABLE {table}_compact RENAME TO {table}')
+    conn.execute('CREATE INDEX idx_image_hashes_color_hash ON image_hashes (color_hash)')
+    conn.execute('CREATE INDEX idx_image_hashes_user_created ON image_hashes (user_id, created_at)')
+    conn.execute('CREATE INDEX idx_sightings_color_hash ON sightings (color_hash, seen_at)')
+    conn.execute('CREATE INDEX idx_sightings_image_cid ON sightings (image_cid)')
+
+# (version, description, SQL statements or a callable taking the connection).
+# Applied in order; the last applied version is kept in PRAGMA user_version.
+# Append new steps only - never edit one that has shipped.
+MIGRATIONS = [
+    (1, 'create image_hashes', [
+        '''
+        CREATE TABLE IF NOT EXISTS image_hashes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT NOT NULL,
+            perceptual_hash TEXT NOT NULL,
+            color_hash TEXT NOT NULL,
+            query_count INTEGER DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE(perceptual_hash, color_hash)
+        )
+        ''',
+    ]),
+    (2, 'add query_count to pre-existing tables', _add_query_count),
+    (3, 'index color_hash lookups and per-user galleries', [
+        'CREATE INDEX IF NOT EXISTS idx_image_hashes_color_hash ON image_hashes (color_hash)',
+        'CREATE INDEX IF NOT EXISTS idx_image_hashes_user_created ON image_hashes (user_id, created_at)',
+    ]),
+    (4, 'record sightings of barcoded images in the wild', [
+        '''
+        CREATE TABLE IF NOT EXISTS sightings (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            color_hash TEXT NOT NULL,
+            perceptual_hash TEXT NOT NULL,
+            post_uri TEXT NOT NULL,
+            image_cid TEXT NOT NULL,
+            matches INTEGER NOT NULL,
+            seen_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE(post_uri, image_cid)
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_sightings_color_hash ON sightings (color_hash, seen_at)',
+    ]),
+    (5, 'look up sightings by image blob', [
+        'CREATE INDEX IF NOT EXISTS idx_sightings_image_cid ON sightings (image_cid)',
+    ]),
+    (6, 'store hashes as INTEGER and BLOB instead of text', _compact_hashes),
+    (7, 'keep per-user gallery stats in a summary table', [
+        '''
+        CREATE TABLE IF NOT EXISTS user_summaries (
+            user_id TEXT PRIMARY KEY,
+            image_count INTEGER NOT NULL DEFAULT 0,
+            query_count INTEGER NOT NULL DEFAULT 0,
+            first_upload TIMESTAMP
+        )
+        ''',
+        '''
+        INSERT OR REPLACE INTO user_summaries (user_id, image_count, query_count, first_upload)
+        SELECT user_id, COUNT(*), COALESCE(SUM(query_count), 0), MIN(created_at)
+        FROM image_hashes GROUP BY user_id
+        ''',
+        # Kept current by the writes themselves, whichever process makes them
+        '''
+        CREATE TRIGGER IF NOT EXISTS user_summaries_insert AFTER INSERT ON image_hashes BEGIN
+            INSERT INTO user_summaries (user_id, image_count, query_count, first_upload)
+            VALUES (NEW.user_id, 1, COALESCE(NEW.query_count, 0), NEW.created_at)
+            ON CONFLICT (user_id) DO UPDATE SET
+                image_count = image_count + 1,
+                query_count = query_count + excluded.query_count,
+                first_upload = MIN(first_upload, excluded.first_upload);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS user_summaries_views AFTER UPDATE OF query_count ON image_hashes BEGIN
+            UPDATE user_summaries
+            SET query_count = query_count + COALESCE(NEW.query_count, 0) - COALESCE(OLD.query_count, 0)
+            WHERE user_id = NEW.user_id;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS user_summaries_delete AFTER DELETE ON image_hashes BEGIN
+            UPDATE user_summaries
+            SET image_count = image_count - 1,
+                query_count = query_count - COALESCE(OLD.query_count, 0),
+                first_upload = (SELECT MIN(created_at) FROM image_hashes WHERE user_id = OLD.user_id)
+            WHERE user_id = OLD.user_id;
+        END
+        ''',
+    ]),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+def schema_version(conn=None):
+    conn = conn or connection()
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+def migrate(conn=None):
+    """
+    Apply every pending migration, each in its own transaction. Safe to
+    call from several processes at once: the version is re-read after the
+    write lock is taken. Returns the resulting schema version.
+    """
+    conn = conn or connection()
+    for version, _, step in MIGRATIONS:
+        if version <= schema_version(conn):
+            continue
+        with transaction(conn, operation='migrate'):
+            if version <= schema_version(conn):
+                continue
+            if callable(step):
+                step(conn)
+            else:
+                for statement in step:
+                    conn.execute(statement)
+            conn.execute(f'PRAGMA user_version = {int(version)}')
+    return schema_version(conn)
+
+# ─────────────────────────────────────────────────────────
+# Write-behind counters
+# ─────────────────────────────────────────────────────────
+
+class WriteBehindCounter:
+    """
+    Buffers per-key increments in memory and applies them in one batched
+    transaction every flush_interval seconds, or as soon as
+    flush_threshold increments are waiting, so counting a page view costs
+    a dict update instead of a commit on SQLite's single writer lock.
+
+    statement is an UPDATE taking (delta, key). The flusher is a daemon
+    thread started on first use; close() (run at exit) stops it and
+    flushes what is left. Increments buffered in another process are not
+    visible here until that process flushes them.
+    """
+
+    def __init__(self, statement, flush_interval=VIEW_FLUSH_INTERVAL, flush_threshold=VIEW_FLUSH_THRESHOLD,
+                 operation='write_behind'):
+        self.statement = statement
+        self.operation = operation
+        self.flush_interval = flush_interval
+        self.flush_threshold = flush_threshold
+        self._pending = {}
+        self._count = 0
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._flushing = False
+        self._generation = 0
+        self._wake = threading.Event()
+        self._thread = None
+        self._closed = False
+
+    def add(self, key, delta=1):
+        with self._lock:
+            self._pending[key] = self._pending.get(key, 0) + delta
+            self._count += delta
+            full = self._count >= self.flush_threshold
+            if self._thread is None and not self._closed:
+                self._thread = threading.Thread(target=self._run, name='write-behind-flush', daemon=True)
+                self._thread.start()
+        if full:
+            self._wake.set()
+
+    def pending(self, key):
+        """Increments for key not yet written to the database."""
+        with self._lock:
+            return self._pending.get(key, 0)
+
+    def pending_items(self):
+        with self._lock:
+            return dict(self._pending)
+
+    def consistent_read(self, read):
+        """
+        Return read(), retried if a flush committed while it ran. A stored
+        value and pending() taken inside read() then count every increment
+        exactly once, which keeps pages read-your-writes accurate.
+        """
+        while True:
+            with self._lock:
+                while self._flushing:
+                    self._idle.wait()
+                generation = self._generation
+            result = read()
+            with self._lock:
+                if not self._flushing and self._generation == generation:
+                    return result
+
+    def flush(self):
+        """Write every pending increment in one transaction. Returns the keys written."""
+        with self._lock:
+            while self._flushing:
+                self._idle.wait()
+            batch, self._pending, self._count = self._pending, {}, 0
+            if not batch:
+                return 0
+            self._flushing = True
+        try:
+            with transaction(operation=self.operation) as conn:
+                conn.executemany(self.statement, [(delta, key) for key, delta in batch.items()])
+        except BaseException:
+            with self._lock:
+                for key, delta in batch.items():
+                    self._pending[key] = self._pending.get(key, 0) + delta
+                    self._count += delta
+            raise
+        finally:
+            with self._lock:
+                self._flushing = False
+                self._generation += 1
+                self._idle.notify_all()
+        return len(batch)
+
+    def close(self):
+        """Stop the flusher thread and write out everything still pending."""
+        with self._lock:
+            self._closed = True
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._wake.set()
+            thread.join()
+        self.flush()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            with self._lock:
+                if self._closed:
+                    return
+            try:
+                self.flush()
+            except sqlite3.Error as e:
+                # Increments stay buffered and are retried on the next interval
+                print(f"query_count flush failed: {e}")
+
+
+view_counts = WriteBehindCounter('UPDATE image_hashes SET query_count = query_count + ? WHERE color_hash = ?',
+                                 operation='flush_views')
+atexit.register(view_counts.close)
+
+# ─────────────────────────────────────────────────────────
+# Queries
+# ─────────────────────────────────────────────────────────
+# Hashes go in and come out in their stored form: perceptual_hash as the
+# int from perceptual_hash_to_int, color_hash as the raw RGB bytes. Hex
+# and URL-safe strings are only made where they are shown.
+
+def insert_image_hash(user_id, perceptual_hash, color_hash):
+    """Insert a (perceptual_hash, color_hash) pair; False if it already exists."""
+    try:
+        # A one-statement transaction, so the wait for the lock is recorded
+        with transaction(operation='insert_image_hash') as conn:
+            conn.execute(
+                'INSERT INTO image_hashes (user_id, perceptual_hash, color_hash) VALUES (?, ?, ?)',
+                (user_id, perceptual_hash, color_hash)
+            )
+        return True
+    except sqlite3.IntegrityError:
+        return False
+
+def insert_image_hashes(user_id, pairs):
+    """
+    Insert several (perceptual_hash, color_hash) pairs in one transaction.
+    Returns one bool per pair: False where the pair already existed.
+    """
+    with transaction(operation='insert_image_hashes') as conn:
+        return [
+            conn.execute(
+                'INSERT OR IGNORE INTO image_hashes (user_id, perceptual_hash, color_hash) VALUES (?, ?, ?)',
+                (user_id, perceptual_hash, color_hash)
+            ).rowcount == 1
+            for perceptual_hash, color_hash in pairs
+        ]
+
+def find_image(perceptual_hash, color_hash):
+    """(user_id, created_at) for an exact pair, or None."""
+    return connection().execute(
+        'SELECT user_id, created_at FROM image_hashes WHERE perceptual_hash = ? AND color_hash = ?',
+        (perceptual_hash, color_hash)
+    ).fetchone()
+
+def find_color_hash(perceptual_hash):
+    """Any color_hash registered for perceptual_hash, or None."""
+    row = connection().execute(
+        'SELECT color_hash FROM image_hashes WHERE perceptual_hash = ?',
+        (perceptual_hash,)
+    ).fetchone()
+    return row[0] if row else None
+
+def record_image_query(color_hash):
+    """
+    Count a view of color_hash and return
+    (user_id, perceptual_hash, created_at, query_count), or None. The count
+    is buffered in view_counts; the returned query_count includes it.
+    """
+    def read():
+        row = connection().execute(
+            'SELECT user_id, perceptual_hash, created_at, query_count FROM image_hashes WHERE color_hash = ?',
+            (color_hash,)
+        ).fetchone()
+        return row, view_counts.pending(color_hash)
+
+    row, pending = view_counts.consistent_read(read)
+    if row is None:
+        return None
+    view_counts.add(color_hash)
+    user_id, perceptual_hash, created_at, query_count = row
+    return user_id, perceptual_hash, created_at, (query_count or 0) + pending + 1
+
+def user_images(user_id, limit, before=None):
+    """
+    Up to limit of user_id's images, newest first, as
+    [(id, color_hash, perceptual_hash, created_at, query_count), ...] with
+    buffered views included in query_count. before is the (created_at, id)
+    of the last row of the previous page: pages are keyset-paginated, so a
+    deep page costs an index seek rather than skipping every row before it.
+    """
+    def read():
+        if before is None:
+            rows = connection().execute(
+                'SELECT id, color_hash, perceptual_hash, created_at, query_count FROM image_hashes '
+                'WHERE user_id = ? ORDER BY created_at DESC, id DESC LIMIT ?',
+                (user_id, limit)
+            ).fetchall()
+        else:
+            rows = connection().execute(
+                'SELECT id, color_hash, perceptual_hash, created_at, query_count FROM image_hashes '
+                'WHERE user_id = ? AND (created_at, id) < (?, ?) ORDER BY created_at DESC, id DESC LIMIT ?',
+                (user_id, *before, limit)
+            ).fetchall()
+        return rows, view_counts.pending_items()
+
+    rows, pending = view_counts.consistent_read(read)
+    return [
+        (image_id, color_hash, perceptual_hash, created_at, (query_count or 0) + pending.get(color_hash, 0))
+        for image_id, color_hash, perceptual_hash, created_at, query_count in rows
+    ]
+
+def user_stats(user_id):
+    """
+    (total_images, total_queries, first_upload) for user_id, including
+    buffered views. Read from user_summaries, which triggers keep current,
+    instead of aggregating the user's rows.
+    """
+    def read():
+        conn = connection()
+        stats = conn.execute(
+            'SELECT image_count, query_count, first_upload FROM user_summaries WHERE user_id = ?',
+            (user_id,)
+        ).fetchone() or (0, None, None)
+        # Which buffered keys are the user's, in one indexed IN lookup per
+        # PENDING_LOOKUP_CHUNK keys, so the cost does not grow with the
+        # size of the user's gallery
+        pending = view_counts.pending_items()
+        keys = list(pending)
+        owned = 0
+        for start in range(0, len(keys), PENDING_LOOKUP_CHUNK):
+            chunk = keys[start:start + PENDING_LOOKUP_CHUNK]
+            placeholders = ', '.join('?' * len(chunk))
+            owned += sum(pending[color_hash] for color_hash, in conn.execute(
+                f'SELECT color_hash FROM image_hashes WHERE user_id = ? AND color_hash IN ({placeholders})',
+                (user_id, *chunk)
+            ))
+        return stats, owned
+
+    (total_images, total_queries, first_upload), pending = view_counts.consistent_read(read)
+    if pending:
+        total_queries = (total_queries or 0) + pending
+    return total_images, total_queries, first_upload
+
+def insert_sighting(color_hash, perceptual_hash, post_uri, image_cid, matches):
+    """Record that a registered bar was seen in a post; False if this image of the post was already recorded."""
+    return connection().execute(
+        'INSERT OR IGNORE INTO sightings (color_hash, perceptual_hash, post_uri, image_cid, matches) '
+        'VALUES (?, ?, ?, ?, ?)',
+        (color_hash, perceptual_hash, post_uri, image_cid, matches)
+    ).rowcount == 1
+
+def find_sighting(image_cid):
+    """(color_hash, perceptual_hash, matches) of an earlier sighting of this image blob, or None."""
+    return connection().execute(
+        'SELECT color_hash, perceptual_hash, matches FROM sightings WHERE image_cid = ? LIMIT 1',
+        (image_cid,)
+    ).fetchone()
+
+def sightings_for(color_hash):
+    """[(post_uri, image_cid, matches, seen_at), ...] for color_hash, newest first."""
+    return connection().execute(
+        'SELECT post_uri, image_cid, matches, seen_at FROM sightings WHERE color_hash = ? ORDER BY seen_at DESC',
+        (color_hash,)
+    ).fetchall()
+
+def image_hashes_since(last_id):
+    """
+    (id, perceptual_hash, color_hash, user_id) of every row with an id above
+    last_id, in id order, for keeping in-memory indexes current. Writers
+    are serialized, so rows become visible in id order.
+    """
+    return connection().execute(
+        'SELECT id, perceptual_hash, color_hash, user_id FROM image_hashes WHERE id > ? ORDER BY id',
+        (last_id,)
+    ).fetchall()
@@ -0,0 +1,26 @@
+"""
+Worker cold start, measured the way a worker pays for it: importing app.py
+in a fresh interpreter from nothing, flask, numpy and PIL included.
+benchmarks/bench_startup.py breaks the same number down.
+"""
+import os
+import statistics
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'benchmarks'))
+
+from bench_startup import ROOT, TOTAL_BUDGET_MS, probe
+
+RUNS = 5
+ENV = {**os.environ, 'AUTH0_DOMAIN': 'auth0.invalid'}
+
+def test_import_app_within_budget():
+    probe(ROOT, (), ENV)  # Compile and cache bytecode before timing
+    total = statistics.median(probe(ROOT, (), ENV)['app'] for _ in range(RUNS)) * 1000
+    assert total <= TOTAL_BUDGET_MS, f"import app takes {total:.1f} ms, over {TOTAL_BUDGET_MS} ms"
+
+def test_import_app_has_no_side_effects():
+    run = probe(ROOT, (), ENV)
+    assert not [name for name in run['files'] if name.startswith('images.db')]
+    assert run['modules'] == []